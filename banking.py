@@ -1,7 +1,152 @@
+import atexit
+import base64
 import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
 import os
+import secrets
+import shutil
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from fractions import Fraction
+
+class Money:
+    # An exact amount held as integer cents. Plain ints are read as whole
+    # dollars, so Money.of(100) is $100.00 and Money(100) is $1.00.
+    __slots__ = ("cents",)
+    def __init__(self, cents=0):
+        self.cents = cents
+
+    @classmethod
+    def parse(cls, text):
+        s = text.strip()
+        sign = -1 if s[:1] == "-" else 1
+        digits = s[1:] if s[:1] in "+-" else s
+        whole, _, frac = digits.partition(".")
+        if (whole or frac) and len(frac) <= 2 and (whole + frac).isdigit() and (whole + frac).isascii():
+            return cls(sign * (int(whole or 0) * 100 + int(frac.ljust(2, "0"))))
+        try:
+            return cls.of(Decimal(s))
+        except InvalidOperation:
+            raise ValueError(f"invalid amount: {text!r}") from None
+
+    @classmethod
+    def of(cls, value):
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, str):
+            return cls.parse(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return cls(value * 100)
+        if isinstance(value, float):
+            value = Decimal(repr(value))
+        if isinstance(value, Decimal):
+            if not value.is_finite():
+                raise ValueError(f"invalid amount: {value!r}")
+            try:
+                return cls(int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+            except InvalidOperation:
+                raise ValueError("invalid amount") from None
+        raise TypeError(f"cannot convert {type(value).__name__} to Money")
+
+    def to_decimal(self):
+        return Decimal(self.cents).scaleb(-2)
+
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        whole, frac = divmod(abs(self.cents), 100)
+        return f"{sign}{whole}.{frac:02d}"
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+    def __format__(self, spec):
+        if spec in ("", ".2f"):
+            return str(self)
+        return format(self.to_decimal(), spec)
+
+    def __float__(self):
+        return self.cents / 100
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __hash__(self):
+        return hash(Fraction(self.cents, 100))
+
+    def __add__(self, other):
+        return Money(self.cents + Money.of(other).cents)
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.of(other).cents)
+
+    def __rsub__(self, other):
+        return Money(Money.of(other).cents - self.cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __eq__(self, other):
+        try:
+            return self.cents == Money.of(other).cents
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    def __lt__(self, other):
+        return self.cents < Money.of(other).cents
+
+    def __le__(self, other):
+        return self.cents <= Money.of(other).cents
+
+    def __gt__(self, other):
+        return self.cents > Money.of(other).cents
+
+    def __ge__(self, other):
+        return self.cents >= Money.of(other).cents
+
+ZERO = Money(0)
+TRANSACTION_LIMIT = Money.of(100)
+OVERDRAFT_FEE = Money.of(35)
+OVERDRAFT_BUFFER = Money.of(65)
+
+PASSWORD_SCHEME = "pbkdf2_sha256"
+DEFAULT_KDF_ITERATIONS = 200000
+
+def hash_password(password, iterations=DEFAULT_KDF_ITERATIONS, salt=None):
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+def is_password_hash(stored):
+    return stored.startswith(PASSWORD_SCHEME + "$")
+
+def password_iterations(stored):
+    return int(stored.split("$")[1]) if is_password_hash(stored) else 0
+
+def verify_password(password, stored):
+    # Rows written before hashing hold plaintext; both paths compare in
+    # constant time.
+    if not is_password_hash(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    _, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate, bytes.fromhex(digest))
 
 class Customer:
+    __slots__ = ("id", "first_name", "last_name", "password", "checking", "savings", "__weakref__")
     def __init__(self, id, first_name, last_name, password, checking=None, savings=None):
         self.id = int(id)
         self.first_name = first_name
@@ -11,134 +156,1308 @@ class Customer:
         self.savings = savings
 
 class Account:
+    # The balance is kept as plain int cents; the balance property wraps it
+    # in Money so callers keep the same attribute API.
+    __slots__ = ("type", "cents", "active", "overdraft_count")
     def __init__(self, type, balance, active=True, overdraft_count=0):
         self.type = type
-        self.balance = float(balance)
+        self.cents = Money.of(balance).cents
         self.active = bool(active)
         self.overdraft_count = int(overdraft_count)
 
+    @property
+    def balance(self):
+        return Money(self.cents)
+
+    @balance.setter
+    def balance(self, value):
+        self.cents = Money.of(value).cents
+
+_open_logs = weakref.WeakSet()
+
+def _bloom_positions(customer_id, bits):
+    data = str(customer_id).encode("utf-8")
+    h1, h2 = zlib.crc32(data), zlib.adler32(data) | 1
+    return [(h1 + i * h2) % bits for i in range(3)]
+
+def _bloom(customer_ids):
+    # A small Bloom filter (about 8 bits per customer, 3 probes) telling
+    # list_for which archived segments can hold a customer's rows.
+    bits = max(64, (8 * len(customer_ids) + 7) // 8 * 8)
+    field = bytearray(bits // 8)
+    for cid in customer_ids:
+        for pos in _bloom_positions(cid, bits):
+            field[pos >> 3] |= 1 << (pos & 7)
+    return base64.b64encode(bytes(field)).decode("ascii")
+
+def _query_match(actions=None, account_type=None, external=None, since=None, until=None,
+                 min_amount=None, max_amount=None):
+    # The row predicate behind TransactionLog.query. account_type matches
+    # the account a row touches (the source side of a transfer), external
+    # picks transfers to other customers, since is inclusive and until
+    # exclusive, and the amount bounds are inclusive.
+    if isinstance(actions, str):
+        actions = actions.split(",")
+    actions = set(actions) if actions else None
+    low = Money.of(min_amount).cents if min_amount not in (None, "") else None
+    high = Money.of(max_amount).cents if max_amount not in (None, "") else None
+    def match(row):
+        if actions is not None and row["action"] not in actions:
+            return False
+        acct = row["account_type"] or ""
+        if account_type and acct != account_type and acct.partition("->")[0] != account_type:
+            return False
+        if external is not None and (":" in acct) != bool(external):
+            return False
+        ts = row["ts"]
+        if (since and not (ts and ts >= since)) or (until and not (ts and ts < until)):
+            return False
+        if low is not None or high is not None:
+            try:
+                cents = Money.parse(row["amount"] or "0").cents
+            except ValueError:
+                return False
+            if (low is not None and cents < low) or (high is not None and cents > high):
+                return False
+        return True
+    return match
+
+@atexit.register
+def _close_open_logs():
+    for log in list(_open_logs):
+        log.close()
+
 class TransactionLog:
+    VERSION = 3
+    QUERY_FILTERS = ("actions", "account_type", "external", "since", "until", "min_amount", "max_amount")
     FIELDS = [
-        "customer_id","action","account_type",
-        "amount","fee","prev_balance","new_balance","status","message"
+        "ts","customer_id","action","account_type",
+        "amount","fee","prev_balance","new_balance","status","message",
+        "idem_key","result"
     ]
-    def __init__(self, csv_path="transactions.csv"):
+    LEGACY_FIELDS = FIELDS[1:10]
+    DURABILITY = ("none", "flush", "fsync")
+    def __init__(self, csv_path="transactions.csv", batch_rows=1, batch_interval=0.0, durability="flush",
+                 segment_bytes=0, segment_seconds=0):
+        # Rows are group-committed once batch_rows are pending or the oldest
+        # pending row is batch_interval seconds old. durability picks what a
+        # commit does: "none" leaves data in the process buffer, "flush" hands
+        # it to the OS, "fsync" also forces it to disk. With segment_bytes or
+        # segment_seconds set, the file is archived as a gzip segment once it
+        # is that big or that old and a new one is started.
+        if durability not in self.DURABILITY:
+            raise ValueError("invalid durability policy")
         self.csv_path = csv_path
+        self.index_path = csv_path + ".idx"
+        self.manifest_path = csv_path + ".manifest"
+        self.segment_bytes = int(segment_bytes)
+        self.segment_seconds = float(segment_seconds)
+        self.batch_rows = max(1, int(batch_rows))
+        self.batch_interval = float(batch_interval)
+        self.durability = durability
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pending_since = 0.0
+        self._timer = None
+        self._fh = None
+        self._idx_fh = None
+        self._load_manifest()
+        self.seq = self.segments[-1]["seq"] + 1 if self.segments else 0
+        self.created = time.time()
         need_header = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
         if need_header:
             with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
-                csv.DictWriter(f, fieldnames=self.FIELDS).writeheader()
+                self._write_preamble(f)
+        self._read_preamble()
+        if self.segments and self.seq <= self.segments[-1]["seq"]:
+            # Archived already, but the process died before starting afresh.
+            self._start_active(self.segments[-1]["seq"] + 1)
+        self._load_index()
+        _open_logs.add(self)
+
+    def _write_preamble(self, f):
+        # "#txlog,<version>,<segment seq>,<created>" then the header.
+        writer = csv.writer(f)
+        writer.writerow(["#txlog", self.VERSION, self.seq, int(self.created)])
+        writer.writerow(self.FIELDS)
+
+    def _read_preamble(self):
+        # Version 1 logs start straight with the header and may hold rows with
+        # an undeclared leading timestamp; version 2+ logs declare both.
+        with open(self.csv_path, "rb") as f:
+            records = self._iter_records(f, 0)
+            first = next(records, (0, b""))[1]
+            values = next(csv.reader([first.decode("utf-8")]), [])
+            if values and values[0] == "#txlog":
+                self.version = int(values[1])
+                if len(values) > 2 and values[2]:
+                    self.seq = int(values[2])
+                if len(values) > 3 and values[3]:
+                    self.created = float(values[3])
+                header = next(records, (0, b""))[1]
+                self.columns = next(csv.reader([header.decode("utf-8")]), [])
+                self._data_start = len(first) + len(header)
+            else:
+                self.version = 1
+                self.columns = values or self.LEGACY_FIELDS
+                self._data_start = len(first)
+
+    def _row_dict(self, values):
+        columns = self.columns
+        if len(values) == len(columns) + 1 and "ts" not in columns:
+            columns = ["ts"] + columns
+        row = dict.fromkeys(self.FIELDS, "")
+        row.update(zip(columns, values))
+        return row
+
+    def _load_index(self):
+        # The sidecar starts with "#idx,<log version>,<data start>" followed
+        # by one "customer_id,offset,length" line per log row.
+        self._offsets = {}
+        self._indexed_to = self._data_start
+        self._index_pos = 0
+        try:
+            self._read_index()
+        except (FileNotFoundError, ValueError):
+            self.rebuild_index()
+            return
+        if self._index_pos == 0 or self._indexed_to > os.path.getsize(self.csv_path):
+            self.rebuild_index()
+        else:
+            self._catch_up()
+
+    def _index_header(self):
+        return f"#idx,{self.version},{self._data_start},{self.seq}\n".encode("utf-8")
+
+    def _read_index(self):
+        # Picks up sidecar lines written since the last read, including ones
+        # appended by other TransactionLog instances on the same file.
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_pos)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if self._index_pos == 0:
+            header = self._index_header()
+            if not data.startswith(header):
+                raise ValueError("stale index")
+            self._index_pos = len(header)
+            data = data[len(header):]
+            end -= len(header)
+        for cid, offset, length in csv.reader(data[:end].decode("utf-8").splitlines()):
+            offset, length = int(offset), int(length)
+            if offset >= self._indexed_to:
+                self._offsets.setdefault(cid, []).append((offset, length))
+                self._indexed_to = offset + length
+        self._index_pos += end
+
+    def rebuild_index(self):
+        self._close_index()
+        self._offsets = {}
+        self._indexed_to = self._data_start
+        header = self._index_header()
+        with open(self.index_path, "wb") as f:
+            f.write(header)
+        self._index_pos = len(header)
+        self._catch_up()
+
+    def migrate(self):
+        # Rewrites a legacy log into the current layout one row at a time.
+        if self.version == self.VERSION and self.columns == self.FIELDS:
+            return False
+        self.flush()
+        self._close_handles()
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as dst:
+            self._write_preamble(dst)
+            writer = csv.writer(dst)
+            for row in self.iter_rows(self._archived_bytes()):
+                writer.writerow([row[k] for k in self.FIELDS])
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.csv_path)
+        self._read_preamble()
+        self.rebuild_index()
+        return True
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.segments = json.load(f)["segments"]
+        except FileNotFoundError:
+            self.segments = []
+        self._blooms = [base64.b64decode(seg["bloom"]) for seg in self.segments]
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segments": self.segments}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _start_active(self, seq):
+        self.seq = seq
+        self.created = time.time()
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            self._write_preamble(f)
+        os.replace(tmp_path, self.csv_path)
+        self._read_preamble()
+
+    def _segment_path(self, seg):
+        return os.path.join(os.path.dirname(self.csv_path), seg["file"])
+
+    def _may_contain(self, i, customer_id):
+        seg = self.segments[i]
+        try:
+            cid = int(customer_id)
+        except (TypeError, ValueError):
+            return True
+        if seg["min_customer"] is None or not seg["min_customer"] <= cid <= seg["max_customer"]:
+            return False
+        bloom = self._blooms[i]
+        return all(bloom[pos >> 3] & (1 << (pos & 7)) for pos in _bloom_positions(cid, len(bloom) * 8))
+
+    def rotate(self):
+        # Archives the active file as <log>.<seq>.gz, records its row count,
+        # customer and time range in the manifest and starts a new file.
+        # Only the process that writes the log may rotate it.
+        with self._lock:
+            self._commit_pending()
+            if os.path.getsize(self.csv_path) <= self._data_start:
+                return False
+            self.migrate()
+            self._close_handles()
+            meta = {"seq": self.seq, "file": f"{os.path.basename(self.csv_path)}.{self.seq:06d}.gz",
+                    "bytes": os.path.getsize(self.csv_path), "rows": 0, "min_customer": None,
+                    "max_customer": None, "min_ts": None, "max_ts": None}
+            customers = set()
+            with open(self.csv_path, "rb") as f:
+                f.seek(self._data_start)
+                for _, raw in self._iter_records(f, self._data_start):
+                    values = next(csv.reader([raw.decode("utf-8")]), [])
+                    if not values:
+                        continue
+                    row = self._row_dict(values)
+                    meta["rows"] += 1
+                    try:
+                        customers.add(int(row["customer_id"]))
+                    except ValueError:
+                        pass
+                    if row["ts"]:
+                        meta["min_ts"] = min(meta["min_ts"] or row["ts"], row["ts"])
+                        meta["max_ts"] = max(meta["max_ts"] or row["ts"], row["ts"])
+            if customers:
+                meta["min_customer"], meta["max_customer"] = min(customers), max(customers)
+            meta["bloom"] = _bloom(customers)
+            seg_path = self._segment_path(meta)
+            with open(self.csv_path, "rb") as src, open(seg_path + ".tmp", "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(seg_path + ".tmp", seg_path)
+            self.segments.append(meta)
+            self._blooms.append(base64.b64decode(meta["bloom"]))
+            self._save_manifest()
+            self._start_active(self.seq + 1)
+            self.rebuild_index()
+            return True
+
+    def _rotation_due(self):
+        if self.segment_bytes and self._indexed_to >= self.segment_bytes:
+            return True
+        return bool(self.segment_seconds) and time.time() - self.created >= self.segment_seconds
+
+    def _segment_records(self, i):
+        # Yields (offset, row) for an archived segment, offsets counted in
+        # its uncompressed bytes.
+        with gzip.open(self._segment_path(self.segments[i]), "rb") as f:
+            records = self._iter_records(f, 0)
+            next(records, None)
+            _, header = next(records, (0, b""))
+            columns = next(csv.reader([header.decode("utf-8")]), [])
+            for offset, raw in records:
+                values = next(csv.reader([raw.decode("utf-8")]), [])
+                if values:
+                    row = dict.fromkeys(self.FIELDS, "")
+                    row.update(zip(columns, values))
+                    yield offset, row
+
+    @staticmethod
+    def _iter_records(f, pos):
+        # Yields (offset, raw bytes) per CSV record, joining quoted newlines.
+        pending = b""
+        start = pos
+        for line in f:
+            pending += line
+            if pending.count(b'"') % 2:
+                continue
+            yield start, pending
+            start += len(pending)
+            pending = b""
+
+    def _catch_up(self):
+        size = os.path.getsize(self.csv_path)
+        if self._indexed_to >= size:
+            return
+        self._read_index()
+        if self._indexed_to >= size:
+            return
+        entries = []
+        with open(self.csv_path, "rb") as f:
+            f.seek(self._indexed_to)
+            for offset, raw in self._iter_records(f, self._indexed_to):
+                if not raw.endswith(b"\n"):
+                    break
+                values = next(csv.reader([raw.decode("utf-8")]), [])
+                if values:
+                    entries.append((str(self._row_dict(values)["customer_id"]), offset, len(raw)))
+                self._indexed_to = offset + len(raw)
+        self._index_entries(entries)
+
+    def _index_entries(self, entries):
+        if not entries:
+            return
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for cid, offset, length in entries:
+            self._offsets.setdefault(cid, []).append((offset, length))
+            writer.writerow([cid, offset, length])
+        data = buf.getvalue().encode("utf-8")
+        if self._idx_fh is None:
+            self._idx_fh = open(self.index_path, "ab")
+        self._idx_fh.write(data)
+        self._idx_fh.flush()
+        self._index_pos += len(data)
+
     def append(self, **kw):
-        row = {k: "" for k in self.FIELDS}
-        row.update(kw)
-        with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
-            csv.DictWriter(f, fieldnames=self.FIELDS).writerow(row)
-    def list_for(self, customer_id, limit=20):
+        self.append_many([kw])
+
+    def append_many(self, rows):
+        ts = datetime.now().isoformat(timespec="seconds")
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        with self._lock:
+            if self.columns != self.FIELDS and any(kw.get("idem_key") for kw in rows):
+                # Older layouts have no idem_key column; upgrade the file
+                # once rather than drop the key.
+                self.migrate()
+            fields = self._write_fields()
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            for kw in rows:
+                row = {k: "" for k in self.FIELDS}
+                row["ts"] = ts
+                row.update(kw)
+                buf.seek(0)
+                buf.truncate()
+                writer.writerow([row[k] for k in fields])
+                self._pending.append((str(row["customer_id"]), buf.getvalue().encode("utf-8")))
+            if len(self._pending) >= self.batch_rows or (
+                    self.batch_interval and time.monotonic() - self._pending_since >= self.batch_interval):
+                self._commit_pending()
+            elif self.batch_interval and self._timer is None:
+                self._timer = threading.Timer(self.batch_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._commit_pending()
+            if self._fh is not None and self.durability == "none":
+                self._fh.flush()
+
+    def _commit_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        self._catch_up()
+        if self._fh is None:
+            self._fh = open(self.csv_path, "ab")
+        offset = self._indexed_to
+        entries = []
+        for cid, chunk in self._pending:
+            entries.append((cid, offset, len(chunk)))
+            offset += len(chunk)
+        self._fh.write(b"".join(chunk for _, chunk in self._pending))
+        if self.durability != "none":
+            self._fh.flush()
+        if self.durability == "fsync":
+            os.fsync(self._fh.fileno())
+        self._pending = []
+        self._indexed_to = offset
+        self._index_entries(entries)
+        if self._rotation_due():
+            self.rotate()
+
+    def _close_index(self):
+        if self._idx_fh is not None:
+            self._idx_fh.close()
+            self._idx_fh = None
+
+    def _close_handles(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self._close_index()
+
+    def close(self):
+        with self._lock:
+            self._commit_pending()
+            self._close_handles()
+
+    def position(self):
+        # Offset just past the last committed row, counting archived
+        # segments' bytes first, so positions stay valid across rotations;
+        # iter_rows(start) resumes reading from there.
+        with self._lock:
+            self._commit_pending()
+            self._catch_up()
+            return self._archived_bytes() + self._indexed_to
+
+    def _archived_bytes(self):
+        return sum(seg["bytes"] for seg in self.segments)
+
+    def iter_rows(self, start=None):
+        self.flush()
+        start = start or 0
+        base = 0
+        for i, seg in enumerate(self.segments):
+            if start < base + seg["bytes"]:
+                for offset, row in self._segment_records(i):
+                    if base + offset >= start:
+                        yield row
+            base += seg["bytes"]
+        start = max(self._data_start, start - base)
+        with open(self.csv_path, "rb") as f:
+            f.seek(start)
+            for _, raw in self._iter_records(f, start):
+                values = next(csv.reader([raw.decode("utf-8")]), [])
+                if values:
+                    yield self._row_dict(values)
+
+    def iter_since(self, since):
+        # Rows stamped at or after the ISO timestamp since, oldest first.
+        # Segments ending earlier are skipped unopened, and in the active
+        # file the leading timestamp is compared before a row is parsed.
+        self.flush()
+        for i, seg in enumerate(self.segments):
+            if seg["max_ts"] is None or seg["max_ts"] >= since:
+                for _, row in self._segment_records(i):
+                    if row["ts"] >= since:
+                        yield row
+        prefix = since.encode("utf-8")
+        ts_first = self.columns[:1] == ["ts"]
+        with open(self.csv_path, "rb") as f:
+            f.seek(self._data_start)
+            for _, raw in self._iter_records(f, self._data_start):
+                if ts_first and raw[:len(prefix)] < prefix:
+                    continue
+                values = next(csv.reader([raw.decode("utf-8")]), [])
+                if values:
+                    row = self._row_dict(values)
+                    if row["ts"] >= since:
+                        yield row
+
+    def _write_fields(self):
+        # Legacy logs get rows with a leading timestamp, the layout their
+        # existing rows already use; newer logs follow their own header.
+        if "ts" not in self.columns:
+            return ["ts"] + self.columns
+        return self.columns
+
+    def list_for(self, customer_id, limit=20, match=None):
+        # The customer's last `limit` rows (all when 0) passing match, oldest
+        # first. The active file is read through the index; archived
+        # segments are opened newest first, only when their customer range
+        # and Bloom filter allow a hit, until limit is met.
+        with self._lock:
+            self._commit_pending()
+            try:
+                self._catch_up()
+                entries = self._offsets.get(str(customer_id), [])
+                if limit and match is None:
+                    entries = entries[-limit:]
+                if entries and self._fh is not None:
+                    self._fh.flush()
+                rows = []
+                with open(self.csv_path, "rb") as f:
+                    for offset, length in entries:
+                        f.seek(offset)
+                        values = next(csv.reader([f.read(length).decode("utf-8")]), [])
+                        row = self._row_dict(values)
+                        if match is None or match(row):
+                            rows.append(row)
+            except FileNotFoundError:
+                rows = []
+            cid = str(customer_id)
+            for i in range(len(self.segments) - 1, -1, -1):
+                if limit and len(rows) >= limit:
+                    break
+                if self._may_contain(i, customer_id):
+                    rows[:0] = [row for _, row in self._segment_records(i)
+                                if row["customer_id"] == cid and (match is None or match(row))]
+            return rows[-limit:] if limit else rows
+
+    def query(self, customer_id, actions=None, account_type=None, external=None, since=None, until=None,
+              min_amount=None, max_amount=None, cursor=None, page_size=20):
+        # One page of the customer's rows passing the filters, newest first,
+        # and the cursor for the next (older) page, or None after the last.
+        # Rows are filtered as they are read: the active file through the
+        # index, then archived segments newest first, skipping those whose
+        # Bloom filter or time range rules them out. A cursor is the logical
+        # position of the last row returned.
+        match = _query_match(actions, account_type, external, since, until, min_amount, max_amount)
+        end = int(cursor) if cursor not in (None, "") else None
+        cid = str(customer_id)
+        rows = []
+        with self._lock:
+            self._commit_pending()
+            base = self._archived_bytes()
+            try:
+                self._catch_up()
+                entries = self._offsets.get(cid, [])
+                if entries and self._fh is not None:
+                    self._fh.flush()
+                with open(self.csv_path, "rb") as f:
+                    for offset, length in reversed(entries):
+                        if end is not None and base + offset >= end:
+                            continue
+                        f.seek(offset)
+                        row = self._row_dict(next(csv.reader([f.read(length).decode("utf-8")]), []))
+                        if match(row):
+                            rows.append(row)
+                            if page_size and len(rows) >= page_size:
+                                return rows, base + offset
+            except FileNotFoundError:
+                pass
+            for i in range(len(self.segments) - 1, -1, -1):
+                seg = self.segments[i]
+                base -= seg["bytes"]
+                if end is not None and base >= end:
+                    continue
+                if ((since and seg["max_ts"] and seg["max_ts"] < since)
+                        or (until and seg["min_ts"] and seg["min_ts"] >= until)
+                        or not self._may_contain(i, customer_id)):
+                    continue
+                hits = [(base + offset, row) for offset, row in self._segment_records(i)
+                        if row["customer_id"] == cid and (end is None or base + offset < end) and match(row)]
+                for pos, row in reversed(hits):
+                    rows.append(row)
+                    if page_size and len(rows) >= page_size:
+                        return rows, pos
+        return rows, None
+
+class _Txn:
+    # Collects the customers to persist and the log rows produced by one or
+    # more operations so they can be written together.
+    __slots__ = ("touched", "rows", "saves", "span")
+    def __init__(self, span=None):
+        self.touched = {}
+        self.rows = []
+        self.saves = 0
+        self.span = span
+
+    def mark(self, phase):
+        if self.span is not None:
+            self.span.mark(phase)
+
+    def save(self, *customers):
+        for c in customers:
+            self.touched[c.id] = c
+        self.saves += 1
+
+    def log(self, **kw):
+        self.rows.append(kw)
+
+class Aggregates:
+    # Running totals fed by every committed log row: [count, cents] per
+    # customer and bank-wide under "action:account_type" keys (transfers
+    # count as transfer_out/transfer_in), plus bank-wide balances.
+    def __init__(self, data=None):
+        data = data or {}
+        self.customers = {int(cid): totals for cid, totals in data.get("customers", {}).items()}
+        self.bank = data.get("bank", {})
+        self.balances = {"checking": 0, "savings": 0}
+        self.balances.update(data.get("balances", {}))
+
+    def to_dict(self):
+        return {"customers": self.customers, "bank": self.bank, "balances": self.balances}
+
+    def _count(self, customer_id, key, cents):
+        for totals in (self.customers.setdefault(customer_id, {}), self.bank):
+            entry = totals.setdefault(key, [0, 0])
+            entry[0] += 1
+            entry[1] += cents
+
+    def add_row(self, row):
+        try:
+            cid = int(row["customer_id"])
+            amount = Money.parse(row.get("amount") or "0").cents
+            fee = Money.parse(row.get("fee") or "0").cents
+        except (KeyError, TypeError, ValueError):
+            return
+        action = row.get("action") or ""
+        account_type = str(row.get("account_type") or "")
+        if row.get("status") != "ok":
+            self._count(cid, "rejected:" + action, amount)
+            return
+        if action == "transfer":
+            src, _, dst = account_type.partition("->")
+            target, _, dst_type = dst.rpartition(":")
+            target, _, shard = target.partition("@")
+            self._count(cid, "transfer_out:" + src, amount)
+            self.balances[src] = self.balances.get(src, 0) - amount
+            # A target on another shard is credited by that shard's
+            # transfer_in row.
+            if not shard:
+                self._count(int(target) if target else cid, "transfer_in:" + dst_type, amount)
+                self.balances[dst_type] = self.balances.get(dst_type, 0) + amount
+        else:
+            self._count(cid, f"{action}:{account_type}", amount)
+            try:
+                delta = Money.parse(row["new_balance"]).cents - Money.parse(row["prev_balance"]).cents
+            except (KeyError, TypeError, ValueError):
+                delta = 0
+            self.balances[account_type] = self.balances.get(account_type, 0) + delta
+        if fee:
+            self._count(cid, "overdraft_fee", fee)
+
+    def _format(self, totals):
+        return {key: {"count": n, "total": str(Money(cents))} for key, (n, cents) in sorted(totals.items())}
+
+    def customer_summary(self, customer_id):
+        return self._format(self.customers.get(customer_id, {}))
+
+    def bank_summary(self):
+        return {
+            "activity": self._format(self.bank),
+            "balances": {t: str(Money(c)) for t, c in sorted(self.balances.items())},
+            "liabilities": str(Money(sum(self.balances.values()))),
+        }
+
+class IdempotencyCache:
+    # Results of keyed money movements by (customer id, key), kept for ttl
+    # seconds and at most max_size entries, oldest dropped first. Repeats
+    # of a key get the stored result without running the operation again.
+    def __init__(self, ttl=86400, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, customer_id, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get((customer_id, key))
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[(customer_id, key)]
+                return None
+            return entry[1]
+
+    def put(self, customer_id, key, result, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[(customer_id, key)] = (now + self.ttl, result)
+            self._entries.move_to_end((customer_id, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            while self._entries:
+                expires, _ = next(iter(self._entries.values()))
+                if expires > now:
+                    break
+                self._entries.popitem(last=False)
+
+    def rebuild(self, log, now=None):
+        # Reloads the keys logged within the last ttl seconds.
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries = OrderedDict()
+        since = datetime.fromtimestamp(now - self.ttl).isoformat(timespec="seconds")
+        for row in log.iter_since(since):
+            if row.get("idem_key"):
+                try:
+                    cid = int(row["customer_id"])
+                    stamp = datetime.fromisoformat(row["ts"]).timestamp()
+                except (TypeError, ValueError):
+                    continue
+                if stamp + self.ttl > now:
+                    self.put(cid, row["idem_key"], row.get("result") or "", stamp)
+
+class Session:
+    # A logged-in customer handle. Unlike BankSystem.login it leaves
+    # bank.current alone, so many sessions can share one BankSystem.
+    def __init__(self, bank, customer):
+        self.bank = bank
+        self.customer = customer
+
+    def deposit(self, account_type, amount, idempotency_key=None):
+        return self.bank._run(self.bank._deposit, self.customer, account_type, amount, key=idempotency_key)
+
+    def withdraw(self, account_type, amount, idempotency_key=None):
+        return self.bank._run(self.bank._withdraw, self.customer, account_type, amount, key=idempotency_key)
+
+    def transfer(self, from_type, to_type, amount, target_customer_id=None, target_account_type=None,
+                 idempotency_key=None):
+        return self.bank._run(self.bank._transfer, self.customer, from_type, to_type, amount,
+                              target_customer_id, target_account_type,
+                              lock_ids=self.bank._target_ids(target_customer_id), key=idempotency_key)
+
+    def create_account(self, account_type, initial_balance=ZERO):
+        return self.bank._create_account(self.customer, account_type, initial_balance)
+
+    def accounts(self):
+        with self.bank._locked(self.customer.id):
+            c = self.customer
+            return {
+                t: {"balance": str(acc.balance), "active": acc.active, "overdrafts": acc.overdraft_count}
+                for t, acc in (("checking", c.checking), ("savings", c.savings)) if acc
+            }
+
+    def recent_transactions(self, limit=20, match=None):
+        with self.bank._io_lock:
+            return self.bank.log.list_for(self.customer.id, limit=limit, match=match)
+
+    def query_transactions(self, **filters):
+        # (rows newest first, next cursor); see TransactionLog.query.
+        with self.bank._io_lock:
+            return self.bank.log.query(self.customer.id, **filters)
+
+    def summary(self):
+        return self.bank.customer_summary(self.customer.id)
+
+class BankStore:
+    # Where customers and their log live. Customers cross this boundary as
+    # value lists in FIELDS order going in, and as dicts keyed by FIELDS
+    # coming out; log rows are the TransactionLog keyword dicts.
+    FIELDS = [
+        "id","first_name","last_name","password",
+        "checking_balance","checking_active","checking_overdrafts",
+        "savings_balance","savings_active","savings_overdrafts"
+    ]
+    needs_checkpoint = False
+    log = None
+
+    def iter_rows(self):
+        raise NotImplementedError
+
+    def iter_customers(self, from_row):
+        # Customers for an eager load. Stores holding typed values may
+        # override this to skip formatting them as strings first.
+        return map(from_row, self.iter_rows())
+
+    def commit(self, rows, log_rows, span=None):
+        # Persists changed customers plus their log rows as one unit and
+        # returns True when the caller should write a full snapshot. span,
+        # when given, gets a mark after each write.
+        raise NotImplementedError
+
+    def write_snapshot(self, rows):
+        raise NotImplementedError
+
+    # Lazy BankSystems fetch single customers instead of loading them all.
+    def build_index(self):
+        raise NotImplementedError
+
+    def get_row(self, customer_id):
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def max_id(self):
+        raise NotImplementedError
+
+    # Saved aggregates are optional; None means rebuild them from scratch.
+    def load_aggregates(self):
+        return None
+
+    def save_aggregates(self, data):
+        pass
+
+    def close(self):
+        self.log.close()
+
+class CsvStore(BankStore):
+    # bank.csv snapshot plus an fsync'd journal of changed rows, with the
+    # transaction log in its own CSV file.
+    def __init__(self, csv_path, log_path="transactions.csv", checkpoint_every=1000, log=None):
+        self.csv_path = csv_path
+        self.journal_path = csv_path + ".journal"
+        self.aggregates_path = csv_path + ".agg"
+        self.checkpoint_every = checkpoint_every
+        self.log = log if log is not None else TransactionLog(log_path)
+        self._journal = None
+        self._journal_rows = 0
+        self._offsets = None
+        self._overlay = {}
+
+    def build_index(self):
+        # Maps customer id -> (offset, length) of its bank.csv row and keeps
+        # journal rows in memory until the next snapshot folds them in.
+        journal, self.needs_checkpoint = self._read_journal()
+        self._journal_rows = len(journal)
+        self._overlay = {int(row["id"]): row for row in journal}
+        self._offsets = {}
+        try:
+            with open(self.csv_path, "rb") as f:
+                # Records, not lines: quoted fields may hold newlines.
+                records = TransactionLog._iter_records(f, 0)
+                next(records, None)
+                for offset, raw in records:
+                    cid = raw.split(b",", 1)[0]
+                    if cid.strip():
+                        self._offsets[int(cid)] = (offset, len(raw))
+        except FileNotFoundError:
+            pass
+
+    def get_row(self, customer_id):
+        row = self._overlay.get(customer_id)
+        if row is not None or customer_id not in self._offsets:
+            return row
+        offset, length = self._offsets[customer_id]
+        with open(self.csv_path, "rb") as f:
+            f.seek(offset)
+            values = next(csv.reader([f.read(length).decode("utf-8")]))
+        return dict(zip(self.FIELDS, values))
+
+    def ids(self):
+        return list(self._offsets) + [cid for cid in self._overlay if cid not in self._offsets]
+
+    def max_id(self):
+        return max(max(self._offsets, default=0), max(self._overlay, default=0))
+
+    def load_aggregates(self):
+        try:
+            with open(self.aggregates_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_aggregates(self, data):
+        if data is None:
+            if os.path.exists(self.aggregates_path):
+                os.remove(self.aggregates_path)
+            return
+        tmp_path = self.aggregates_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.aggregates_path)
+
+    def _read_journal(self):
+        rows = []
+        try:
+            f = open(self.journal_path, newline="", encoding="utf-8")
+        except FileNotFoundError:
+            return rows, False
+        with f:
+            for values in csv.reader(f):
+                if len(values) != len(self.FIELDS) + 1 or values[-1] != str(zlib.crc32(",".join(values[:-1]).encode("utf-8"))):
+                    return rows, True
+                rows.append(dict(zip(self.FIELDS, values)))
+        return rows, False
+
+    def iter_rows(self):
+        # Streams bank.csv with the journal applied, in bounded memory. A
+        # torn journal tail is skipped and flagged via needs_checkpoint.
+        journal, self.needs_checkpoint = self._read_journal()
+        self._journal_rows = len(journal)
+        overlay = {}
+        for row in journal:
+            overlay[row["id"]] = row
         try:
             with open(self.csv_path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                rows = [r for r in reader if str(r.get("customer_id")) == str(customer_id)]
-                return rows[-limit:] if limit else rows
+                for row in csv.DictReader(f):
+                    yield overlay.pop(row["id"], row)
         except FileNotFoundError:
-            return []
+            pass
+        yield from overlay.values()
+
+    def commit(self, rows, log_rows, span=None):
+        if rows:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for values in rows:
+                writer.writerow(values + [zlib.crc32(",".join(values).encode("utf-8"))])
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a", newline="", encoding="utf-8")
+            self._journal.write(buf.getvalue())
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_rows += len(rows)
+            if self._offsets is not None:
+                for values in rows:
+                    self._overlay[int(values[0])] = dict(zip(self.FIELDS, values))
+            if span is not None:
+                span.mark("journal")
+        if log_rows:
+            self.log.append_many(log_rows)
+            if span is not None:
+                span.mark("log")
+        return self._journal_rows >= self.checkpoint_every
+
+    def write_snapshot(self, rows):
+        # Atomically replaces bank.csv with rows and empties the journal
+        # they supersede.
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.FIELDS)
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "w", newline="", encoding="utf-8")
+        self._journal_rows = 0
+        self.needs_checkpoint = False
+        if self._offsets is not None:
+            self.build_index()
+
+    def close(self):
+        self.log.close()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+BINARY_SUFFIXES = (".bin",)
+
+def open_store(path, log_path="transactions.csv", checkpoint_every=1000, log=None):
+    if path.endswith(SQLITE_SUFFIXES):
+        from sqlite_store import SqliteStore
+        return SqliteStore(path)
+    if path.endswith(BINARY_SUFFIXES):
+        from binstore import BinaryStore
+        return BinaryStore(path, log_path, checkpoint_every, log)
+    return CsvStore(path, log_path, checkpoint_every, log)
 
 class BankSystem:
-    def __init__(self, csv_path, log_path="transactions.csv"):
+    FIELDS = BankStore.FIELDS
+    def __init__(self, csv_path, log_path="transactions.csv", checkpoint_every=1000, log=None, store=None,
+                 kdf_iterations=DEFAULT_KDF_ITERATIONS, credential_cache_size=1024, token_ttl=900,
+                 lazy=False, cache_size=10000, metrics=None, limits=None, idempotency_ttl=86400,
+                 idempotency_cache_size=100000):
+        # In lazy mode customers are read from the store on first access and
+        # kept in a bounded LRU. Changes are written through the store on
+        # every commit, so evicting an entry never loses anything.
         self.csv_path = csv_path
+        self.store = store if store is not None else open_store(csv_path, log_path, checkpoint_every, log)
+        self.log = self.store.log
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self._live = weakref.WeakValueDictionary()
+        self._cache_lock = threading.RLock()
+        self.aggregates = Aggregates()
+        self.metrics = metrics
+        # Optional limits.VelocityLimits, checked on withdrawals and
+        # external transfers and rebuilt from the log tail on load.
+        self.limits = limits
+        self.idempotency = IdempotencyCache(idempotency_ttl, idempotency_cache_size)
         self.customers = []
         self.current = None
-        self.log = TransactionLog(log_path)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._io_lock = threading.Lock()
+        # Verified logins are remembered as keyed digests so repeat logins
+        # skip the KDF; tokens let a session resume without the password.
+        self.kdf_iterations = kdf_iterations
+        self.credential_cache_size = credential_cache_size
+        self.token_ttl = token_ttl
+        self._credential_key = os.urandom(32)
+        self._credentials = OrderedDict()
+        self._tokens = OrderedDict()
+        self._auth_lock = threading.Lock()
 
-    def load_from_csv(self):
-        self.customers = []
+    @property
+    def customers(self):
+        if self.lazy:
+            return [self.get_customer(cid) for cid in self.store.ids()]
+        return self._customers
+
+    @customers.setter
+    def customers(self, customers):
+        self._customers = customers
+        self._by_id = OrderedDict() if self.lazy else {}
+        self._next_id = 10001
+        for c in customers:
+            self._index_customer(c)
+
+    def _index_customer(self, c):
+        if self.lazy:
+            with self._cache_lock:
+                self._live[c.id] = c
+                self._by_id[c.id] = c
+                self._by_id.move_to_end(c.id)
+                while len(self._by_id) > self.cache_size:
+                    self._by_id.popitem(last=False)
+        else:
+            self._by_id[c.id] = c
+        if c.id >= self._next_id:
+            self._next_id = c.id + 1
+
+    def get_customer(self, customer_id):
         try:
-            with open(self.csv_path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    chk_bal = row.get("checking_balance") or ""
-                    chk_act = row.get("checking_active") or ""
-                    chk_odc = row.get("checking_overdrafts") or ""
-                    sav_bal = row.get("savings_balance") or ""
-                    sav_act = row.get("savings_active") or ""
-                    sav_odc = row.get("savings_overdrafts") or ""
-                    checking = None
-                    savings = None
-                    if chk_bal != "":
-                        checking = Account("checking", float(chk_bal), (chk_act == "True"), int(chk_odc or 0))
-                    if sav_bal != "":
-                        savings = Account("savings", float(sav_bal), (sav_act == "True"), int(sav_odc or 0))
-                    c = Customer(int(row["id"]), row["first_name"], row["last_name"], row["password"], checking, savings)
-                    self.customers.append(c)
-        except FileNotFoundError:
+            cid = int(customer_id)
+        except (TypeError, ValueError):
+            return None
+        if not self.lazy:
+            return self._by_id.get(cid)
+        with self._cache_lock:
+            c = self._by_id.get(cid)
+            if c is not None:
+                self._by_id.move_to_end(cid)
+                return c
+            # A customer evicted from the LRU may still be held by a session;
+            # reuse that object so there is only ever one copy in memory.
+            c = self._live.get(cid)
+            if c is None:
+                row = self.store.get_row(cid)
+                if row is None:
+                    return None
+                c = self._customer_from_row(row)
+            self._index_customer(c)
+            return c
+
+    def _customer_from_row(self, row):
+        chk_bal = row.get("checking_balance") or ""
+        chk_act = row.get("checking_active") or ""
+        chk_odc = row.get("checking_overdrafts") or ""
+        sav_bal = row.get("savings_balance") or ""
+        sav_act = row.get("savings_active") or ""
+        sav_odc = row.get("savings_overdrafts") or ""
+        checking = None
+        savings = None
+        if chk_bal != "":
+            checking = Account("checking", Money.parse(chk_bal), (chk_act == "True"), int(chk_odc or 0))
+        if sav_bal != "":
+            savings = Account("savings", Money.parse(sav_bal), (sav_act == "True"), int(sav_odc or 0))
+        return Customer(int(row["id"]), row["first_name"], row["last_name"], row["password"], checking, savings)
+
+    def _row_values(self, c):
+        return [
+            str(c.id), c.first_name, c.last_name, c.password,
+            str(c.checking.balance) if c.checking else "",
+            str(c.checking.active) if c.checking else "",
+            str(c.checking.overdraft_count) if c.checking else "",
+            str(c.savings.balance) if c.savings else "",
+            str(c.savings.active) if c.savings else "",
+            str(c.savings.overdraft_count) if c.savings else "",
+        ]
+
+    def load_from_csv(self):
+        if self.lazy:
+            self.store.build_index()
             self.customers = []
+            self._next_id = max(10001, self.store.max_id() + 1)
+        else:
+            self.customers = list(self.store.iter_customers(self._customer_from_row))
+        needs_checkpoint = self.store.needs_checkpoint
+        self._load_aggregates()
+        if self.limits is not None:
+            self.limits.rebuild(self.log)
+        self.idempotency.rebuild(self.log)
+        if needs_checkpoint:
+            self.save_all_to_csv()
+
+    def _load_aggregates(self):
+        # Aggregates saved at the last checkpoint are caught up from the log
+        # rows written since; without usable ones they are rebuilt.
+        data = self.store.load_aggregates()
+        if (not data or data.get("log_version") != getattr(self.log, "version", None)
+                or data.get("position", 0) > self.log.position()):
+            self.rebuild_aggregates()
+            return
+        self.aggregates = Aggregates(data)
+        for row in self.log.iter_rows(data["position"]):
+            self.aggregates.add_row(row)
+
+    def rebuild_aggregates(self):
+        # Balances come from the customer rows, activity from a full log scan.
+        with self._io_lock:
+            agg = Aggregates()
+            position = self.log.position()
+            for row in self.log.iter_rows():
+                agg.add_row(row)
+            agg.balances = {"checking": 0, "savings": 0}
+            for row in self.store.iter_rows():
+                for t in ("checking", "savings"):
+                    if row.get(f"{t}_balance"):
+                        agg.balances[t] += Money.parse(row[f"{t}_balance"]).cents
+            self.aggregates = agg
+            self._save_aggregates(position)
+
+    def _save_aggregates(self, position=None):
+        data = self.aggregates.to_dict()
+        data["position"] = self.log.position() if position is None else position
+        data["log_version"] = getattr(self.log, "version", None)
+        self.store.save_aggregates(data)
+
+    def customer_summary(self, customer_id=None):
+        if customer_id is None:
+            if self.current is None:
+                raise PermissionError("login required")
+            customer_id = self.current.id
+        with self._io_lock:
+            return self.aggregates.customer_summary(int(customer_id))
+
+    def bank_summary(self):
+        with self._io_lock:
+            return self.aggregates.bank_summary()
+
+    def iter_customer_rows(self):
+        return self.store.iter_rows()
+
+    def iter_customers(self):
+        # Every customer once. Lazy banks stream the store and hand back the
+        # live object where one exists, without filling the LRU.
+        if not self.lazy:
+            yield from self._customers
+            return
+        for row in self.store.iter_rows():
+            c = self._live.get(int(row["id"]))
+            yield c if c is not None else self._customer_from_row(row)
+
+    def _persist(self, customers, log_rows=(), span=None):
+        # Callers hold _io_lock. The store writes the customer rows and their
+        # log rows together and says when a checkpoint is due.
+        if self.store.commit([self._row_values(c) for c in customers], log_rows, span):
+            self.save_all_to_csv()
+            if span is not None:
+                span.mark("checkpoint")
 
     def save_all_to_csv(self):
-        fieldnames = [
-            "id","first_name","last_name","password",
-            "checking_balance","checking_active","checking_overdrafts",
-            "savings_balance","savings_active","savings_overdrafts"
-        ]
-        with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for c in self.customers:
-                chk_bal = f"{c.checking.balance:.2f}" if c.checking else ""
-                chk_act = str(c.checking.active) if c.checking else ""
-                chk_odc = str(c.checking.overdraft_count) if c.checking else ""
-                sav_bal = f"{c.savings.balance:.2f}" if c.savings else ""
-                sav_act = str(c.savings.active) if c.savings else ""
-                sav_odc = str(c.savings.overdraft_count) if c.savings else ""
-                writer.writerow({
-                    "id": c.id,
-                    "first_name": c.first_name,
-                    "last_name": c.last_name,
-                    "password": c.password,
-                    "checking_balance": chk_bal,
-                    "checking_active": chk_act,
-                    "checking_overdrafts": chk_odc,
-                    "savings_balance": sav_bal,
-                    "savings_active": sav_act,
-                    "savings_overdrafts": sav_odc
-                })
+        if self.lazy:
+            self.store.write_snapshot([row.get(k) or "" for k in self.FIELDS] for row in self.store.iter_rows())
+        else:
+            self.store.write_snapshot(self._row_values(c) for c in self.customers)
+        self._save_aggregates()
+
+    def write_snapshot(self, rows):
+        # Rows from outside the operations bypass the aggregates, so the saved
+        # ones are dropped and rebuilt on the next load.
+        self.store.write_snapshot(rows)
+        self.store.save_aggregates(None)
+
+    def close(self):
+        self.store.close()
 
     def add_customer(self, first_name, last_name, password, open_checking=False, open_savings=False):
-        new_id = (max((c.id for c in self.customers), default=10000) + 1)
-        checking = Account("checking", 0.0) if open_checking else None
-        savings  = Account("savings", 0.0) if open_savings else None
-        customer = Customer(new_id, first_name, last_name, password, checking, savings)
-        self.customers.append(customer)
-        self.save_all_to_csv()
+        checking = Account("checking", ZERO) if open_checking else None
+        savings  = Account("savings", ZERO) if open_savings else None
+        password = hash_password(password, self.kdf_iterations)
+        with self._io_lock:
+            new_id = self._next_id
+            customer = Customer(new_id, first_name, last_name, password, checking, savings)
+            if not self.lazy:
+                self.customers.append(customer)
+            self._index_customer(customer)
+            self._persist([customer])
         return customer
 
-    def login(self, customer_id, password):
-        for c in self.customers:
-            if c.id == int(customer_id) and c.password == password:
-                self.current = c
+    def _authenticate(self, customer_id, password):
+        c = self.get_customer(customer_id)
+        if c is None:
+            raise PermissionError("invalid credentials")
+        stored = c.password
+        key = hmac.new(self._credential_key, password.encode("utf-8"), hashlib.sha256).digest()
+        with self._auth_lock:
+            cached = self._credentials.get(c.id)
+            if cached is not None and cached[0] == stored and hmac.compare_digest(cached[1], key):
+                self._credentials.move_to_end(c.id)
                 return c
-        raise PermissionError("invalid credentials")
+        if not verify_password(password, stored):
+            raise PermissionError("invalid credentials")
+        if password_iterations(stored) != self.kdf_iterations:
+            with self._locked(c.id):
+                c.password = hash_password(password, self.kdf_iterations)
+                with self._io_lock:
+                    self._persist([c])
+        with self._auth_lock:
+            self._credentials[c.id] = (c.password, key)
+            self._credentials.move_to_end(c.id)
+            while len(self._credentials) > self.credential_cache_size:
+                self._credentials.popitem(last=False)
+        return c
+
+    def login(self, customer_id, password):
+        self.current = self._authenticate(customer_id, password)
+        return self.current
+
+    def open_session(self, customer_id, password):
+        return Session(self, self._authenticate(customer_id, password))
+
+    def issue_token(self, customer):
+        token = secrets.token_urlsafe(24)
+        with self._auth_lock:
+            self._tokens[token] = (customer.id, customer.password, time.monotonic() + self.token_ttl)
+            while len(self._tokens) > self.credential_cache_size:
+                self._tokens.popitem(last=False)
+        return token
+
+    def resume_session(self, token):
+        with self._auth_lock:
+            entry = self._tokens.get(token)
+            if entry is not None and entry[2] < time.monotonic():
+                del self._tokens[token]
+                entry = None
+        c = self.get_customer(entry[0]) if entry else None
+        if c is None or c.password != entry[1]:
+            raise PermissionError("invalid or expired token")
+        return Session(self, c)
+
+    def migrate_passwords(self):
+        # Hashes every plaintext row now rather than at each customer's next
+        # login. Costs one KDF run per plaintext customer.
+        migrated = [c for c in self.customers if not is_password_hash(c.password)]
+        for c in migrated:
+            with self._locked(c.id):
+                c.password = hash_password(c.password, self.kdf_iterations)
+        if migrated:
+            with self._io_lock:
+                self._persist(migrated)
+        return len(migrated)
 
     def logout(self):
         self.current = None
+        self.log.flush()
 
-    def create_account(self, account_type, initial_balance=0.0):
-        if self.current is None:
+    def create_account(self, account_type, initial_balance=ZERO):
+        return self._create_account(self.current, account_type, initial_balance)
+
+    def _create_account(self, c, account_type, initial_balance):
+        if c is None:
             raise PermissionError("login required")
         if account_type not in ("checking", "savings"):
             raise ValueError("invalid account type")
-        c = self.current
+        with self._locked(c.id):
+            return self._open_account(c, account_type, initial_balance)
+
+    def _open_account(self, c, account_type, initial_balance):
         if c.checking and c.savings:
             raise ValueError("You already have both accounts.")
         if account_type == "checking":
             if c.checking:
                 raise ValueError("Checking account already exists.")
-            c.checking = Account("checking", float(initial_balance))
+            c.checking = Account("checking", Money.of(initial_balance))
             acc = c.checking
         else:
             if c.savings:
                 raise ValueError("Savings account already exists.")
-            c.savings = Account("savings", float(initial_balance))
+            c.savings = Account("savings", Money.of(initial_balance))
             acc = c.savings
-        self.save_all_to_csv()
+        with self._io_lock:
+            self.aggregates.balances[account_type] += acc.cents
+            self._persist([c])
         return acc
 
     def _get_account(self, account_type, customer=None):
@@ -169,104 +1488,277 @@ class BankSystem:
         if customer.savings:
             customer.savings.active = False
 
-    def deposit(self, account_type, amount):
+    def deposit(self, account_type, amount, idempotency_key=None):
+        return self._run(self._deposit, self.current, account_type, amount, key=idempotency_key)
+
+    def withdraw(self, account_type, amount, idempotency_key=None):
+        return self._run(self._withdraw, self.current, account_type, amount, key=idempotency_key)
+
+    def transfer(self, from_type, to_type, amount, target_customer_id=None, target_account_type=None,
+                 idempotency_key=None):
+        return self._run(self._transfer, self.current, from_type, to_type, amount,
+                         target_customer_id, target_account_type,
+                         lock_ids=self._target_ids(target_customer_id), key=idempotency_key)
+
+    def _target_ids(self, target_customer_id):
+        target = None if target_customer_id is None else self.get_customer(target_customer_id)
+        return (target.id,) if target else ()
+
+    def _lock_for(self, customer_id):
+        lock = self._locks.get(customer_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(customer_id, threading.Lock())
+        return lock
+
+    @contextmanager
+    def _locked(self, *customer_ids):
+        # Customer locks are always taken in ascending id order, so transfers
+        # running in opposite directions cannot deadlock.
+        locks = [self._lock_for(cid) for cid in sorted(set(customer_ids))]
+        for lock in locks:
+            lock.acquire()
         try:
-            amount = float(amount)
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _run(self, op, customer, *args, lock_ids=(), key=None):
+        # With an idempotency key a repeat returns the first result: checked
+        # once without locks, then again under the customer lock so two
+        # concurrent retries cannot both run.
+        key = key if key and customer is not None else None
+        if key:
+            done = self.idempotency.get(customer.id, key)
+            if done is not None:
+                return done
+        ids = lock_ids + ((customer.id,) if customer is not None else ())
+        span = None if self.metrics is None else self.metrics.start(op.__name__.lstrip("_"))
+        reason = None
+        try:
+            with self._locked(*ids):
+                if key:
+                    done = self.idempotency.get(customer.id, key)
+                    if done is not None:
+                        reason = "duplicate"
+                        return done
+                txn = _Txn(span)
+                txn.mark("lock")
+                msg = op(txn, customer, *args)
+                if span is not None:
+                    span.mark("rules" if "validate" in span.phases else "validate")
+                    reason = None if txn.saves else self._reject_reason(txn.rows, msg)
+                if key:
+                    self._tag_keyed(txn, 0, customer, op.__name__.lstrip("_"), key, msg)
+                self._commit(txn)
+                if key:
+                    self.idempotency.put(customer.id, key, msg)
+        except Exception:
+            reason = "error"
+            raise
+        finally:
+            if span is not None:
+                self.metrics.finish(span, reason)
+        return msg
+
+    def _tag_keyed(self, txn, first_row, customer, name, key, msg):
+        # Marks the rows of a keyed operation with its key and result. A
+        # rejection that wrote no row gets one, so the key still survives a
+        # restart through IdempotencyCache.rebuild.
+        if len(txn.rows) == first_row:
+            txn.log(customer_id=customer.id, action=name, status="error", message="rejected")
+        for row in txn.rows[first_row:]:
+            row.update(idem_key=key, result=msg)
+
+    def _reject_reason(self, rows, msg):
+        # The logged error message where there is one ("over limit",
+        # "overdraft cap", "deactivated"), else the reply's first sentence.
+        if rows and rows[-1].get("status") == "error":
+            return rows[-1].get("message")
+        return str(msg).split(".")[0].lower()
+
+    def _commit(self, txn):
+        with self._io_lock:
+            for row in txn.rows:
+                self.aggregates.add_row(row)
+            if txn.touched or txn.rows:
+                self._persist(txn.touched.values(), txn.rows, txn.span)
+
+    def apply_batch(self, ops):
+        ops_by_name = {"deposit": self._deposit, "withdraw": self._withdraw, "transfer": self._transfer}
+        txn = _Txn()
+        results = []
+        stats = {"ops": 0, "applied": 0, "rejected": 0, "duplicates": 0, "by_op": {}}
+        keyed = {}
+        for item in ops:
+            name = customer = key = None
+            saves = txn.saves
+            rows = len(txn.rows)
+            txn.span = None
+            # A malformed op is rejected on its own; the batch still reaches
+            # _commit, so earlier ops are never left applied but unsaved.
+            try:
+                if not isinstance(item, dict):
+                    raise TypeError("operation must be an object")
+                name = item.get("op")
+                customer = self.get_customer(item.get("customer_id"))
+                key = item.get("idempotency_key") if customer is not None else None
+                if key:
+                    done = keyed.get((customer.id, key)) or self.idempotency.get(customer.id, key)
+                    if done is not None:
+                        results.append(done)
+                        stats["ops"] += 1
+                        stats["duplicates"] += 1
+                        continue
+                if self.metrics is not None:
+                    txn.span = self.metrics.start(str(name))
+                if name not in ops_by_name:
+                    msg = "Unknown operation."
+                elif customer is None:
+                    msg = "Customer not found."
+                elif name == "transfer":
+                    with self._locked(customer.id, *self._target_ids(item.get("target_customer_id"))):
+                        msg = self._transfer(txn, customer, item.get("from_type"), item.get("to_type"),
+                                             item.get("amount"), item.get("target_customer_id"),
+                                             item.get("target_account_type"))
+                else:
+                    with self._locked(customer.id):
+                        msg = ops_by_name[name](txn, customer, item.get("account_type"), item.get("amount"))
+            except (TypeError, ValueError, InvalidOperation) as e:
+                msg = f"Error: {e}"
+                key = None
+            applied = txn.saves > saves
+            if txn.span is not None:
+                txn.span.mark("rules" if "validate" in txn.span.phases else "validate")
+                self.metrics.finish(txn.span, None if applied else self._reject_reason(txn.rows[rows:], msg))
+            if key:
+                self._tag_keyed(txn, rows, customer, str(name), key, msg)
+                keyed[(customer.id, key)] = msg
+            results.append(msg)
+            stats["ops"] += 1
+            stats["applied" if applied else "rejected"] += 1
+            counts = stats["by_op"].setdefault(name if isinstance(name, str) else str(name),
+                                               {"applied": 0, "rejected": 0})
+            counts["applied" if applied else "rejected"] += 1
+        stats["customers_touched"] = len(txn.touched)
+        stats["log_rows"] = len(txn.rows)
+        txn.span = None if self.metrics is None else self.metrics.start("batch_commit")
+        self._commit(txn)
+        for (cid, key), msg in keyed.items():
+            self.idempotency.put(cid, key, msg)
+        if txn.span is not None:
+            self.metrics.finish(txn.span)
+        return results, stats
+
+    def _deposit(self, txn, customer, account_type, amount):
+        try:
+            amount = Money.of(amount)
         except (TypeError, ValueError):
             return "Amount must be a number."
-        if amount <= 0:
+        if amount <= ZERO:
             return "Amount must be positive."
         try:
-            acc = self._get_account(account_type)
+            acc = self._get_account(account_type, customer=customer)
         except Exception as e:
             return f"Error: {e}"
+        txn.mark("validate")
         was_user_deactivated = (
-            (self.current.checking and not self.current.checking.active) or
-            (self.current.savings and not self.current.savings.active)
+            (customer.checking and not customer.checking.active) or
+            (customer.savings and not customer.savings.active)
         )
         prev = acc.balance
         acc.balance += amount
         if was_user_deactivated:
             all_solvent = True
-            if self.current.checking and self.current.checking.balance < 0:
+            if customer.checking and customer.checking.balance < ZERO:
                 all_solvent = False
-            if self.current.savings and self.current.savings.balance < 0:
+            if customer.savings and customer.savings.balance < ZERO:
                 all_solvent = False
             if all_solvent:
-                if self.current.checking:
-                    self.current.checking.active = True
-                    self.current.checking.overdraft_count = 0
-                if self.current.savings:
-                    self.current.savings.active = True
-                    self.current.savings.overdraft_count = 0
+                if customer.checking:
+                    customer.checking.active = True
+                    customer.checking.overdraft_count = 0
+                if customer.savings:
+                    customer.savings.active = True
+                    customer.savings.overdraft_count = 0
                 msg = "All accounts reactivated. Deposit successful."
             else:
                 msg = "Deposit successful."
         else:
             msg = "Deposit successful."
-        self.save_all_to_csv()
-        self.log.append(customer_id=self.current.id, action="deposit", account_type=account_type,
-                        amount=f"{amount:.2f}", fee="0.00",
-                        prev_balance=f"{prev:.2f}", new_balance=f"{acc.balance:.2f}",
-                        status="ok", message=msg)
-        return f"{msg} New balance: {acc.balance:.2f}"
-
-    def withdraw(self, account_type, amount):
+        txn.save(customer)
+        txn.log(customer_id=customer.id, action="deposit", account_type=account_type,
+                amount=str(amount), fee="0.00",
+                prev_balance=str(prev), new_balance=str(acc.balance),
+                status="ok", message=msg)
+        return f"{msg} New balance: {acc.balance}"
+
+    def _withdraw(self, txn, customer, account_type, amount):
         try:
-            amount = float(amount)
+            amount = Money.of(amount)
         except (TypeError, ValueError):
             return "Amount must be a number."
-        if amount <= 0:
+        if amount <= ZERO:
             return "Amount must be positive."
         try:
-            acc = self._get_account(account_type)
+            acc = self._get_account(account_type, customer=customer)
         except Exception as e:
             return f"Error: {e}"
         if not acc.active:
-            msg = f"Account is deactivated. Current balance: {acc.balance:.2f}"
-            self.log.append(customer_id=self.current.id, action="withdraw", account_type=account_type,
-                            amount=f"{amount:.2f}", fee="0.00",
-                            prev_balance=f"{acc.balance:.2f}", new_balance=f"{acc.balance:.2f}",
-                            status="error", message="deactivated")
+            msg = f"Account is deactivated. Current balance: {acc.balance}"
+            txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                    amount=str(amount), fee="0.00",
+                    prev_balance=str(acc.balance), new_balance=str(acc.balance),
+                    status="error", message="deactivated")
             return msg
-        if amount > 100:
-            msg = f"Cannot withdraw more than $100 in one transaction. Current balance: {acc.balance:.2f}"
-            self.log.append(customer_id=self.current.id, action="withdraw", account_type=account_type,
-                            amount=f"{amount:.2f}", fee="0.00",
-                            prev_balance=f"{acc.balance:.2f}", new_balance=f"{acc.balance:.2f}",
-                            status="error", message="over limit")
+        if amount > TRANSACTION_LIMIT:
+            msg = f"Cannot withdraw more than $100 in one transaction. Current balance: {acc.balance}"
+            txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                    amount=str(amount), fee="0.00",
+                    prev_balance=str(acc.balance), new_balance=str(acc.balance),
+                    status="error", message="over limit")
             return msg
+        if self.limits is not None:
+            limit = self.limits.check(customer.id, account_type, "withdraw", amount.cents)
+            if limit is not None:
+                txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                        amount=str(amount), fee="0.00",
+                        prev_balance=str(acc.balance), new_balance=str(acc.balance),
+                        status="error", message="velocity limit")
+                return f"Velocity limit reached: {limit.describe()}. Current balance: {acc.balance}"
+        txn.mark("validate")
         b = acc.balance
-        if b < 0:
-            max_allowed = max(0.0, min(100.0, b + 65.0))
+        if b < ZERO:
+            max_allowed = max(ZERO, min(TRANSACTION_LIMIT, b + OVERDRAFT_BUFFER))
             if amount > max_allowed:
-                msg = f"Overdraft limit reached. Max you can withdraw is ${max_allowed:.2f}. Current balance: {b:.2f}"
-                self.log.append(customer_id=self.current.id, action="withdraw", account_type=account_type,
-                                amount=f"{amount:.2f}", fee="0.00",
-                                prev_balance=f"{b:.2f}", new_balance=f"{b:.2f}",
-                                status="error", message="overdraft cap")
+                msg = f"Overdraft limit reached. Max you can withdraw is ${max_allowed}. Current balance: {b}"
+                txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                        amount=str(amount), fee="0.00",
+                        prev_balance=str(b), new_balance=str(b),
+                        status="error", message="overdraft cap")
                 return msg
         else:
             if amount > b:
-                max_allowed = max(0.0, min(100.0, b + 65.0))
+                max_allowed = max(ZERO, min(TRANSACTION_LIMIT, b + OVERDRAFT_BUFFER))
                 if amount > max_allowed:
-                    msg = f"Overdraft limit reached. Max you can withdraw is ${max_allowed:.2f}. Current balance: {b:.2f}"
-                    self.log.append(customer_id=self.current.id, action="withdraw", account_type=account_type,
-                                    amount=f"{amount:.2f}", fee="0.00",
-                                    prev_balance=f"{b:.2f}", new_balance=f"{b:.2f}",
-                                    status="error", message="overdraft cap")
+                    msg = f"Overdraft limit reached. Max you can withdraw is ${max_allowed}. Current balance: {b}"
+                    txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                            amount=str(amount), fee="0.00",
+                            prev_balance=str(b), new_balance=str(b),
+                            status="error", message="overdraft cap")
                     return msg
         prev = acc.balance
         acc.balance -= amount
-        fee = 0.0
-        overdrafted_now = prev < 0 or acc.balance < 0
+        fee = ZERO
+        overdrafted_now = prev < ZERO or acc.balance < ZERO
         if overdrafted_now:
-            fee = 35.0
+            fee = OVERDRAFT_FEE
             acc.balance -= fee
             acc.overdraft_count += 1
-            total = self._customer_overdraft_total(self.current)
+            total = self._customer_overdraft_total(customer)
             if total >= 3:
-                self._deactivate_customer_accounts(self.current)
+                self._deactivate_customer_accounts(customer)
                 msg = "Overdraft fee $35.00 applied. Account deactivated."
             else:
                 msg = "Overdraft fee $35.00 applied."
@@ -274,70 +1766,90 @@ class BankSystem:
             if not acc.active:
                 acc.active = True
             msg = "Withdraw successful."
-        self.save_all_to_csv()
-        self.log.append(customer_id=self.current.id, action="withdraw", account_type=account_type,
-                        amount=f"{amount:.2f}", fee=f"{fee:.2f}",
-                        prev_balance=f"{prev:.2f}", new_balance=f"{acc.balance:.2f}",
-                        status="ok", message=msg)
-        return f"{msg} Current balance: {acc.balance:.2f}"
-
-    def transfer(self, from_type, to_type, amount, target_customer_id=None, target_account_type=None):
+        if self.limits is not None:
+            self.limits.record(customer.id, account_type, "withdraw", amount.cents)
+        txn.save(customer)
+        txn.log(customer_id=customer.id, action="withdraw", account_type=account_type,
+                amount=str(amount), fee=str(fee),
+                prev_balance=str(prev), new_balance=str(acc.balance),
+                status="ok", message=msg)
+        return f"{msg} Current balance: {acc.balance}"
+
+    def _transfer(self, txn, customer, from_type, to_type, amount, target_customer_id=None, target_account_type=None):
         try:
-            amount = float(amount)
+            amount = Money.of(amount)
         except (TypeError, ValueError):
             return "Amount must be a number."
-        if amount <= 0:
+        if amount <= ZERO:
             return "Amount must be positive."
         try:
-            src = self._get_account(from_type)
+            src = self._get_account(from_type, customer=customer)
         except Exception as e:
             return f"Error: {e}"
         if not src.active:
-            return f"Source account is deactivated. Current balance: {src.balance:.2f}"
-        if amount > 100:
-            return f"Cannot transfer more than $100 in one transaction. Current balance: {src.balance:.2f}"
-        if src.balance - amount < 0:
-            return f"Insufficient funds. Current balance: {src.balance:.2f}"
+            return f"Source account is deactivated. Current balance: {src.balance}"
+        if amount > TRANSACTION_LIMIT:
+            return f"Cannot transfer more than $100 in one transaction. Current balance: {src.balance}"
+        if src.balance - amount < ZERO:
+            return f"Insufficient funds. Current balance: {src.balance}"
+        txn.mark("validate")
         prev_src = src.balance
         if target_customer_id is None:
             if from_type == to_type:
                 return "Cannot transfer to the same account."
             try:
-                dst = self._get_account(to_type)
+                dst = self._get_account(to_type, customer=customer)
             except Exception as e:
                 return f"Error: {e}"
             src.balance -= amount
             dst.balance += amount
-            self.save_all_to_csv()
-            self.log.append(customer_id=self.current.id, action="transfer",
-                            account_type=f"{from_type}->{to_type}", amount=f"{amount:.2f}", fee="0.00",
-                            prev_balance=f"{prev_src:.2f}", new_balance=f"{src.balance:.2f}",
-                            status="ok", message="Internal transfer")
-            chk_bal = f"{self.current.checking.balance:.2f}" if self.current.checking else "N/A"
-            sav_bal = f"{self.current.savings.balance:.2f}" if self.current.savings else "N/A"
+            txn.save(customer)
+            txn.log(customer_id=customer.id, action="transfer",
+                    account_type=f"{from_type}->{to_type}", amount=str(amount), fee="0.00",
+                    prev_balance=str(prev_src), new_balance=str(src.balance),
+                    status="ok", message="Internal transfer")
+            chk_bal = f"{customer.checking.balance}" if customer.checking else "N/A"
+            sav_bal = f"{customer.savings.balance}" if customer.savings else "N/A"
             return f"Transfer successful. checking={chk_bal}, savings={sav_bal}"
-        if int(target_customer_id) == self.current.id:
-            return "Cannot transfer to your own accounts here. Use internal transfer."
-        target = next((c for c in self.customers if c.id == int(target_customer_id)), None)
+        target = self.get_customer(target_customer_id)
         if target is None:
             return "Target customer not found."
+        if target.id == customer.id:
+            return "Cannot transfer to your own accounts here. Use internal transfer."
         if target_account_type not in ("checking", "savings"):
             return "Invalid target account type."
         try:
             dst = self._get_account(target_account_type, customer=target)
         except Exception as e:
             return f"Error: {e}"
+        if self.limits is not None:
+            limit = self.limits.check(customer.id, from_type, "transfer", amount.cents)
+            if limit is not None:
+                txn.log(customer_id=customer.id, action="transfer",
+                        account_type=f"{from_type}->{target.id}:{target_account_type}",
+                        amount=str(amount), fee="0.00",
+                        prev_balance=str(prev_src), new_balance=str(prev_src),
+                        status="error", message="velocity limit")
+                return f"Velocity limit reached: {limit.describe()}. Current balance: {src.balance}"
+            self.limits.record(customer.id, from_type, "transfer", amount.cents)
         src.balance -= amount
         dst.balance += amount
-        self.save_all_to_csv()
-        self.log.append(customer_id=self.current.id, action="transfer",
-                        account_type=f"{from_type}->{target.id}:{target_account_type}",
-                        amount=f"{amount:.2f}", fee="0.00",
-                        prev_balance=f"{prev_src:.2f}", new_balance=f"{src.balance:.2f}",
-                        status="ok", message=f"External transfer to {target.id}")
-        return f"Transfer successful. {from_type}={src.balance:.2f}"
+        txn.save(customer, target)
+        txn.log(customer_id=customer.id, action="transfer",
+                account_type=f"{from_type}->{target.id}:{target_account_type}",
+                amount=str(amount), fee="0.00",
+                prev_balance=str(prev_src), new_balance=str(src.balance),
+                status="ok", message=f"External transfer to {target.id}")
+        return f"Transfer successful. {from_type}={src.balance}"
+
+    def recent_transactions(self, limit=20, match=None):
+        if self.current is None:
+            raise PermissionError("login required")
+        with self._io_lock:
+            return self.log.list_for(self.current.id, limit=limit, match=match)
 
-    def recent_transactions(self, limit=20):
+    def query_transactions(self, **filters):
         if self.current is None:
             raise PermissionError("login required")
-        return self.log.list_for(self.current.id, limit=limit)
\ No newline at end of file
+        with self._io_lock:
+            return self.log.query(self.current.id, **filters)
\ No newline at end of file
@@ -0,0 +1,331 @@
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from banking import Account, BankSystem, Customer, Money, TransactionLog, hash_password
+
+class DictCustomer:
+    def __init__(self, id, first_name, last_name, password, checking=None, savings=None):
+        self.id = int(id)
+        self.first_name = first_name
+        self.last_name = last_name
+        self.password = password
+        self.checking = checking
+        self.savings = savings
+
+class DictAccount:
+    def __init__(self, type, balance, active=True, overdraft_count=0):
+        self.type = type
+        self.balance = float(balance)
+        self.active = bool(active)
+        self.overdraft_count = int(overdraft_count)
+
+def build_customers(n, customer_cls, account_cls, balance):
+    customers = []
+    for i in range(n):
+        checking = account_cls("checking", balance(i * 7 % 100000))
+        savings = account_cls("savings", balance(i * 13 % 100000)) if i % 2 else None
+        customers.append(customer_cls(10001 + i, f"First{i}", f"Last{i}", f"pw{i}", checking, savings))
+    return customers
+
+def measure_memory(n, customer_cls, account_cls, balance):
+    gc.collect()
+    tracemalloc.start()
+    customers = build_customers(n, customer_cls, account_cls, balance)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del customers
+    return used
+
+def bench_memory(args):
+    results = {}
+    layouts = {
+        "dict_float": (DictCustomer, DictAccount, lambda cents: cents / 100),
+        "slots_money": (Customer, Account, Money),
+    }
+    for name, (customer_cls, account_cls, balance) in layouts.items():
+        used = measure_memory(args.customers, customer_cls, account_cls, balance)
+        results[name] = {"bytes": used, "bytes_per_customer": round(used / args.customers, 1)}
+    return {"benchmark": "memory", "customers": args.customers, "results": results}
+
+BENCH_PASSWORD = "bench"
+
+def generate_bank(directory, customers, log_rows, seed=1, kdf_iterations=1000):
+    # Writes a synthetic bank.csv and transactions.csv: mostly healthy
+    # accounts plus some overdrafted and some deactivated customers. Every
+    # customer shares one password hash so generation skips the KDF.
+    rng = random.Random(seed)
+    password = hash_password(BENCH_PASSWORD, kdf_iterations)
+    bank_path = os.path.join(directory, "bank.csv")
+    log_path = os.path.join(directory, "transactions.csv")
+    def rows():
+        for i in range(customers):
+            kind = rng.random()
+            overdrafts, active = 0, "True"
+            balance = rng.randint(0, 500000)
+            if kind < 0.05:
+                overdrafts, active, balance = 3, "False", -rng.randint(100, 10000)
+            elif kind < 0.15:
+                overdrafts, balance = rng.randint(1, 2), -rng.randint(100, 6500)
+            checking = [str(Money(balance)), active, str(overdrafts)]
+            savings = [str(Money(rng.randint(0, 1000000))), active, "0"] if i % 3 else ["", "", ""]
+            yield [str(10001 + i), f"First{i}", f"Last{i}", password] + checking + savings
+    bank = BankSystem(bank_path, log_path=log_path)
+    bank.write_snapshot(rows())
+    bank.close()
+    log = TransactionLog(log_path)
+    actions = ("deposit", "withdraw", "transfer")
+    for start in range(0, log_rows, 10000):
+        batch = []
+        for _ in range(min(10000, log_rows - start)):
+            amount = Money(rng.randint(100, 10000))
+            prev = Money(rng.randint(0, 500000))
+            batch.append({"customer_id": 10001 + rng.randrange(customers), "action": rng.choice(actions),
+                          "account_type": "checking", "amount": str(amount), "fee": "0.00",
+                          "prev_balance": str(prev), "new_balance": str(prev + amount),
+                          "status": "ok", "message": "synthetic"})
+        log.append_many(batch)
+    return bank_path, log_path
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    def pct(p):
+        return round(samples[min(n - 1, int(p * n))] * 1e6, 1)
+    total = sum(samples)
+    return {"n": n, "mean_us": round(total / n * 1e6, 1), "p50_us": pct(0.50), "p90_us": pct(0.90),
+            "p99_us": pct(0.99), "max_us": round(samples[-1] * 1e6, 1), "ops_per_s": round(n / total, 1)}
+
+def timed(samples, fn, *args, **kw):
+    start = time.perf_counter()
+    result = fn(*args, **kw)
+    samples.append(time.perf_counter() - start)
+    return result
+
+def bench_scale(customers, log_rows, ops, seed, kdf_iterations):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        bank_path, log_path = generate_bank(directory, customers, log_rows, seed, kdf_iterations)
+        samples = {k: [] for k in ("load", "login", "deposit", "withdraw", "transfer_internal",
+                                   "transfer_external", "history")}
+        bank = BankSystem(bank_path, log_path=log_path, kdf_iterations=kdf_iterations)
+        timed(samples["load"], bank.load_from_csv)
+        ids = [c.id for c in bank.customers]
+        for _ in range(ops):
+            cid = rng.choice(ids)
+            timed(samples["login"], bank.login, cid, BENCH_PASSWORD)
+            timed(samples["deposit"], bank.deposit, "checking", Money(rng.randint(100, 20000)))
+            timed(samples["withdraw"], bank.withdraw, "checking", Money(rng.randint(100, 5000)))
+            timed(samples["transfer_internal"], bank.transfer, "checking", "savings", Money(rng.randint(100, 2000)))
+            timed(samples["transfer_external"], bank.transfer, "checking", None, Money(rng.randint(100, 2000)),
+                  target_customer_id=rng.choice(ids), target_account_type="checking")
+            timed(samples["history"], bank.recent_transactions, 20)
+        bank.close()
+        return {name: summarize(values) for name, values in samples.items()}
+
+def bench_ops(args):
+    scales = [int(s) for s in args.scales.split(",")]
+    results = {}
+    for customers in scales:
+        log_rows = customers * args.log_ratio
+        print(f"scale {customers} customers / {log_rows} log rows", file=sys.stderr)
+        results[str(customers)] = bench_scale(customers, log_rows, args.ops, args.seed, args.kdf_iterations)
+    return {"benchmark": "ops", "ops": args.ops, "log_ratio": args.log_ratio,
+            "kdf_iterations": args.kdf_iterations, "results": results}
+
+def bench_login(args):
+    # Cold logins run the KDF; cached logins and token resumes should not.
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for iterations in [int(s) for s in args.iterations.split(",")]:
+            bank_path, log_path = generate_bank(directory, args.customers, 0, kdf_iterations=iterations)
+            bank = BankSystem(bank_path, log_path=log_path, kdf_iterations=iterations)
+            bank.load_from_csv()
+            ids = [c.id for c in bank.customers]
+            samples = {"cold": [], "cached": [], "token": []}
+            for cid in ids[:args.logins]:
+                bank._credentials.clear()
+                timed(samples["cold"], bank.login, cid, BENCH_PASSWORD)
+                timed(samples["cached"], bank.login, cid, BENCH_PASSWORD)
+                token = bank.issue_token(bank.current)
+                timed(samples["token"], bank.resume_session, token)
+            bank.close()
+            results[str(iterations)] = {name: summarize(values) for name, values in samples.items()}
+    return {"benchmark": "login", "logins": args.logins, "results": results}
+
+def bench_posting(args):
+    # One period-end posting over the whole book per engine, each on a fresh
+    # copy of the same generated bank.
+    import posting
+    engines = ["python"] + (["numpy"] if posting.np is not None else [])
+    results = {}
+    for engine in engines:
+        with tempfile.TemporaryDirectory() as directory:
+            bank_path, log_path = generate_bank(directory, args.customers, 0, args.seed)
+            bank = BankSystem(bank_path, log_path=log_path, checkpoint_every=10 ** 9)
+            start = time.perf_counter()
+            bank.load_from_csv()
+            load = time.perf_counter() - start
+            start = time.perf_counter()
+            stats = posting.post_period(bank, args.interest_rate, args.maintenance_fee, args.minimum_balance,
+                                        args.overdraft_fee, use_numpy=engine == "numpy")
+            stats["total_s"] = round(time.perf_counter() - start, 4)
+            stats["load_s"] = round(load, 4)
+            bank.close()
+            results[engine] = stats
+    return {"benchmark": "posting", "customers": args.customers, "results": results}
+
+def bench_shards(args):
+    # Deposit and cross-customer transfer throughput through ShardRouter with
+    # one client thread per customer session, at several shard counts.
+    import threading
+    from shard import ShardRouter
+    results = {}
+    for shards in [int(s) for s in args.shards.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            router = ShardRouter(directory, shards)
+            ids = [router.add_customer(f"First{i}", f"Last{i}", BENCH_PASSWORD, open_checking=True).id
+                   for i in range(args.clients)]
+            sessions = [router.open_session(cid, BENCH_PASSWORD) for cid in ids]
+            samples = {"deposit": [], "transfer": []}
+            def client(n):
+                rng = random.Random(args.seed + n)
+                mine = {"deposit": [], "transfer": []}
+                for _ in range(args.ops):
+                    timed(mine["deposit"], sessions[n].deposit, "checking", "10")
+                    timed(mine["transfer"], sessions[n].transfer, "checking", None, "1",
+                          rng.choice(ids), "checking")
+                for k, v in mine.items():
+                    samples[k].extend(v)
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            router.close()
+            result = {name: summarize(values) for name, values in samples.items()}
+            result["total"] = {"ops": 2 * args.clients * args.ops,
+                               "ops_per_s": round(2 * args.clients * args.ops / elapsed, 1)}
+            results[str(shards)] = result
+    return {"benchmark": "shards", "clients": args.clients, "ops": args.ops, "results": results}
+
+COLD_START = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "from banking import BankSystem\n"
+    "bank = BankSystem(sys.argv[1], log_path=sys.argv[2], lazy=sys.argv[3] == '1')\n"
+    "bank.load_from_csv()\n"
+    "bank.get_customer(10001)\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+def cold_start(path, log_path, lazy):
+    # Seconds from a fresh interpreter to the first customer lookup,
+    # imports included.
+    out = subprocess.run([sys.executable, "-c", COLD_START, path, log_path, "1" if lazy else "0"],
+                         cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    return round(float(out.stdout), 4)
+
+def bench_coldstart(args):
+    # Startup of the same generated bank as bank.csv and as bank.bin, eager
+    # and lazy. The first start of each builds the saved aggregates and is
+    # not counted.
+    from binstore import convert
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bank_path, log_path = generate_bank(directory, args.customers, 0, args.seed)
+        bin_path = os.path.join(directory, "bank.bin")
+        start = time.perf_counter()
+        convert(bank_path, bin_path, log_path)
+        convert_s = round(time.perf_counter() - start, 4)
+        for fmt, path in (("csv", bank_path), ("bin", bin_path)):
+            for lazy in (False, True):
+                cold_start(path, log_path, lazy)
+                runs = [cold_start(path, log_path, lazy) for _ in range(args.runs)]
+                results[f"{fmt}_{'lazy' if lazy else 'eager'}"] = {"best_s": min(runs), "runs": runs,
+                                                                   "bytes": os.path.getsize(path)}
+    return {"benchmark": "coldstart", "customers": args.customers, "convert_s": convert_s, "results": results}
+
+def compare(old, new, threshold, metric="p50_us"):
+    # Yields (scale, operation, old, new, ratio) for every slowdown over threshold.
+    for scale, ops in new.get("results", {}).items():
+        for op, stats in ops.items():
+            before = old.get("results", {}).get(scale, {}).get(op)
+            if not isinstance(stats, dict) or not isinstance(before, dict) or metric not in stats or not before.get(metric):
+                continue
+            ratio = stats[metric] / before[metric]
+            if ratio > 1 + threshold:
+                yield scale, op, before[metric], stats[metric], round(ratio, 2)
+
+def bench_compare(args):
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = [dict(zip(("scale", "op", "old", "new", "ratio"), r))
+                   for r in compare(old, new, args.threshold, args.metric)]
+    return {"benchmark": "compare", "metric": args.metric, "threshold": args.threshold, "regressions": regressions}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Blue Sky Bank benchmarks")
+    parser.add_argument("--output", help="write JSON results to this file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("memory", help="per-customer memory of the in-memory model")
+    p.add_argument("--customers", type=int, default=100000)
+    p = sub.add_parser("ops", help="latency and throughput of BankSystem operations at several scales")
+    p.add_argument("--scales", default="1000,10000,100000", help="comma-separated customer counts")
+    p.add_argument("--log-ratio", type=int, default=10, help="log rows per customer")
+    p.add_argument("--ops", type=int, default=200, help="samples per operation and scale")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--kdf-iterations", type=int, default=1000)
+    p = sub.add_parser("login", help="login throughput at several password hashing costs")
+    p.add_argument("--iterations", default="1000,10000,100000,200000", help="comma-separated KDF costs")
+    p.add_argument("--customers", type=int, default=1000)
+    p.add_argument("--logins", type=int, default=50)
+    p = sub.add_parser("posting", help="period-end interest and fee posting over the whole book")
+    p.add_argument("--customers", type=int, default=1000000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--interest-rate", default="0.001")
+    p.add_argument("--maintenance-fee", default="5")
+    p.add_argument("--minimum-balance", default="100")
+    p.add_argument("--overdraft-fee", default="35")
+    p = sub.add_parser("shards", help="throughput of the sharded ledger at several shard counts")
+    p.add_argument("--shards", default="1,2,4", help="comma-separated shard counts")
+    p.add_argument("--clients", type=int, default=8, help="concurrent customer sessions")
+    p.add_argument("--ops", type=int, default=200, help="deposits and transfers per client")
+    p.add_argument("--seed", type=int, default=1)
+    p = sub.add_parser("coldstart", help="startup time from bank.csv versus the binary bank.bin snapshot")
+    p.add_argument("--customers", type=int, default=1000000)
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1)
+    p = sub.add_parser("compare", help="report slowdowns between two saved result files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    p.add_argument("--metric", default="p50_us")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    commands = {"memory": bench_memory, "ops": bench_ops, "login": bench_login, "posting": bench_posting,
+                "shards": bench_shards, "coldstart": bench_coldstart, "compare": bench_compare}
+    result = commands[args.command](args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    if args.command == "compare" and result["regressions"]:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
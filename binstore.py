@@ -0,0 +1,258 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from banking import BINARY_SUFFIXES, Account, BankStore, CsvStore, Customer, Money
+
+# bank.bin: a fixed-width snapshot that is memory-mapped rather than parsed.
+#
+#   header   magic, version, record size, record count
+#   records  one RECORD per customer, sorted by id
+#   strings  first name, last name and password of each record, back to back
+#
+# A record holds the id, where its strings start and their byte lengths,
+# presence/active flags and cents plus overdraft count per account. Changes
+# still go through CsvStore's CRC journal; a snapshot folds them in.
+
+MAGIC = b"BSKYBNK\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+RECORD = struct.Struct("<qQHHHBxqIqI")
+HAS_CHECKING, CHECKING_ACTIVE, HAS_SAVINGS, SAVINGS_ACTIVE = 1, 2, 4, 8
+
+def pack_values(values, str_off):
+    # FIELDS-ordered strings -> (record bytes, string bytes).
+    (cid, first, last, password, chk_bal, chk_act, chk_odc, sav_bal, sav_act, sav_odc) = values
+    strings = [s.encode("utf-8") for s in (first, last, password)]
+    if max(map(len, strings)) > 0xFFFF:
+        raise ValueError(f"customer {cid}: name or password too long for a binary snapshot")
+    flags = 0
+    chk = sav = 0
+    if chk_bal not in (None, ""):
+        flags |= HAS_CHECKING | (CHECKING_ACTIVE if chk_act == "True" else 0)
+        chk = Money.parse(chk_bal).cents
+    if sav_bal not in (None, ""):
+        flags |= HAS_SAVINGS | (SAVINGS_ACTIVE if sav_act == "True" else 0)
+        sav = Money.parse(sav_bal).cents
+    record = RECORD.pack(int(cid), str_off, len(strings[0]), len(strings[1]), len(strings[2]), flags,
+                         chk, int(chk_odc or 0), sav, int(sav_odc or 0))
+    return record, b"".join(strings)
+
+def _strings(fields, buf, strings_start):
+    off = strings_start + fields[1]
+    n_first, n_last, n_pw = fields[2:5]
+    raw = buf[off:off + n_first + n_last + n_pw]
+    return (raw[:n_first].decode("utf-8"), raw[n_first:n_first + n_last].decode("utf-8"),
+            raw[n_first + n_last:].decode("utf-8"))
+
+def unpack_row(fields, buf, strings_start):
+    # One unpacked RECORD plus the buffer holding the string table -> a
+    # FIELDS-keyed dict.
+    cid, _, _, _, _, flags, chk, chk_odc, sav, sav_odc = fields
+    values = [str(cid), *_strings(fields, buf, strings_start)]
+    for present, active, cents, odc in ((HAS_CHECKING, CHECKING_ACTIVE, chk, chk_odc),
+                                        (HAS_SAVINGS, SAVINGS_ACTIVE, sav, sav_odc)):
+        if flags & present:
+            values += [str(Money(cents)), str(bool(flags & active)), str(odc)]
+        else:
+            values += ["", "", ""]
+    return dict(zip(BankStore.FIELDS, values))
+
+def unpack_customer(fields, buf, strings_start):
+    # Same as unpack_row, straight to a Customer without the string forms.
+    cid, _, _, _, _, flags, chk, chk_odc, sav, sav_odc = fields
+    checking = Account("checking", Money(chk), flags & CHECKING_ACTIVE, chk_odc) if flags & HAS_CHECKING else None
+    savings = Account("savings", Money(sav), flags & SAVINGS_ACTIVE, sav_odc) if flags & HAS_SAVINGS else None
+    return Customer(cid, *_strings(fields, buf, strings_start), checking, savings)
+
+class RecordTable:
+    # Read-only view over a mapped bank.bin. Indexing yields customer ids
+    # (so bisect can search it); rows are decoded only when asked for.
+    def __init__(self, path):
+        self.f = None
+        self.map = None
+        self.count = 0
+        self.strings_start = HEADER.size
+        try:
+            self.f = open(path, "rb")
+        except FileNotFoundError:
+            return
+        if os.fstat(self.f.fileno()).st_size == 0:
+            return
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} binary snapshot")
+        self.strings_start = HEADER.size + self.count * RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return struct.unpack_from("<q", self.map, HEADER.size + i * RECORD.size)[0]
+
+    def find(self, customer_id):
+        i = bisect.bisect_left(self, customer_id)
+        return i if i < self.count and self[i] == customer_id else None
+
+    def row(self, i):
+        return unpack_row(RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size), self.map, self.strings_start)
+
+    def records(self, per_chunk=4096):
+        # Record fields in slices of the mapping, so nothing holds a buffer
+        # on it between reads.
+        step = per_chunk * RECORD.size
+        for start in range(HEADER.size, self.strings_start, step):
+            yield from RECORD.iter_unpack(self.map[start:min(start + step, self.strings_start)])
+
+    def ids(self):
+        return [fields[0] for fields in self.records()]
+
+    def rows(self):
+        for fields in self.records():
+            yield unpack_row(fields, self.map, self.strings_start)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def write_binary(path, rows):
+    # Streams FIELDS-ordered value lists into path atomically. Records must
+    # end up sorted by id; input that is not already sorted is sorted in
+    # memory once written.
+    tmp_path = path + ".tmp"
+    count = 0
+    in_order = True
+    last_id = None
+    with open(tmp_path, "w+b") as f, tempfile.TemporaryFile() as strings:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+        str_off = 0
+        for values in rows:
+            record, data = pack_values(values, str_off)
+            cid = int(values[0])
+            if last_id is not None and cid <= last_id:
+                in_order = False
+            last_id = cid
+            f.write(record)
+            strings.write(data)
+            str_off += len(data)
+            count += 1
+        if not in_order:
+            f.seek(HEADER.size)
+            records = [f.read(RECORD.size) for _ in range(count)]
+            records.sort(key=lambda r: struct.unpack_from("<q", r)[0])
+            f.seek(HEADER.size)
+            f.write(b"".join(records))
+            del records
+        strings.seek(0)
+        while True:
+            chunk = strings.read(1 << 20)
+            if not chunk:
+                break
+            f.write(chunk)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+class BinaryStore(CsvStore):
+    # CsvStore with bank.bin as the snapshot. The mapped RecordTable stands
+    # in for CsvStore's offset index, so a lazy BankSystem starts without
+    # reading any customer.
+    def build_index(self):
+        journal, self.needs_checkpoint = self._read_journal()
+        self._journal_rows = len(journal)
+        self._overlay = {int(row["id"]): row for row in journal}
+        if self._offsets is not None:
+            self._offsets.close()
+        self._offsets = RecordTable(self.csv_path)
+
+    def get_row(self, customer_id):
+        row = self._overlay.get(customer_id)
+        if row is not None:
+            return row
+        i = self._offsets.find(customer_id)
+        return None if i is None else self._offsets.row(i)
+
+    def ids(self):
+        table = self._offsets
+        return table.ids() + [cid for cid in self._overlay if table.find(cid) is None]
+
+    def max_id(self):
+        table = self._offsets
+        return max(table[len(table) - 1] if len(table) else 0, max(self._overlay, default=0))
+
+    def iter_rows(self):
+        journal, self.needs_checkpoint = self._read_journal()
+        self._journal_rows = len(journal)
+        overlay = {row["id"]: row for row in journal}
+        table = RecordTable(self.csv_path)
+        try:
+            for row in table.rows():
+                yield overlay.pop(row["id"], row)
+        finally:
+            table.close()
+        yield from overlay.values()
+
+    def iter_customers(self, from_row):
+        # Snapshot records become Customers directly; only journal rows go
+        # through from_row.
+        journal, self.needs_checkpoint = self._read_journal()
+        self._journal_rows = len(journal)
+        overlay = {int(row["id"]): row for row in journal}
+        table = RecordTable(self.csv_path)
+        try:
+            for fields in table.records():
+                row = overlay.pop(fields[0], None)
+                yield from_row(row) if row is not None else unpack_customer(fields, table.map, table.strings_start)
+        finally:
+            table.close()
+        for row in overlay.values():
+            yield from_row(row)
+
+    def write_snapshot(self, rows):
+        write_binary(self.csv_path, rows)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "w", newline="", encoding="utf-8")
+        self._journal_rows = 0
+        self.needs_checkpoint = False
+        if self._offsets is not None:
+            self.build_index()
+
+    def close(self):
+        super().close()
+        if self._offsets is not None:
+            self._offsets.close()
+
+def convert(src, dst, log_path="transactions.csv"):
+    # Copies customers (journal included) between a CSV and a binary
+    # snapshot, picking each side's format from its suffix.
+    def open_side(path, log=None):
+        cls = BinaryStore if path.endswith(BINARY_SUFFIXES) else CsvStore
+        return cls(path, log_path, log=log)
+    source = open_side(src)
+    target = open_side(dst, source.log)
+    try:
+        count = 0
+        def rows():
+            nonlocal count
+            for row in source.iter_rows():
+                count += 1
+                yield [row.get(k) or "" for k in BankStore.FIELDS]
+        target.write_snapshot(rows())
+        target.save_aggregates(None)
+        return count
+    finally:
+        source.close()
+        target.close()
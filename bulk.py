@@ -0,0 +1,277 @@
+import argparse
+import csv
+import json
+import sys
+from banking import DEFAULT_KDF_ITERATIONS, BankSystem, Money, TransactionLog, hash_password
+
+TRUE_WORDS = ("1", "true", "y", "yes")
+
+def open_input(path):
+    if path == "-":
+        return sys.stdin
+    return open(path, newline="", encoding="utf-8")
+
+def open_output(path):
+    if path == "-":
+        return sys.stdout
+    return open(path, "w", newline="", encoding="utf-8")
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+def read_records(path, fmt):
+    f = open_input(path)
+    try:
+        if fmt == "jsonl":
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+class Progress:
+    def __init__(self, label, every):
+        self.label = label
+        self.every = every
+        self.count = 0
+
+    def tick(self):
+        self.count += 1
+        if self.every and self.count % self.every == 0:
+            print(f"{self.label}: {self.count} rows", file=sys.stderr)
+
+    def done(self):
+        print(f"{self.label}: {self.count} rows done", file=sys.stderr)
+
+def opening_account(record, kind):
+    balance = record.get(f"{kind}_balance")
+    if balance not in (None, ""):
+        balance = Money.of(balance)
+        if balance.cents < 0:
+            raise ValueError(f"negative opening {kind} balance")
+        return [str(balance), "True", "0"]
+    if str(record.get(f"open_{kind}") or "").strip().lower() in TRUE_WORDS:
+        return ["0.00", "True", "0"]
+    return ["", "", ""]
+
+def customer_values(record, customer_id, kdf_iterations):
+    first = str(record.get("first_name") or "").strip()
+    last = str(record.get("last_name") or "").strip()
+    password = str(record.get("password") or "")
+    if not first or not password:
+        raise ValueError("first_name and password are required")
+    accounts = opening_account(record, "checking") + opening_account(record, "savings")
+    return [str(customer_id), first, last, hash_password(password, kdf_iterations)] + accounts
+
+def import_customers(bank, records, every=0):
+    # Ids follow add_customer: one past the highest existing id. Existing
+    # rows and the new ones are streamed into a single snapshot write.
+    next_id = 10001
+    for row in bank.iter_customer_rows():
+        next_id = max(next_id, int(row["id"]) + 1)
+    stats = {"imported": 0, "skipped": 0, "first_id": next_id, "last_id": None}
+    progress = Progress("import", every)
+    def rows():
+        nonlocal next_id
+        for row in bank.iter_customer_rows():
+            yield [row.get(k) or "" for k in BankSystem.FIELDS]
+        for n, record in enumerate(records, 1):
+            progress.tick()
+            try:
+                values = customer_values(record, next_id, bank.kdf_iterations)
+            except (TypeError, ValueError) as e:
+                stats["skipped"] += 1
+                print(f"record {n} skipped: {e}", file=sys.stderr)
+                continue
+            stats["imported"] += 1
+            stats["last_id"] = next_id
+            next_id += 1
+            yield values
+    bank.write_snapshot(rows())
+    bank.close()
+    progress.done()
+    return stats
+
+def customer_matches(row, args):
+    cid = int(row["id"])
+    if args.min_id is not None and cid < args.min_id:
+        return False
+    if args.max_id is not None and cid > args.max_id:
+        return False
+    if args.account and not row.get(f"{args.account}_balance"):
+        return False
+    if args.status:
+        flags = [row.get(f"{k}_active") for k in ("checking", "savings") if row.get(f"{k}_balance")]
+        active = bool(flags) and all(flag == "True" for flag in flags)
+        if active != (args.status == "active"):
+            return False
+    return True
+
+def export_customers(bank, out, fmt, args, every=0):
+    fields = [k for k in BankSystem.FIELDS if args.with_passwords or k != "password"]
+    progress = Progress("export", every)
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(fields)
+    for row in bank.iter_customer_rows():
+        if not customer_matches(row, args):
+            continue
+        if writer:
+            writer.writerow([row.get(k) or "" for k in fields])
+        else:
+            out.write(json.dumps({k: row.get(k) or "" for k in fields}) + "\n")
+        progress.tick()
+    progress.done()
+    return progress.count
+
+def transaction_matches(row, args):
+    if args.customer is not None and row["customer_id"] != str(args.customer):
+        return False
+    if args.action and row["action"] != args.action:
+        return False
+    if args.status and row["status"] != args.status:
+        return False
+    if args.since and not (row["ts"] and row["ts"] >= args.since):
+        return False
+    if args.until and not (row["ts"] and row["ts"] < args.until):
+        return False
+    return True
+
+def export_transactions(log, out, fmt, args, every=0):
+    progress = Progress("export", every)
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(TransactionLog.FIELDS)
+    for row in log.iter_rows():
+        if not transaction_matches(row, args):
+            continue
+        if writer:
+            writer.writerow([row[k] for k in TransactionLog.FIELDS])
+        else:
+            out.write(json.dumps(row) + "\n")
+        progress.tick()
+    progress.done()
+    return progress.count
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Blue Sky Bank bulk tools")
+    parser.add_argument("--bank", default="bank.csv")
+    parser.add_argument("--log", default="transactions.csv")
+    parser.add_argument("--progress", type=int, default=10000, help="report every N rows (0 = off)")
+    parser.add_argument("--kdf-iterations", type=int, default=DEFAULT_KDF_ITERATIONS)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import-customers", help="append customers from a CSV or JSONL file")
+    p.add_argument("input", help="file path or - for stdin")
+    p.add_argument("--format", choices=("csv", "jsonl"))
+
+    p = sub.add_parser("export-customers", help="write customers to a CSV or JSONL file")
+    p.add_argument("output", help="file path or - for stdout")
+    p.add_argument("--format", choices=("csv", "jsonl"))
+    p.add_argument("--min-id", type=int)
+    p.add_argument("--max-id", type=int)
+    p.add_argument("--account", choices=("checking", "savings"))
+    p.add_argument("--status", choices=("active", "inactive"))
+    p.add_argument("--with-passwords", action="store_true")
+
+    p = sub.add_parser("export-transactions", help="write log rows to a CSV or JSONL file")
+    p.add_argument("output", help="file path or - for stdout")
+    p.add_argument("--format", choices=("csv", "jsonl"))
+    p.add_argument("--customer", type=int)
+    p.add_argument("--action")
+    p.add_argument("--status")
+    p.add_argument("--since", help="ISO timestamp, inclusive")
+    p.add_argument("--until", help="ISO timestamp, exclusive")
+
+    sub.add_parser("migrate-log", help="rewrite the transaction log in the current format")
+    sub.add_parser("rotate-log", help="archive the transaction log as a gzip segment and start a new one")
+    sub.add_parser("hash-passwords", help="hash every plaintext password in bank.csv now")
+
+    p = sub.add_parser("post-period", help="post savings interest and checking fees across every account")
+    p.add_argument("--interest-rate", default="0", help="per-period savings rate, e.g. 0.001")
+    p.add_argument("--maintenance-fee", default="0")
+    p.add_argument("--minimum-balance", default="0", help="checking below this pays the maintenance fee")
+    p.add_argument("--overdraft-fee", default="0", help="charged on overdrawn checking accounts")
+    p.add_argument("--no-numpy", action="store_true", help="use the pure-Python engine")
+
+    p = sub.add_parser("convert-sqlite", help="copy --bank and --log into a SQLite database")
+    p.add_argument("database", help="path of the .db file to create or fill")
+
+    p = sub.add_parser("convert-binary", help="copy --bank into a snapshot of the other format (.csv <-> .bin)")
+    p.add_argument("output", help="path of the .bin (or .csv) snapshot to write")
+
+    p = sub.add_parser("reconcile", help="check snapshot balances against the transaction log")
+    p.add_argument("--workers", type=int, help="processes reading the log (default: one per core)")
+    p.add_argument("--incremental", action="store_true", help="only read rows logged since the last run")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "import-customers":
+        bank = BankSystem(args.bank, log_path=args.log, kdf_iterations=args.kdf_iterations)
+        records = read_records(args.input, detect_format(args.input, args.format))
+        stats = import_customers(bank, records, args.progress)
+        print(json.dumps(stats))
+    elif args.command == "export-customers":
+        bank = BankSystem(args.bank, log_path=args.log)
+        out = open_output(args.output)
+        try:
+            export_customers(bank, out, detect_format(args.output, args.format), args, args.progress)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == "export-transactions":
+        log = TransactionLog(args.log)
+        out = open_output(args.output)
+        try:
+            export_transactions(log, out, detect_format(args.output, args.format), args, args.progress)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.command == "migrate-log":
+        migrated = TransactionLog(args.log).migrate()
+        print("Log migrated." if migrated else "Log already current.")
+    elif args.command == "rotate-log":
+        log = TransactionLog(args.log)
+        rotated = log.rotate()
+        log.close()
+        print("Log rotated." if rotated else "Log is empty.")
+    elif args.command == "hash-passwords":
+        bank = BankSystem(args.bank, log_path=args.log, kdf_iterations=args.kdf_iterations)
+        bank.load_from_csv()
+        count = bank.migrate_passwords()
+        bank.save_all_to_csv()
+        bank.close()
+        print(f"{count} passwords hashed.")
+    elif args.command == "post-period":
+        from posting import post_period
+        bank = BankSystem(args.bank, log_path=args.log)
+        bank.load_from_csv()
+        stats = post_period(bank, args.interest_rate, args.maintenance_fee, args.minimum_balance,
+                            args.overdraft_fee, use_numpy=False if args.no_numpy else None)
+        bank.close()
+        print(json.dumps(stats))
+    elif args.command == "convert-sqlite":
+        from sqlite_store import SqliteStore
+        store = SqliteStore(args.database)
+        customers, rows = store.import_csv(args.bank, args.log)
+        store.close()
+        print(json.dumps({"customers": customers, "log_rows": rows}))
+    elif args.command == "convert-binary":
+        from binstore import convert
+        print(json.dumps({"customers": convert(args.bank, args.output, args.log)}))
+    elif args.command == "reconcile":
+        from reconcile import has_issues, reconcile
+        report = reconcile(args.bank, args.log, workers=args.workers, incremental=args.incremental)
+        print(json.dumps(report))
+        return 1 if has_issues(report) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import threading
+import time
+from datetime import datetime
+from banking import Money
+
+# Rolling-window velocity limits for BankSystem(limits=VelocityLimits(...)).
+# Every (limit, customer[, account]) pair keeps a ring of time buckets with
+# running count and cents totals, so a check touches a fixed number of
+# slots however busy the account is. A window spans `buckets` buckets and
+# the oldest one drops out whole, so the effective window is between
+# window - window/buckets and window long. Counted are withdrawals and
+# transfers to other customers; moving money between one's own accounts is
+# not.
+
+WINDOWS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400}
+
+class Limit:
+    __slots__ = ("window", "max_count", "max_amount", "scope", "actions", "label")
+    def __init__(self, window, max_count=None, max_amount=None, scope="account", actions=("withdraw", "transfer")):
+        self.label = window if window in WINDOWS else f"{window}s"
+        self.window = WINDOWS.get(window) or int(window)
+        self.max_count = int(max_count) if max_count not in (None, "") else None
+        self.max_amount = Money.of(max_amount).cents if max_amount not in (None, "") else None
+        if scope not in ("account", "customer"):
+            raise ValueError("scope must be account or customer")
+        if self.window <= 0 or (self.max_count is None and self.max_amount is None):
+            raise ValueError("a limit needs a positive window and a count or amount")
+        self.scope = scope
+        self.actions = tuple(actions.split(",")) if isinstance(actions, str) else tuple(actions)
+
+    @classmethod
+    def parse(cls, text):
+        # "day:amount=500", "hour:count=5:scope=customer:actions=withdraw"
+        window, *options = text.split(":")
+        kw = {}
+        for option in options:
+            key, _, value = option.partition("=")
+            key = {"count": "max_count", "amount": "max_amount"}.get(key, key)
+            if key not in ("max_count", "max_amount", "scope", "actions"):
+                raise ValueError(f"unknown limit option: {option}")
+            kw[key] = value
+        return cls(window, **kw)
+
+    def describe(self):
+        parts = []
+        if self.max_count is not None:
+            parts.append(f"{self.max_count} transactions")
+        if self.max_amount is not None:
+            parts.append(f"${Money(self.max_amount)}")
+        where = "per account" if self.scope == "account" else "across accounts"
+        return f"at most {' and '.join(parts)} {where} per {self.label}"
+
+class Window:
+    # Ring of bucket totals; `last` is the newest bucket number seen.
+    __slots__ = ("width", "counts", "cents", "count", "total", "last")
+    def __init__(self, window, buckets):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.cents = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.last = None
+
+    def _advance(self, now):
+        b = int(now // self.width)
+        n = len(self.counts)
+        if self.last is None or b - self.last >= n:
+            self.counts = [0] * n
+            self.cents = [0] * n
+            self.count = self.total = 0
+            self.last = b
+        elif b > self.last:
+            for i in range(self.last + 1, b + 1):
+                slot = i % n
+                self.count -= self.counts[slot]
+                self.total -= self.cents[slot]
+                self.counts[slot] = self.cents[slot] = 0
+            self.last = b
+        return b
+
+    def totals(self, now):
+        self._advance(now)
+        return self.count, self.total
+
+    def add(self, now, cents):
+        b = self._advance(now)
+        if b <= self.last - len(self.counts):
+            return
+        slot = b % len(self.counts)
+        self.counts[slot] += 1
+        self.cents[slot] += cents
+        self.count += 1
+        self.total += cents
+
+def _action(action, account_type):
+    # Log rows -> the action a limit counts, or None for ones it ignores.
+    if action == "transfer":
+        return "transfer" if ":" in (account_type or "") else None
+    return action
+
+class VelocityLimits:
+    def __init__(self, *limits, buckets=24, clock=time.time):
+        self.limits = list(limits)
+        self.buckets = buckets
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _keys(self, customer_id, account_type, action):
+        for i, limit in enumerate(self.limits):
+            if action in limit.actions:
+                yield limit, (i, customer_id, account_type if limit.scope == "account" else None)
+
+    def _window(self, key, limit):
+        w = self._windows.get(key)
+        if w is None:
+            w = self._windows[key] = Window(limit.window, self.buckets)
+        return w
+
+    def check(self, customer_id, account_type, action, cents, now=None):
+        # The first limit this operation would break, else None.
+        now = self.clock() if now is None else now
+        with self._lock:
+            for limit, key in self._keys(customer_id, account_type, action):
+                count, total = self._window(key, limit).totals(now)
+                if ((limit.max_count is not None and count + 1 > limit.max_count)
+                        or (limit.max_amount is not None and total + cents > limit.max_amount)):
+                    return limit
+        return None
+
+    def record(self, customer_id, account_type, action, cents, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            for limit, key in self._keys(customer_id, account_type, action):
+                self._window(key, limit).add(now, cents)
+
+    def add_row(self, row, now=None):
+        if row.get("status") != "ok":
+            return
+        account_type = row.get("account_type") or ""
+        action = _action(row.get("action"), account_type)
+        if action is None:
+            return
+        try:
+            cid = int(row["customer_id"])
+            cents = Money.parse(row.get("amount") or "0").cents
+            ts = datetime.fromisoformat(row["ts"]).timestamp() if row.get("ts") else now
+        except (KeyError, TypeError, ValueError):
+            return
+        if ts is not None:
+            self.record(cid, account_type.partition("->")[0], action, cents, ts)
+
+    def rebuild(self, log, now=None):
+        # Replays the log rows young enough to matter, as found by
+        # log.iter_since, so startup reads only the tail of the log.
+        if not self.limits:
+            return
+        now = self.clock() if now is None else now
+        since = datetime.fromtimestamp(now - max(limit.window for limit in self.limits))
+        with self._lock:
+            self._windows = {}
+        for row in log.iter_since(since.isoformat(timespec="seconds")):
+            self.add_row(row)
+
+def from_specs(specs):
+    # --limit command line values -> VelocityLimits, or None without any.
+    return VelocityLimits(*[Limit.parse(spec) for spec in specs]) if specs else None
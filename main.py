@@ -1,4 +1,9 @@
-from banking import BankSystem
+import argparse
+import json
+import shlex
+import sys
+import time
+from banking import BankSystem, Money, Session, TransactionLog
 
 def pause():
     input("Press Enter to continue...")
@@ -7,7 +12,7 @@ def prompt_amount(msg):
     while True:
         s = input(msg).strip()
         try:
-            return float(s)
+            return Money.parse(s)
         except ValueError:
             print("Invalid amount. Please enter a number.")
 
@@ -40,7 +45,7 @@ def show_accounts(bs):
         print("No accounts yet.")
     else:
         if u.checking:
-            line = f"Checking: {u.checking.balance:.2f}"
+            line = f"Checking: {u.checking.balance}"
             if not u.checking.active or u.checking.overdraft_count > 0:
                 status = "inactive" if not u.checking.active else "active"
                 line += f" | {status}, overdrafts={u.checking.overdraft_count}"
@@ -48,7 +53,7 @@ def show_accounts(bs):
         else:
             print("Checking: N/A")
         if u.savings:
-            line = f"Savings:  {u.savings.balance:.2f}"
+            line = f"Savings:  {u.savings.balance}"
             if not u.savings.active or u.savings.overdraft_count > 0:
                 status = "inactive" if not u.savings.active else "active"
                 line += f" | {status}, overdrafts={u.savings.overdraft_count}"
@@ -124,7 +129,7 @@ def transfer_menu(bs):
         if int(target_id) == bs.current.id:
             info("Cannot transfer to your own ID here. Use internal transfer.")
             return
-        target = next((c for c in bs.customers if c.id == int(target_id)), None)
+        target = bs.get_customer(target_id)
         if target is None:
             info("Target customer not found.")
             return
@@ -141,8 +146,13 @@ def transfer_menu(bs):
     else:
         info("Invalid choice.")
 
-def fetch_all_user_tx(bs):
-    return bs.recent_transactions(limit=0)
+# History screens page through TransactionLog.query newest first, so only
+# the rows on screen are read and filtered.
+HISTORY_PAGE = 10
+MONEY_ACTIONS = ("deposit", "withdraw", "transfer", "transfer_in", "fee", "interest")
+
+def fetch_tx_page(bs, cursor=None, **filters):
+    return bs.query_transactions(cursor=cursor, page_size=HISTORY_PAGE, **filters)
 
 def print_tx_rows(rows):
     for r in rows:
@@ -154,41 +164,63 @@ def print_tx_rows(rows):
         newb = r["new_balance"] or "-"
         print(f"{act:<8} {acc:<14} {amt:>8} -> {newb}")
 
+def show_tx_pages(bs, title, empty_msg, **filters):
+    rows, cursor = fetch_tx_page(bs, **filters)
+    if not rows:
+        info(empty_msg)
+        return
+    print(f"\n--- {title} ---")
+    while True:
+        print_tx_rows(rows)
+        if cursor is None:
+            pause()
+            return
+        if input("n = older, Enter = back: ").strip().lower() != "n":
+            return
+        rows, cursor = fetch_tx_page(bs, cursor, **filters)
+        if not rows:
+            info("No older transactions.")
+            return
+
 def show_transactions_all(bs):
     if bs.current is None:
         info("Login first.")
         return
-    rows = fetch_all_user_tx(bs)
-    if not rows:
-        info("No transactions yet.")
-        return
-    print("\n--- All Transactions ---")
-    print_tx_rows(rows)
-    pause()
+    show_tx_pages(bs, "All Transactions", "No transactions yet.", actions=MONEY_ACTIONS)
 
 def show_transactions_filtered(bs, filter_kind):
     if bs.current is None:
         info("Login first.")
         return
-    rows = fetch_all_user_tx(bs)
     if filter_kind == "checking":
-        rows = [r for r in rows if r["action"] in ("deposit", "withdraw") and r["account_type"] == "checking"]
+        filters = {"actions": ("deposit", "withdraw"), "account_type": "checking"}
         title = "Checking Deposits/Withdrawals"
     elif filter_kind == "savings":
-        rows = [r for r in rows if r["action"] in ("deposit", "withdraw") and r["account_type"] == "savings"]
+        filters = {"actions": ("deposit", "withdraw"), "account_type": "savings"}
         title = "Savings Deposits/Withdrawals"
     elif filter_kind == "external":
-        rows = [r for r in rows if r["action"] == "transfer" and ":" in (r["account_type"] or "")]
+        filters = {"actions": "transfer", "external": True}
         title = "External Transfers"
     else:
         info("Invalid filter.")
         return
-    if not rows:
-        info("No transactions for this selection.")
+    show_tx_pages(bs, title, "No transactions for this selection.", **filters)
+
+def search_transactions(bs):
+    if bs.current is None:
+        info("Login first.")
         return
-    print(f"\n--- {title} ---")
-    print_tx_rows(rows)
-    pause()
+    print("Leave blank to skip a filter.")
+    filters = {
+        "since": input("From date (YYYY-MM-DD): ").strip(),
+        "until": input("Before date (YYYY-MM-DD): ").strip(),
+        "min_amount": input("Minimum amount: ").strip(),
+        "max_amount": input("Maximum amount: ").strip(),
+    }
+    try:
+        show_tx_pages(bs, "Search Results", "No transactions match.", actions=MONEY_ACTIONS, **filters)
+    except ValueError:
+        info("Invalid amount.")
 
 def transactions_menu(bs):
     while True:
@@ -198,6 +230,7 @@ def transactions_menu(bs):
         print("3. Savings only")
         print("4. External transfers only")
         print("5. Back")
+        print("6. Search by date or amount")
         ch = input("Choose: ").strip()
         if ch == "1":
             show_transactions_all(bs)
@@ -209,6 +242,8 @@ def transactions_menu(bs):
             show_transactions_filtered(bs, "external")
         elif ch == "5":
             return
+        elif ch == "6":
+            search_transactions(bs)
         else:
             info("Invalid choice.")
 
@@ -229,11 +264,8 @@ def create_missing(bs):
         confirm = input(f"Do you want to create {acc_type}? (y/n): ").strip().lower()
         if confirm == "y":
             try:
-                uid, pwd = bs.current.id, bs.current.password
                 bs.create_account(acc_type)
                 print(f"{acc_type.capitalize()} account created.")
-                bs.load_from_csv()
-                bs.login(uid, pwd)
             except Exception as e:
                 print(f"Error: {e}")
             pause()
@@ -242,6 +274,17 @@ def create_missing(bs):
         else:
             info("Invalid choice. Please enter y or n.")
 
+def show_summary(bs):
+    summary = bs.customer_summary()
+    print("\n--- Summary ---")
+    if not summary:
+        print("No activity yet.")
+    for key, entry in summary.items():
+        action, _, account_type = key.partition(":")
+        label = f"{action.replace('_', ' ')} ({account_type})" if account_type else action.replace("_", " ")
+        print(f"{label}: {entry['count']} totalling {entry['total']}")
+    pause()
+
 def login_menu(bs):
     def do_logout():
         bs.logout()
@@ -257,6 +300,7 @@ def login_menu(bs):
         print("6. Transfer")
         print("7. Logout")
         print("8. Exit")
+        print("9. Summary")
         choice = input("Choose: ").strip()
         actions = {
             "1": lambda: show_accounts(bs),
@@ -267,6 +311,7 @@ def login_menu(bs):
             "6": lambda: transfer_menu(bs),
             "7": do_logout,
             "8": lambda: (print("Goodbye!"), exit()),
+            "9": lambda: show_summary(bs),
         }
         act = actions.get(choice)
         if act:
@@ -276,9 +321,172 @@ def login_menu(bs):
         else:
             info("Invalid option.")
 
-def main():
-    bs = BankSystem("bank.csv")
+# Scripted mode: one command per line, either a JSON object like the
+# server protocol ({"op": "deposit", "account_type": "checking", ...}) or
+# words such as "deposit checking 25" with optional key=value arguments.
+# Every command gets one JSON result line and nothing waits for input.
+SCRIPT_ARGS = {
+    "login": ("customer_id", "password"),
+    "logout": (),
+    "add_customer": ("first_name", "last_name", "password", "open_checking", "open_savings"),
+    "deposit": ("account_type", "amount"),
+    "withdraw": ("account_type", "amount"),
+    "transfer": ("from_type", "to_type", "amount", "target_customer_id", "target_account_type"),
+    "create_account": ("account_type",),
+    "accounts": (),
+    "history": ("limit",),
+    "query": ("page_size", "cursor"),
+    "summary": (),
+}
+
+def parse_command(line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        return json.loads(line)
+    words = shlex.split(line)
+    cmd = {"op": words[0]}
+    positional = [w for w in words[1:] if "=" not in w]
+    names = SCRIPT_ARGS.get(words[0], ())
+    if len(positional) > len(names):
+        raise ValueError(f"too many arguments for {words[0]}")
+    cmd.update(zip(names, positional))
+    cmd.update(w.split("=", 1) for w in words[1:] if "=" in w)
+    return cmd
+
+def truthy(value):
+    return str(value).strip().lower() in ("1", "true", "y", "yes")
+
+def run_command(bs, cmd):
+    op = cmd.get("op")
+    if op == "login":
+        c = bs.login(cmd["customer_id"], str(cmd["password"]))
+        return {"message": f"Welcome, {c.first_name} {c.last_name}!", "customer_id": c.id}
+    if op == "add_customer":
+        c = bs.add_customer(cmd["first_name"], cmd.get("last_name", ""), str(cmd["password"]),
+                            open_checking=truthy(cmd.get("open_checking")),
+                            open_savings=truthy(cmd.get("open_savings")))
+        return {"message": f"Customer created. Your ID is {c.id}", "customer_id": c.id}
+    if op not in SCRIPT_ARGS:
+        raise ValueError(f"unknown op: {op}")
+    if bs.current is None:
+        raise PermissionError("login required")
+    if op == "logout":
+        bs.logout()
+        return {"message": "Logged out."}
+    key = cmd.get("idempotency_key")
+    if op == "deposit":
+        return {"message": bs.deposit(cmd["account_type"], cmd["amount"], idempotency_key=key)}
+    if op == "withdraw":
+        return {"message": bs.withdraw(cmd["account_type"], cmd["amount"], idempotency_key=key)}
+    if op == "transfer":
+        to_type = cmd.get("to_type")
+        return {"message": bs.transfer(cmd["from_type"], None if to_type in (None, "", "-") else to_type,
+                                       cmd["amount"], cmd.get("target_customer_id"), cmd.get("target_account_type"),
+                                       idempotency_key=key)}
+    if op == "create_account":
+        acc = bs.create_account(cmd["account_type"])
+        return {"message": f"{acc.type.capitalize()} account created."}
+    if op == "accounts":
+        return {"accounts": Session(bs, bs.current).accounts()}
+    if op == "history":
+        return {"rows": bs.recent_transactions(limit=int(cmd.get("limit", 20)))}
+    if op == "query":
+        filters = {k: cmd[k] for k in TransactionLog.QUERY_FILTERS if k in cmd}
+        if "external" in filters:
+            filters["external"] = truthy(filters["external"])
+        rows, cursor = bs.query_transactions(cursor=cmd.get("cursor"), page_size=int(cmd.get("page_size", 20)),
+                                             **filters)
+        return {"rows": rows, "cursor": cursor}
+    return {"summary": bs.customer_summary()}
+
+def run_script(bs, lines, out, stop_on_error=False):
+    # Returns {"commands", "errors", "seconds"}; results go to out.
+    stats = {"commands": 0, "errors": 0}
+    start = time.perf_counter()
+    for n, line in enumerate(lines, 1):
+        try:
+            cmd = parse_command(line)
+            if cmd is None:
+                continue
+            result = {"line": n, "op": cmd.get("op"), "ok": True}
+            result.update(run_command(bs, cmd))
+        except KeyError as e:
+            result = {"line": n, "ok": False, "error": f"missing argument: {e.args[0]}"}
+        except (ValueError, TypeError, PermissionError) as e:
+            result = {"line": n, "ok": False, "error": str(e)}
+        except Exception as e:
+            # One failing step is reported like any other; the replay goes on.
+            result = {"line": n, "ok": False, "error": f"internal error: {e}"}
+        stats["commands"] += 1
+        if not result["ok"]:
+            stats["errors"] += 1
+        out.write(json.dumps(result) + "\n")
+        if stop_on_error and not result["ok"]:
+            break
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Blue Sky Bank teller")
+    parser.add_argument("--bank", default="bank.csv")
+    parser.add_argument("--log", default="transactions.csv")
+    parser.add_argument("--segment-mb", type=float, default=0, help="archive the log in segments of this size")
+    parser.add_argument("--metrics-jsonl", help="append one JSON line per operation to this file")
+    parser.add_argument("--prometheus", help="write Prometheus text metrics to this file on exit")
+    parser.add_argument("--profile", help="cProfile the session and save the stats to this file")
+    parser.add_argument("--script", help="run commands from this file (- for stdin) instead of the menus")
+    parser.add_argument("--output", help="write scripted results here instead of stdout")
+    parser.add_argument("--stop-on-error", action="store_true")
+    parser.add_argument("--limit", action="append", default=[],
+                        help="rolling velocity limit, e.g. day:amount=500 or hour:count=5:scope=customer")
+    return parser
+
+def open_metrics(args):
+    if not (args.metrics_jsonl or args.prometheus or args.profile):
+        return None
+    from metrics import JsonlSink, Metrics, PrometheusSink
+    sinks = []
+    if args.metrics_jsonl:
+        sinks.append(JsonlSink(args.metrics_jsonl))
+    if args.prometheus:
+        sinks.append(PrometheusSink(args.prometheus))
+    metrics = Metrics(*sinks)
+    if args.profile:
+        metrics.start_profile()
+    return metrics
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from limits import from_specs
+    metrics = open_metrics(args)
+    log = TransactionLog(args.log, segment_bytes=int(args.segment_mb * 2 ** 20)) if args.segment_mb else None
+    bs = BankSystem(args.bank, log_path=args.log, log=log, lazy=True, metrics=metrics,
+                    limits=from_specs(args.limit))
     bs.load_from_csv()
+    try:
+        if args.script:
+            source = sys.stdin if args.script == "-" else open(args.script, encoding="utf-8")
+            out = sys.stdout if not args.output else open(args.output, "w", encoding="utf-8")
+            try:
+                stats = run_script(bs, source, out, args.stop_on_error)
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+                if out is not sys.stdout:
+                    out.close()
+            print(json.dumps(stats), file=sys.stderr)
+            return 1 if stats["errors"] else 0
+        menu(bs)
+    finally:
+        bs.close()
+        if metrics is not None:
+            if args.profile:
+                metrics.stop_profile(args.profile)
+            metrics.close()
+
+def menu(bs):
     while True:
         print("\n--- Blue Sky Bank ---")
         print("1. Login")
@@ -321,4 +529,4 @@ def main():
             info("Invalid option.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
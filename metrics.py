@@ -0,0 +1,183 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+# Optional instrumentation for BankSystem(metrics=Metrics(...)). Each
+# operation is a Span whose phases (lock, validate, rules, journal, log,
+# checkpoint) are timed with perf_counter; finished spans go to the sinks as
+# plain dict events. With metrics=None the operations skip all of this.
+
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+class Span:
+    __slots__ = ("op", "start", "last", "phases")
+    def __init__(self, op):
+        self.op = op
+        self.start = self.last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        # Charges the time since the previous mark to phase.
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+class Histogram:
+    __slots__ = ("counts", "total", "n")
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.n += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        rank = q * self.n
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+class MemorySink:
+    # Histograms per (op, phase) plus operation and rejection counters.
+    def __init__(self):
+        self.histograms = {}
+        self.ops = {}
+        self.rejections = {}
+
+    def record(self, event):
+        op = event["op"]
+        for phase, seconds in list(event["phases"].items()) + [("total", event["total"])]:
+            hist = self.histograms.get((op, phase))
+            if hist is None:
+                hist = self.histograms[(op, phase)] = Histogram()
+            hist.observe(seconds)
+        key = (op, event["status"])
+        self.ops[key] = self.ops.get(key, 0) + 1
+        if event["reason"]:
+            key = (op, event["reason"])
+            self.rejections[key] = self.rejections.get(key, 0) + 1
+
+    def snapshot(self):
+        return {
+            "ops": {f"{op}:{status}": n for (op, status), n in sorted(self.ops.items())},
+            "rejections": {f"{op}:{reason}": n for (op, reason), n in sorted(self.rejections.items())},
+            "timings": {f"{op}:{phase}": {"n": h.n, "mean_us": round(h.total / h.n * 1e6, 1),
+                                          "p50_le_us": h.quantile(0.5) * 1e6, "p99_le_us": h.quantile(0.99) * 1e6}
+                        for (op, phase), h in sorted(self.histograms.items())},
+        }
+
+    def close(self):
+        pass
+
+class JsonlSink:
+    # One JSON line per finished operation.
+    def __init__(self, path):
+        self.f = open(path, "a", encoding="utf-8")
+
+    def record(self, event):
+        self.f.write(json.dumps(event) + "\n")
+
+    def close(self):
+        self.f.close()
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class PrometheusSink(MemorySink):
+    # Prometheus text exposition written to a local file (for a node
+    # exporter textfile collector) on close, on dump() and every `every`
+    # events.
+    def __init__(self, path, every=0):
+        super().__init__()
+        self.path = path
+        self.every = every
+        self._events = 0
+
+    def record(self, event):
+        super().record(event)
+        self._events += 1
+        if self.every and self._events % self.every == 0:
+            self.dump()
+
+    def render(self):
+        lines = ["# TYPE bank_op_seconds histogram"]
+        for (op, phase), h in sorted(self.histograms.items()):
+            labels = f'op="{_label(op)}",phase="{_label(phase)}"'
+            seen = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                seen += count
+                lines.append(f'bank_op_seconds_bucket{{{labels},le="{bound}"}} {seen}')
+            lines.append(f'bank_op_seconds_bucket{{{labels},le="+Inf"}} {h.n}')
+            lines.append(f"bank_op_seconds_sum{{{labels}}} {h.total:.9f}")
+            lines.append(f"bank_op_seconds_count{{{labels}}} {h.n}")
+        lines.append("# TYPE bank_ops_total counter")
+        for (op, status), n in sorted(self.ops.items()):
+            lines.append(f'bank_ops_total{{op="{_label(op)}",status="{_label(status)}"}} {n}')
+        lines.append("# TYPE bank_rejections_total counter")
+        for (op, reason), n in sorted(self.rejections.items()):
+            lines.append(f'bank_rejections_total{{op="{_label(op)}",reason="{_label(reason)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.dump()
+
+class Metrics:
+    def __init__(self, *sinks):
+        self.sinks = list(sinks) or [MemorySink()]
+        self._lock = threading.Lock()
+        self._profiler = None
+
+    def start(self, op):
+        return Span(op)
+
+    def finish(self, span, reason=None):
+        event = {"ts": time.time(), "op": span.op, "status": "rejected" if reason else "ok", "reason": reason,
+                 "total": time.perf_counter() - span.start, "phases": span.phases}
+        with self._lock:
+            for sink in self.sinks:
+                sink.record(event)
+
+    def start_profile(self):
+        # cProfile for the calling thread until stop_profile().
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop_profile(self, path=None, top=25):
+        # Saves raw stats to path when given and returns the top functions
+        # by cumulative time as text.
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return ""
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        return out.getvalue()
+
+    def close(self):
+        self.stop_profile()
+        with self._lock:
+            for sink in self.sinks:
+                sink.close()
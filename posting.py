@@ -0,0 +1,133 @@
+import time
+from decimal import Decimal
+from fractions import Fraction
+from banking import Money
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Period-end posting over the whole book: interest on savings, maintenance
+# and overdraft fees on checking. Deactivated accounts are frozen and get
+# neither. An overdraft fee counts as an overdraft like the one withdraw
+# charges, so a customer reaching three has every account deactivated.
+
+def gather(customers):
+    cols = {k: [] for k in ("chk_cents", "chk_active", "chk_odc", "sav_cents", "sav_active", "sav_odc")}
+    for c in customers:
+        for prefix, acc in (("chk", c.checking), ("sav", c.savings)):
+            cols[prefix + "_cents"].append(acc.cents if acc else 0)
+            cols[prefix + "_active"].append(bool(acc and acc.active))
+            cols[prefix + "_odc"].append(acc.overdraft_count if acc else 0)
+    return cols
+
+def compute_python(cols, rule):
+    num2, den2 = 2 * rule["num"], 2 * rule["den"]
+    interest = [(cents * num2 + rule["den"]) // den2 if active and cents > 0 else 0
+                for cents, active in zip(cols["sav_cents"], cols["sav_active"])]
+    fees, overdrafted, deactivate = [], [], []
+    for cents, active, chk_odc, sav_odc in zip(cols["chk_cents"], cols["chk_active"],
+                                               cols["chk_odc"], cols["sav_odc"]):
+        over = active and cents < 0 and rule["overdraft_fee"] > 0
+        maint = active and 0 <= cents < rule["minimum_balance"] and rule["maintenance_fee"] > 0
+        fees.append(rule["overdraft_fee"] if over else rule["maintenance_fee"] if maint else 0)
+        overdrafted.append(over)
+        deactivate.append(over and chk_odc + sav_odc + 1 >= 3)
+    touched = [i for i, (a, b) in enumerate(zip(interest, fees)) if a or b]
+    return interest, fees, overdrafted, deactivate, touched
+
+def compute_numpy(cols, rule):
+    chk = np.array(cols["chk_cents"], dtype=np.int64)
+    sav = np.array(cols["sav_cents"], dtype=np.int64)
+    chk_active = np.array(cols["chk_active"], dtype=bool)
+    sav_active = np.array(cols["sav_active"], dtype=bool)
+    odc = np.array(cols["chk_odc"], dtype=np.int64) + np.array(cols["sav_odc"], dtype=np.int64)
+    interest = np.where(sav_active & (sav > 0), (sav * (2 * rule["num"]) + rule["den"]) // (2 * rule["den"]), 0)
+    over = chk_active & (chk < 0) & (rule["overdraft_fee"] > 0)
+    maint = chk_active & (chk >= 0) & (chk < rule["minimum_balance"]) & (rule["maintenance_fee"] > 0)
+    fees = np.where(over, rule["overdraft_fee"], np.where(maint, rule["maintenance_fee"], 0))
+    deactivate = over & (odc + 1 >= 3)
+    touched = np.flatnonzero((interest != 0) | (fees != 0))
+    return interest.tolist(), fees.tolist(), over.tolist(), deactivate.tolist(), touched.tolist()
+
+def numpy_safe(cols, rule):
+    # int64 products must not overflow; huge balances or rates with long
+    # denominators fall back to Python ints.
+    if np is None:
+        return False
+    biggest = max(max(map(abs, cols["sav_cents"]), default=0), 1)
+    return biggest * 2 * rule["num"] + rule["den"] < 2 ** 62
+
+def post_period(bank, interest_rate="0", maintenance_fee="0", minimum_balance="0", overdraft_fee="0",
+                use_numpy=None):
+    # Runs with the bank quiet (it holds _io_lock, not the customer locks),
+    # logs every posting in one append and ends with one snapshot.
+    rate = Fraction(Decimal(str(interest_rate)))
+    if rate < 0:
+        raise ValueError("interest rate must not be negative")
+    rule = {"num": rate.numerator, "den": rate.denominator}
+    for name, value in (("maintenance_fee", maintenance_fee), ("minimum_balance", minimum_balance),
+                        ("overdraft_fee", overdraft_fee)):
+        rule[name] = Money.of(value).cents
+        if rule[name] < 0:
+            raise ValueError(f"{name} must not be negative")
+    timings = {}
+    clock = time.perf_counter()
+    def lap(name):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[name] = round(now - clock, 4)
+        clock = now
+    with bank._io_lock:
+        customers = list(bank.iter_customers())
+        cols = gather(customers)
+        lap("gather")
+        vectorized = numpy_safe(cols, rule) if use_numpy is None else bool(use_numpy and numpy_safe(cols, rule))
+        compute = compute_numpy if vectorized else compute_python
+        interest, fees, overdrafted, deactivate, touched = compute(cols, rule)
+        lap("compute")
+        stats = {"engine": "numpy" if vectorized else "python", "customers": len(customers),
+                 "interest_count": 0, "interest_total": 0, "fee_count": 0, "fee_total": 0, "deactivated": 0}
+        rows = []
+        changed = []
+        for i in touched:
+            c = customers[i]
+            if interest[i]:
+                acc = c.savings
+                prev = acc.balance
+                acc.cents += interest[i]
+                stats["interest_count"] += 1
+                stats["interest_total"] += interest[i]
+                rows.append({"customer_id": c.id, "action": "interest", "account_type": "savings",
+                             "amount": str(Money(interest[i])), "fee": "0.00", "prev_balance": str(prev),
+                             "new_balance": str(acc.balance), "status": "ok", "message": "Interest posted."})
+            if fees[i]:
+                acc = c.checking
+                prev = acc.balance
+                acc.cents -= fees[i]
+                msg = "Maintenance fee applied."
+                if overdrafted[i]:
+                    acc.overdraft_count += 1
+                    msg = "Overdraft fee applied."
+                if deactivate[i]:
+                    bank._deactivate_customer_accounts(c)
+                    stats["deactivated"] += 1
+                    msg = "Overdraft fee applied. Account deactivated."
+                stats["fee_count"] += 1
+                stats["fee_total"] += fees[i]
+                rows.append({"customer_id": c.id, "action": "fee", "account_type": "checking",
+                             "amount": str(Money(fees[i])), "fee": "0.00", "prev_balance": str(prev),
+                             "new_balance": str(acc.balance), "status": "ok", "message": msg})
+            changed.append(c)
+        lap("apply")
+        for row in rows:
+            bank.aggregates.add_row(row)
+        bank.store.commit([bank._row_values(c) for c in changed], rows)
+        lap("commit")
+        bank.save_all_to_csv()
+        lap("snapshot")
+    stats["interest_total"] = str(Money(stats["interest_total"]))
+    stats["fee_total"] = str(Money(stats["fee_total"]))
+    stats["timings"] = timings
+    return stats
@@ -0,0 +1,248 @@
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from banking import Money, TransactionLog, open_store
+
+# Checks the snapshot (bank.csv plus its journal) against the transaction
+# log. Every row carrying an account's balances must start from where that
+# account's previous row ended plus what was transferred into it in between,
+# and the balance after its last row must be the snapshot's.
+#
+# The log is cut into byte ranges: archived segments whole, the active file
+# at row boundaries looked up in its .idx sidecar. A process pool reduces
+# each range to per-account summaries (first prev_balance, last new_balance,
+# credits around them) and gaps inside the range; the summaries are then
+# chained per account in log order. The first row seen for an account is
+# taken on trust, since opening balances (bulk imports, create_account)
+# are not logged. A watermark next to the snapshot keeps the position
+# reached and the balances there, so an incremental run reads only newer
+# rows; it is dropped once the log is migrated or rotated.
+
+WATERMARK_VERSION = 1
+
+def _account_of(row):
+    # A log row -> (customer id, account its balances describe, credited
+    # (customer id, account) or None). Targets on another shard are credited
+    # by that shard's transfer_in row.
+    cid = row["customer_id"]
+    account_type = row["account_type"] or ""
+    if row["action"] != "transfer":
+        return cid, account_type, None
+    src, _, dst = account_type.partition("->")
+    if ":" not in dst:
+        return cid, src, (cid, dst) if dst else None
+    target, _, dst_type = dst.rpartition(":")
+    target, _, shard = target.partition("@")
+    return cid, src, None if shard else (target, dst_type)
+
+def summarise(rows):
+    # (position, row) pairs in log order -> summary of the range. Accounts
+    # map to [first position, first prev, credits before it, last new,
+    # credits after it, rows].
+    accounts = {}
+    gaps = []
+    invalid = []
+    count = skipped = 0
+    for pos, row in rows:
+        count += 1
+        if not row["prev_balance"] and not row["new_balance"]:
+            # login, logout and add_customer rows move no money.
+            skipped += 1
+            continue
+        try:
+            cid, account_type, credit = _account_of(row)
+            int(cid)
+            prev = Money.parse(row["prev_balance"]).cents
+            new = Money.parse(row["new_balance"]).cents
+            amount = Money.parse(row["amount"] or "0").cents
+        except (TypeError, ValueError):
+            invalid.append({"position": pos, "customer_id": row.get("customer_id"), "action": row.get("action")})
+            continue
+        key = (cid, account_type)
+        s = accounts.get(key)
+        if s is None:
+            s = accounts[key] = [None, None, 0, None, 0, 0]
+        if not s[5]:
+            s[0], s[1] = pos, prev
+        elif s[3] + s[4] != prev:
+            gaps.append({"customer_id": cid, "account_type": account_type, "position": pos,
+                         "expected": str(Money(s[3] + s[4])), "found": str(Money(prev))})
+        s[3], s[4] = new, 0
+        s[5] += 1
+        if credit is not None and row["status"] == "ok":
+            t = accounts.get(credit)
+            if t is None:
+                t = accounts[credit] = [None, None, 0, None, 0, 0]
+            t[2 if not t[5] else 4] += amount
+    return {"rows": count, "skipped": skipped, "accounts": accounts, "gaps": gaps, "invalid": invalid}
+
+def _range_rows(path, base, start, end, columns):
+    # (logical position, row) for the records of one range. Segments are
+    # read from the top for their header; the active file is entered at
+    # start, which is always a record boundary.
+    opener = gzip.open if columns is None else open
+    with opener(path, "rb") as f:
+        if columns is None:
+            records = TransactionLog._iter_records(f, 0)
+            next(records, None)
+            _, header = next(records, (0, b""))
+            columns = next(csv.reader([header.decode("utf-8")]), [])
+        else:
+            f.seek(start)
+            records = TransactionLog._iter_records(f, start)
+        legacy = ["ts"] + columns if "ts" not in columns else None
+        for offset, raw in records:
+            if offset < start:
+                continue
+            if end is not None and offset >= end:
+                break
+            values = next(csv.reader([raw.decode("utf-8")]), [])
+            if values:
+                row = dict.fromkeys(TransactionLog.FIELDS, "")
+                row.update(zip(legacy if legacy and len(values) == len(columns) + 1 else columns, values))
+                yield base + offset, row
+
+def scan_range(task):
+    return summarise(_range_rows(*task))
+
+def _split_points(log, parts):
+    # Row offsets at evenly spaced places in the .idx sidecar, whose lines
+    # follow the log's own order, so no log bytes are read to find them.
+    header = len(log._index_header())
+    size = os.path.getsize(log.index_path)
+    points = set()
+    with open(log.index_path, "rb") as f:
+        for k in range(1, parts):
+            f.seek(header + (size - header) * k // parts)
+            f.readline()
+            line = f.readline()
+            if line.endswith(b"\n"):
+                points.add(int(next(csv.reader([line.decode("utf-8")]))[1]))
+    return sorted(points)
+
+def plan(log, start, parts):
+    # The ranges holding rows from logical position start on, oldest first.
+    tasks = []
+    base = 0
+    for seg in log.segments:
+        if start < base + seg["bytes"]:
+            tasks.append((log._segment_path(seg), base, max(0, start - base), None, None))
+        base += seg["bytes"]
+    first = max(log._data_start, start - base)
+    end = log._indexed_to
+    bounds = [first] + [p for p in _split_points(log, parts) if first < p < end] + [end]
+    for a, b in zip(bounds, bounds[1:]):
+        tasks.append((log.csv_path, base, a, b, log.columns))
+    return tasks
+
+def load_watermark(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get("version") != WATERMARK_VERSION:
+        return None
+    return data
+
+def _log_identity(log):
+    # Positions only carry over while the active file keeps its layout and
+    # segment: migrate() rewrites it and rotate() replaces it.
+    return getattr(log, "version", None), getattr(log, "seq", None)
+
+def save_watermark(path, position, balances, log=None):
+    version, seq = _log_identity(log)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": WATERMARK_VERSION, "position": position, "log_version": version, "log_seq": seq,
+                   "balances": {f"{cid}:{kind}": cents for (cid, kind), cents in balances.items()}}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def reconcile(bank_path, log_path="transactions.csv", workers=None, incremental=False, watermark_path=None):
+    # Returns a report of gaps (rows not following on from the account's
+    # previous balance), mismatches (log and snapshot disagree at the end),
+    # orphans (log activity on accounts the snapshot lacks) and unparseable
+    # rows, then saves the watermark. Rows without balances are skipped. Run it while the bank is idle; rows
+    # committed mid-run show up as mismatches.
+    started = time.perf_counter()
+    workers = max(1, workers or os.cpu_count() or 1)
+    watermark_path = watermark_path or bank_path + ".recon"
+    store = open_store(bank_path, log_path)
+    log = store.log
+    try:
+        end = log.position()
+        mark = load_watermark(watermark_path) if incremental else None
+        if mark is not None and (mark["position"] > end or
+                                 (mark.get("log_version"), mark.get("log_seq")) != _log_identity(log)):
+            mark = None
+        start = mark["position"] if mark else 0
+        balances = {}
+        if mark:
+            for key, cents in mark["balances"].items():
+                cid, _, kind = key.rpartition(":")
+                balances[(cid, kind)] = cents
+        if isinstance(log, TransactionLog):
+            tasks = plan(log, start, workers * 4 if workers > 1 else 1)
+            if workers > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    summaries = list(pool.map(scan_range, tasks))
+            else:
+                summaries = [scan_range(task) for task in tasks]
+        else:
+            # Logs without byte positions (SQLite) are read in one pass.
+            summaries = [summarise((None, row) for row in log.iter_rows(start))]
+
+        report = {"start": start, "position": end, "rows": 0, "skipped": 0, "ranges": len(summaries), "accounts": 0,
+                  "gaps": [], "mismatches": [], "orphans": [], "invalid": []}
+        active = {}
+        for summary in summaries:
+            report["rows"] += summary["rows"]
+            report["skipped"] += summary["skipped"]
+            report["gaps"] += summary["gaps"]
+            report["invalid"] += summary["invalid"]
+            for key, (first_pos, first_prev, before, last_new, after, rows) in summary["accounts"].items():
+                active[key] = active.get(key, 0) + rows
+                balance = balances.get(key)
+                if rows:
+                    if balance is not None and balance + before != first_prev:
+                        report["gaps"].append({"customer_id": key[0], "account_type": key[1],
+                                               "position": first_pos, "expected": str(Money(balance + before)),
+                                               "found": str(Money(first_prev))})
+                    balances[key] = last_new + after
+                elif balance is not None:
+                    balances[key] = balance + before
+
+        customers = set()
+        for row in store.iter_rows():
+            customers.add(row["id"])
+            for kind in ("checking", "savings"):
+                if row.get(f"{kind}_balance") in (None, ""):
+                    continue
+                key = (row["id"], kind)
+                active.pop(key, None)
+                balance = balances.get(key)
+                if balance is None:
+                    continue
+                report["accounts"] += 1
+                snapshot = Money.parse(row[f"{kind}_balance"]).cents
+                if snapshot != balance:
+                    report["mismatches"].append({"customer_id": key[0], "account_type": kind,
+                                                 "log": str(Money(balance)), "snapshot": str(Money(snapshot))})
+        for (cid, kind), rows in sorted(active.items()):
+            balances.pop((cid, kind), None)
+            report["orphans"].append({"customer_id": cid, "account_type": kind, "rows": rows,
+                                      "reason": "no such account" if cid in customers else "no such customer"})
+        save_watermark(watermark_path, end, balances, log)
+    finally:
+        store.close()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+def has_issues(report):
+    return any(report[k] for k in ("gaps", "mismatches", "orphans", "invalid"))
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import socketserver
+import sys
+import traceback
+from banking import BankSystem, TransactionLog
+
+class SessionHandler(socketserver.StreamRequestHandler):
+    # One connection is one teller session. Each request is a JSON object on
+    # its own line and gets exactly one JSON line back.
+    def handle(self):
+        self.session = None
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                reply = self.dispatch(request)
+            except (ValueError, TypeError, KeyError, PermissionError) as e:
+                reply = {"ok": False, "error": str(e)}
+            except Exception as e:
+                # Still one reply per request; the session stays open.
+                traceback.print_exc(file=sys.stderr)
+                reply = {"ok": False, "error": f"internal error: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+    def dispatch(self, request):
+        bank = self.server.bank
+        op = request.get("op")
+        if op == "login":
+            if "token" in request:
+                session = bank.resume_session(request["token"])
+            else:
+                session = bank.open_session(request["customer_id"], str(request["password"]))
+            c = session.customer
+            token = bank.issue_token(c)
+            # Switch only once the login fully succeeded.
+            self.session = session
+            return {"ok": True, "message": f"Welcome, {c.first_name} {c.last_name}!", "customer_id": c.id,
+                    "token": token}
+        if op == "add_customer":
+            c = bank.add_customer(request["first_name"], request.get("last_name", ""), str(request["password"]),
+                                  open_checking=bool(request.get("open_checking")),
+                                  open_savings=bool(request.get("open_savings")))
+            return {"ok": True, "message": f"Customer created. Your ID is {c.id}", "customer_id": c.id}
+        if self.session is None:
+            raise PermissionError("login required")
+        if op == "logout":
+            if hasattr(self.session, "logout"):
+                self.session.logout()
+            self.session = None
+            return {"ok": True, "message": "Logged out."}
+        key = request.get("idempotency_key")
+        if op == "deposit":
+            return {"ok": True, "message": self.session.deposit(request["account_type"], request["amount"],
+                                                                idempotency_key=key)}
+        if op == "withdraw":
+            return {"ok": True, "message": self.session.withdraw(request["account_type"], request["amount"],
+                                                                 idempotency_key=key)}
+        if op == "transfer":
+            msg = self.session.transfer(request["from_type"], request.get("to_type"), request["amount"],
+                                        request.get("target_customer_id"), request.get("target_account_type"),
+                                        idempotency_key=key)
+            return {"ok": True, "message": msg}
+        if op == "create_account":
+            acc = self.session.create_account(request["account_type"])
+            return {"ok": True, "message": f"{acc.type.capitalize()} account created."}
+        if op == "accounts":
+            return {"ok": True, "accounts": self.session.accounts()}
+        if op == "history":
+            return {"ok": True, "rows": self.session.recent_transactions(limit=int(request.get("limit", 20)))}
+        if op == "query":
+            filters = {k: request[k] for k in TransactionLog.QUERY_FILTERS if k in request}
+            rows, cursor = self.session.query_transactions(cursor=request.get("cursor"),
+                                                           page_size=int(request.get("page_size", 20)), **filters)
+            return {"ok": True, "rows": rows, "cursor": cursor}
+        raise ValueError(f"unknown op: {op}")
+
+class BankTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    def __init__(self, address, bank):
+        super().__init__(address, SessionHandler)
+        self.bank = bank
+
+class BankUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    def __init__(self, path, bank):
+        super().__init__(path, SessionHandler)
+        self.bank = bank
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Blue Sky Bank session server")
+    parser.add_argument("--bank", default="bank.csv")
+    parser.add_argument("--log", default="transactions.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--shards", type=int, default=0, help="run N shard worker processes (0 = one bank)")
+    parser.add_argument("--data", default="shards", help="data directory for --shards")
+    parser.add_argument("--limit", action="append", default=[],
+                        help="rolling velocity limit, e.g. day:amount=500 (single bank only)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.shards:
+        from shard import ShardRouter
+        bank = ShardRouter(args.data, args.shards)
+    else:
+        from limits import from_specs
+        bank = BankSystem(args.bank, log_path=args.log, limits=from_specs(args.limit))
+        bank.load_from_csv()
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = BankUnixServer(args.unix, bank)
+        where = args.unix
+    else:
+        server = BankTCPServer((args.host, args.port), bank)
+        where = "%s:%d" % server.server_address[:2]
+    print(f"Blue Sky Bank listening on {where}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        bank.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+import json
+import multiprocessing
+import os
+import secrets
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from banking import TRANSACTION_LIMIT, ZERO, BankSystem, IdempotencyCache, Money, Session, _Txn
+
+# Customers are spread over worker processes by id % shards, each shard with
+# its own bank.csv and transactions.csv. A transfer whose target lives on
+# another shard runs as a two-phase commit driven by ShardRouter: the source
+# shard prepares the debit (validating it and holding the customer's
+# outgoing funds), the target shard prepares the credit, the router records
+# the commit decision durably and both shards apply it. A prepared
+# transaction with no recorded decision is aborted on recovery.
+
+ERRORS = {"PermissionError": PermissionError, "KeyError": KeyError, "TypeError": TypeError}
+
+class ShardCustomer:
+    # What the router knows about a logged-in customer: the shard's session
+    # handle and a resumable token prefixed with the shard number.
+    __slots__ = ("id", "first_name", "last_name", "handle", "token")
+    def __init__(self, id, first_name, last_name, handle=None, token=None):
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.handle = handle
+        self.token = token
+
+class ShardWorker:
+    # Runs inside a worker process and answers one request at a time.
+    METHODS = ("next_id", "add_customer", "login", "resume", "logout", "session", "prepare_debit",
+               "prepare_credit", "commit", "abort", "in_doubt")
+
+    def __init__(self, directory, index, max_sessions=65536):
+        os.makedirs(directory, exist_ok=True)
+        self.index = index
+        self.sessions = OrderedDict()
+        self.max_sessions = max_sessions
+        self.bank = BankSystem(os.path.join(directory, "bank.csv"),
+                               log_path=os.path.join(directory, "transactions.csv"), lazy=True)
+        self.bank.load_from_csv()
+        self.prepared_path = os.path.join(directory, "prepared.json")
+        try:
+            with open(self.prepared_path, encoding="utf-8") as f:
+                self.prepared = json.load(f)
+        except FileNotFoundError:
+            self.prepared = {}
+        # A commit that reached the log before the crash is not in doubt.
+        for txid, record in list(self.prepared.items()):
+            if any(row["message"].endswith(f"[{txid}]")
+                   for row in self.bank.log.list_for(record["customer_id"], limit=0)):
+                del self.prepared[txid]
+        self._save_prepared()
+
+    def _save_prepared(self):
+        tmp_path = self.prepared_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.prepared, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.prepared_path)
+
+    def _debit_pending(self, customer_id):
+        return any(r["role"] == "debit" and r["customer_id"] == customer_id for r in self.prepared.values())
+
+    def _info(self, c, token=None):
+        if token is None:
+            return ShardCustomer(c.id, c.first_name, c.last_name)
+        handle = secrets.token_hex(16)
+        self.sessions[handle] = c.id
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return ShardCustomer(c.id, c.first_name, c.last_name, handle, f"{self.index}.{token}")
+
+    def _customer(self, handle):
+        customer_id = self.sessions.get(handle)
+        if customer_id is None:
+            raise PermissionError("login required")
+        self.sessions.move_to_end(handle)
+        return self.bank.get_customer(customer_id)
+
+    def next_id(self):
+        return self.bank._next_id
+
+    def add_customer(self, customer_id, first_name, last_name, password, open_checking, open_savings):
+        # The router hands out ids; they only grow, so this keeps the
+        # bank's own counter in step.
+        if self.bank.get_customer(customer_id) is not None:
+            raise ValueError("customer id already exists")
+        self.bank._next_id = customer_id
+        c = self.bank.add_customer(first_name, last_name, password, open_checking, open_savings)
+        return self._info(c)
+
+    def login(self, customer_id, password):
+        c = self.bank.open_session(customer_id, password).customer
+        return self._info(c, self.bank.issue_token(c))
+
+    def resume(self, token):
+        return self._info(self.bank.resume_session(token).customer, token)
+
+    def logout(self, handle):
+        self.sessions.pop(handle, None)
+
+    def session(self, handle, op, args):
+        s = Session(self.bank, self._customer(handle))
+        if op in ("withdraw", "transfer") and self._debit_pending(s.customer.id):
+            return "Another transfer is in progress. Try again."
+        if op == "deposit":
+            return s.deposit(*args)
+        if op == "withdraw":
+            return s.withdraw(*args)
+        if op == "transfer":
+            return s.transfer(*args)
+        if op == "create_account":
+            return s.create_account(*args)
+        if op == "accounts":
+            return s.accounts()
+        if op == "history":
+            return s.recent_transactions(*args)
+        if op == "query":
+            return s.query_transactions(**args[0])
+        raise ValueError(f"unknown op: {op}")
+
+    def prepare_debit(self, txid, handle, from_type, amount, target_id, target_type, target_shard):
+        # Same checks as BankSystem._transfer; returns (ok, message).
+        c = self._customer(handle)
+        try:
+            acc = self.bank._get_account(from_type, customer=c)
+        except Exception as e:
+            return False, f"Error: {e}"
+        amount = Money.parse(amount)
+        if not acc.active:
+            return False, f"Source account is deactivated. Current balance: {acc.balance}"
+        if amount > TRANSACTION_LIMIT:
+            return False, f"Cannot transfer more than $100 in one transaction. Current balance: {acc.balance}"
+        if acc.balance - amount < ZERO:
+            return False, f"Insufficient funds. Current balance: {acc.balance}"
+        if self._debit_pending(c.id):
+            return False, "Another transfer is in progress. Try again."
+        self.prepared[txid] = {"role": "debit", "customer_id": c.id, "account_type": from_type,
+                               "amount": str(amount), "peer": target_id, "peer_type": target_type,
+                               "peer_shard": target_shard}
+        self._save_prepared()
+        return True, None
+
+    def prepare_credit(self, txid, target_id, target_type, amount, source_id):
+        target = self.bank.get_customer(target_id)
+        if target is None:
+            return False, "Target customer not found."
+        if target_type not in ("checking", "savings"):
+            return False, "Invalid target account type."
+        try:
+            self.bank._get_account(target_type, customer=target)
+        except Exception as e:
+            return False, f"Error: {e}"
+        self.prepared[txid] = {"role": "credit", "customer_id": target.id, "account_type": target_type,
+                               "amount": amount, "peer": source_id}
+        self._save_prepared()
+        return True, None
+
+    def commit(self, txid):
+        # Idempotent: an unknown txid was already committed or aborted.
+        record = self.prepared.get(txid)
+        if record is None:
+            return None
+        c = self.bank.get_customer(record["customer_id"])
+        acc = self.bank._get_account(record["account_type"], customer=c)
+        amount = Money.parse(record["amount"])
+        prev = acc.balance
+        txn = _Txn()
+        with self.bank._locked(c.id):
+            if record["role"] == "debit":
+                acc.balance -= amount
+                txn.log(customer_id=c.id, action="transfer",
+                        account_type=f"{record['account_type']}->{record['peer']}@{record['peer_shard']}:{record['peer_type']}",
+                        amount=str(amount), fee="0.00", prev_balance=str(prev), new_balance=str(acc.balance),
+                        status="ok", message=f"External transfer to {record['peer']} [{txid}]")
+                msg = f"Transfer successful. {record['account_type']}={acc.balance}"
+            else:
+                acc.balance += amount
+                txn.log(customer_id=c.id, action="transfer_in", account_type=record["account_type"],
+                        amount=str(amount), fee="0.00", prev_balance=str(prev), new_balance=str(acc.balance),
+                        status="ok", message=f"External transfer from {record['peer']} [{txid}]")
+                msg = None
+            txn.save(c)
+            self.bank._commit(txn)
+        del self.prepared[txid]
+        self._save_prepared()
+        return msg
+
+    def abort(self, txid):
+        if self.prepared.pop(txid, None) is not None:
+            self._save_prepared()
+
+    def in_doubt(self):
+        return list(self.prepared)
+
+    def close(self):
+        self.bank.close()
+
+def serve(conn, directory, index):
+    worker = ShardWorker(directory, index)
+    while True:
+        try:
+            method, args = conn.recv()
+        except EOFError:
+            break
+        if method == "close":
+            break
+        try:
+            if method not in ShardWorker.METHODS:
+                raise ValueError(f"unknown method: {method}")
+            conn.send(("ok", getattr(worker, method)(*args)))
+        except (ValueError, TypeError, KeyError, PermissionError) as e:
+            conn.send(("error", type(e).__name__, str(e)))
+        except Exception as e:
+            # Anything else is reported too; the worker keeps serving.
+            traceback.print_exc(file=sys.stderr)
+            conn.send(("error", "InternalError", f"internal error: {e}"))
+    worker.close()
+    conn.send(("ok", None))
+
+class ShardSession:
+    # Session-compatible handle whose calls go to the customer's shard.
+    def __init__(self, router, shard, customer):
+        self.router = router
+        self.shard = shard
+        self.customer = customer
+
+    def _call(self, op, *args):
+        return self.router.call(self.shard, "session", self.customer.handle, op, args)
+
+    def deposit(self, account_type, amount, idempotency_key=None):
+        return self._call("deposit", account_type, amount, idempotency_key)
+
+    def withdraw(self, account_type, amount, idempotency_key=None):
+        return self._call("withdraw", account_type, amount, idempotency_key)
+
+    def transfer(self, from_type, to_type, amount, target_customer_id=None, target_account_type=None,
+                 idempotency_key=None):
+        if target_customer_id is None or self.router.shard_for(target_customer_id) == self.shard:
+            return self._call("transfer", from_type, to_type, amount, target_customer_id, target_account_type,
+                              idempotency_key)
+        # Cross-shard transfers are de-duplicated by the router, in memory
+        # only: its cache does not survive a restart.
+        key = idempotency_key
+        if key:
+            done = self.router.idempotency.get(self.customer.id, key)
+            if done is not None:
+                return done
+        msg = self.router._transfer(self, from_type, amount, int(target_customer_id), target_account_type)
+        if key:
+            self.router.idempotency.put(self.customer.id, key, msg)
+        return msg
+
+    def create_account(self, account_type, initial_balance=ZERO):
+        return self._call("create_account", account_type, initial_balance)
+
+    def accounts(self):
+        return self._call("accounts")
+
+    def recent_transactions(self, limit=20):
+        return self._call("history", limit)
+
+    def query_transactions(self, **filters):
+        return self._call("query", filters)
+
+    def logout(self):
+        self.router.call(self.shard, "logout", self.customer.handle)
+
+class ShardRouter:
+    # Owns the worker processes and routes each call to the shard that owns
+    # the customer. Exposes the BankSystem calls server.py makes.
+    def __init__(self, directory, shards=4):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shards = int(shards)
+        layout_path = os.path.join(directory, "shards.json")
+        if os.path.exists(layout_path):
+            with open(layout_path, encoding="utf-8") as f:
+                if json.load(f)["shards"] != self.shards:
+                    raise ValueError("data directory was written with a different shard count")
+        else:
+            with open(layout_path, "w", encoding="utf-8") as f:
+                json.dump({"shards": self.shards}, f)
+        self.coordinator_path = os.path.join(directory, "coordinator.log")
+        self.idempotency = IdempotencyCache()
+        ctx = multiprocessing.get_context("spawn")
+        self._conns = []
+        self._procs = []
+        self._locks = []
+        for i in range(self.shards):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=serve, args=(child, os.path.join(directory, f"shard{i}"), i), daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+            self._locks.append(threading.Lock())
+        self._id_lock = threading.Lock()
+        self._decision_lock = threading.Lock()
+        self._next_id = max([10001] + [self.call(i, "next_id") for i in range(self.shards)])
+        self.recover()
+
+    def shard_for(self, customer_id):
+        return int(customer_id) % self.shards
+
+    def call(self, shard, method, *args):
+        with self._locks[shard]:
+            self._conns[shard].send((method, args))
+            reply = self._conns[shard].recv()
+        if reply[0] == "ok":
+            return reply[1]
+        raise ERRORS.get(reply[1], ValueError)(reply[2])
+
+    def recover(self):
+        # Settles every prepared transaction: committed if the router
+        # recorded the decision, aborted otherwise.
+        try:
+            with open(self.coordinator_path, encoding="utf-8") as f:
+                committed = {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            committed = set()
+        for shard in range(self.shards):
+            for txid in self.call(shard, "in_doubt"):
+                self.call(shard, "commit" if txid in committed else "abort", txid)
+        with open(self.coordinator_path, "w", encoding="utf-8"):
+            pass
+
+    def _decide(self, txid):
+        with self._decision_lock:
+            with open(self.coordinator_path, "a", encoding="utf-8") as f:
+                f.write(txid + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _transfer(self, session, from_type, amount, target_id, target_type):
+        try:
+            amount = Money.of(amount)
+        except (TypeError, ValueError):
+            return "Amount must be a number."
+        if amount <= ZERO:
+            return "Amount must be positive."
+        txid = secrets.token_hex(8)
+        src, dst = session.shard, self.shard_for(target_id)
+        ok, msg = self.call(src, "prepare_debit", txid, session.customer.handle, from_type, str(amount), target_id, target_type, dst)
+        if not ok:
+            return msg
+        ok, msg = self.call(dst, "prepare_credit", txid, target_id, target_type, str(amount), session.customer.id)
+        if not ok:
+            self.call(src, "abort", txid)
+            return msg
+        self._decide(txid)
+        msg = self.call(src, "commit", txid)
+        self.call(dst, "commit", txid)
+        return msg
+
+    def add_customer(self, first_name, last_name, password, open_checking=False, open_savings=False):
+        with self._id_lock:
+            customer_id = self._next_id
+            self._next_id += 1
+        return self.call(self.shard_for(customer_id), "add_customer", customer_id, first_name, last_name,
+                         password, open_checking, open_savings)
+
+    def open_session(self, customer_id, password):
+        shard = self.shard_for(customer_id)
+        return ShardSession(self, shard, self.call(shard, "login", int(customer_id), password))
+
+    def issue_token(self, customer):
+        return customer.token
+
+    def resume_session(self, token):
+        shard, _, raw = str(token).partition(".")
+        if not shard.isdigit() or int(shard) >= self.shards:
+            raise PermissionError("invalid or expired token")
+        return ShardSession(self, int(shard), self.call(int(shard), "resume", raw))
+
+    def close(self):
+        for shard, proc in enumerate(self._procs):
+            if proc.is_alive():
+                self.call(shard, "close")
+            proc.join(10)
+            self._conns[shard].close()
@@ -0,0 +1,277 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from banking import BankStore, CsvStore, Money, TransactionLog
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT, last_name TEXT, password TEXT,
+    checking_balance INTEGER, checking_active INTEGER, checking_overdrafts INTEGER,
+    savings_balance INTEGER, savings_active INTEGER, savings_overdrafts INTEGER
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT, customer_id INTEGER, action TEXT, account_type TEXT,
+    amount INTEGER, fee INTEGER, prev_balance INTEGER, new_balance INTEGER,
+    status TEXT, message TEXT, idem_key TEXT, result TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_customer ON transactions (customer_id, seq);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+CUSTOMER_SQL = "INSERT OR REPLACE INTO customers (%s) VALUES (%s)" % (
+    ",".join(BankStore.FIELDS), ",".join("?" * len(BankStore.FIELDS)))
+LOG_COLUMNS = TransactionLog.FIELDS
+LOG_SQL = "INSERT INTO transactions (%s) VALUES (%s)" % (",".join(LOG_COLUMNS), ",".join("?" * len(LOG_COLUMNS)))
+LOG_MONEY = ("amount", "fee", "prev_balance", "new_balance")
+
+# Balances and amounts are stored as integer cents, flags as 0/1, and empty
+# CSV cells as NULL; rows are turned back into the CSV string forms on read.
+
+def _cents(text):
+    return Money.parse(text).cents if text not in (None, "") else None
+
+def _flag(text):
+    return None if text in (None, "") else int(text == "True")
+
+def _count(text):
+    return None if text in (None, "") else int(text)
+
+def customer_params(values):
+    (cid, first, last, password, chk_bal, chk_act, chk_odc, sav_bal, sav_act, sav_odc) = values
+    return (int(cid), first, last, password, _cents(chk_bal), _flag(chk_act), _count(chk_odc),
+            _cents(sav_bal), _flag(sav_act), _count(sav_odc))
+
+def customer_row(record):
+    (cid, first, last, password, chk_bal, chk_act, chk_odc, sav_bal, sav_act, sav_odc) = record
+    def money(v):
+        return "" if v is None else str(Money(v))
+    def flag(v):
+        return "" if v is None else str(bool(v))
+    def count(v):
+        return "" if v is None else str(v)
+    values = (str(cid), first, last, password, money(chk_bal), flag(chk_act), count(chk_odc),
+              money(sav_bal), flag(sav_act), count(sav_odc))
+    return dict(zip(BankStore.FIELDS, values))
+
+def log_params(row):
+    return tuple(_cents(row.get(k)) if k in LOG_MONEY else row.get(k) for k in LOG_COLUMNS)
+
+def log_row(record):
+    row = {}
+    for k, v in zip(LOG_COLUMNS, record):
+        if v is None:
+            row[k] = ""
+        elif k in LOG_MONEY:
+            row[k] = str(Money(v))
+        else:
+            row[k] = str(v)
+    return row
+
+class SqliteLog:
+    # The transaction log as a table, with the same calls BankSystem and the
+    # menus make on TransactionLog.
+    FIELDS = TransactionLog.FIELDS
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self._lock = lock
+
+    def _insert(self, rows):
+        ts = datetime.now().isoformat(timespec="seconds")
+        params = []
+        for kw in rows:
+            row = {k: "" for k in self.FIELDS}
+            row["ts"] = ts
+            row.update(kw)
+            params.append(log_params(row))
+        self.conn.executemany(LOG_SQL, params)
+
+    def append(self, **kw):
+        self.append_many([kw])
+
+    def append_many(self, rows):
+        with self._lock, self.conn:
+            self._insert(rows)
+
+    def list_for(self, customer_id, limit=20, match=None):
+        sql = "SELECT %s FROM transactions WHERE customer_id = ? ORDER BY seq DESC" % ",".join(LOG_COLUMNS)
+        params = [customer_id]
+        if limit and match is None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        rows = []
+        with self._lock:
+            for record in self.conn.execute(sql, params):
+                row = log_row(record)
+                if match is None or match(row):
+                    rows.append(row)
+                    if limit and len(rows) >= limit:
+                        break
+        rows.reverse()
+        return rows
+
+    def query(self, customer_id, actions=None, account_type=None, external=None, since=None, until=None,
+              min_amount=None, max_amount=None, cursor=None, page_size=20):
+        # TransactionLog.query with every filter in the WHERE clause; the
+        # cursor is the seq of the last row returned.
+        where = ["customer_id = ?"]
+        params = [int(customer_id)]
+        if cursor not in (None, ""):
+            where.append("seq < ?")
+            params.append(int(cursor))
+        if actions:
+            actions = actions.split(",") if isinstance(actions, str) else list(actions)
+            where.append("action IN (%s)" % ",".join("?" * len(actions)))
+            params += actions
+        if account_type:
+            where.append("(account_type = ? OR substr(account_type, 1, ?) = ?)")
+            params += [account_type, len(account_type) + 2, account_type + "->"]
+        if external is not None:
+            where.append("instr(COALESCE(account_type, ''), ':') %s 0" % (">" if external else "="))
+        for column, op, value in (("ts", ">=", since), ("ts", "<", until)):
+            if value:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        for op, value in ((">=", min_amount), ("<=", max_amount)):
+            if value not in (None, ""):
+                where.append(f"COALESCE(amount, 0) {op} ?")
+                params.append(Money.of(value).cents)
+        sql = "SELECT seq, %s FROM transactions WHERE %s ORDER BY seq DESC" % (",".join(LOG_COLUMNS), " AND ".join(where))
+        if page_size:
+            sql += " LIMIT ?"
+            params.append(int(page_size))
+        with self._lock:
+            records = self.conn.execute(sql, params).fetchall()
+        rows = [log_row(record[1:]) for record in records]
+        return rows, records[-1][0] if page_size and len(records) == page_size else None
+
+    def position(self):
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM transactions").fetchone()[0]
+
+    def iter_rows(self, start=None):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT %s FROM transactions WHERE seq > ? ORDER BY seq" % ",".join(LOG_COLUMNS),
+                       (start or 0,))
+        for record in cursor:
+            yield log_row(record)
+
+    def iter_since(self, since):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT %s FROM transactions WHERE ts >= ? ORDER BY seq" % ",".join(LOG_COLUMNS), (since,))
+        for record in cursor:
+            yield log_row(record)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class SqliteStore(BankStore):
+    # One SQLite database in WAL mode: each commit updates only the changed
+    # customer rows and inserts their log rows in a single transaction.
+    def __init__(self, path, synchronous="FULL"):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.executescript(SCHEMA)
+        # Databases made before idempotency keys lack their columns.
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(transactions)")}
+        for column in ("idem_key", "result"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE transactions ADD COLUMN {column} TEXT")
+        self._lock = threading.RLock()
+        self.log = SqliteLog(self.conn, self._lock)
+
+    def iter_rows(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT %s FROM customers ORDER BY id" % ",".join(self.FIELDS))
+        for record in cursor:
+            yield customer_row(record)
+
+    def build_index(self):
+        # The primary key is the index.
+        pass
+
+    def ids(self):
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT id FROM customers ORDER BY id")]
+
+    def max_id(self):
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM customers").fetchone()[0]
+
+    def get_row(self, customer_id):
+        with self._lock:
+            record = self.conn.execute("SELECT %s FROM customers WHERE id = ?" % ",".join(self.FIELDS),
+                                       (int(customer_id),)).fetchone()
+        return customer_row(record) if record else None
+
+    def commit(self, rows, log_rows, span=None):
+        with self._lock, self.conn:
+            if rows:
+                self.conn.executemany(CUSTOMER_SQL, [customer_params(v) for v in rows])
+            if log_rows:
+                self.log._insert(log_rows)
+        if span is not None:
+            span.mark("commit")
+        return False
+
+    def write_snapshot(self, rows):
+        # rows may be streamed from iter_rows over this very table, so they
+        # are staged in a temporary table and swapped in only once read.
+        with self._lock, self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot AS SELECT * FROM customers WHERE 0")
+            self.conn.execute("DELETE FROM temp.snapshot")
+            self.conn.executemany(CUSTOMER_SQL.replace("INTO customers", "INTO temp.snapshot"),
+                                  (customer_params(v) for v in rows))
+            self.conn.execute("DELETE FROM customers")
+            self.conn.execute("INSERT INTO customers SELECT * FROM temp.snapshot")
+            self.conn.execute("DELETE FROM temp.snapshot")
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def load_aggregates(self):
+        with self._lock:
+            record = self.conn.execute("SELECT value FROM meta WHERE key = 'aggregates'").fetchone()
+        return json.loads(record[0]) if record else None
+
+    def save_aggregates(self, data):
+        with self._lock, self.conn:
+            if data is None:
+                self.conn.execute("DELETE FROM meta WHERE key = 'aggregates'")
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aggregates', ?)",
+                                  (json.dumps(data),))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def import_csv(self, csv_path, log_path, batch=10000):
+        # Streams bank.csv (with its journal) and the transaction log into
+        # the database as one transaction. Returns (customers, log rows).
+        source = CsvStore(csv_path, log_path)
+        counts = [0, 0]
+        def chunks(rows, convert):
+            chunk = []
+            for row in rows:
+                chunk.append(convert(row))
+                if len(chunk) >= batch:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        with self._lock, self.conn:
+            for chunk in chunks(source.iter_rows(), lambda r: customer_params([r.get(k) or "" for k in self.FIELDS])):
+                self.conn.executemany(CUSTOMER_SQL, chunk)
+                counts[0] += len(chunk)
+            for chunk in chunks(source.log.iter_rows(), log_params):
+                self.conn.executemany(LOG_SQL, chunk)
+                counts[1] += len(chunk)
+        source.close()
+        return tuple(counts)
@@ -1,5 +1,13 @@
+import gzip
+import os
+import time
 import unittest
-from banking import BankSystem
+from decimal import Decimal
+import banking
+import reconcile
+from banking import BankSystem, Money, TransactionLog, is_password_hash
+from metrics import MemorySink, Metrics
+from testbase import BankTestCase
 
 class TestBankSystem(unittest.TestCase):
     def setUp(self):
@@ -27,5 +35,465 @@ class TestBankSystem(unittest.TestCase):
         msg = self.bs.transfer("checking", "savings", 50)
         self.assertIn("Transfer successful", msg)
 
+class TestCustomers(BankTestCase):
+    def test_customer_index_tracks_ids(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Nora", "User", "1", open_checking=True)
+        b = bs.add_customer("Reem", "User", "2", open_savings=True)
+        self.assertEqual(b.id, a.id + 1)
+        self.assertIs(bs.get_customer(b.id), b)
+        self.assertIsNone(bs.get_customer(b.id + 1))
+        bs.customers = [a]
+        self.assertIsNone(bs.get_customer(b.id))
+        self.assertEqual(bs.add_customer("Dana", "User", "3").id, a.id + 1)
+
+    def test_overdraft_uses_exact_cents(self):
+        bs = self.open_bank()
+        c = bs.add_customer("Mona", "User", "6666", open_checking=True)
+        bs.login(c.id, "6666")
+        for _ in range(3):
+            bs.deposit("checking", "0.10")
+        self.assertEqual(c.checking.balance, Money(30))
+        msg = bs.withdraw("checking", "10.30")
+        self.assertEqual(msg, "Overdraft fee $35.00 applied. Current balance: -45.00")
+        msg = bs.withdraw("checking", 25)
+        self.assertIn("Max you can withdraw is $20.00", msg)
+
+class TestPasswords(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bs = self.open_bank()
+
+    def test_new_passwords_are_hashed(self):
+        c = self.bs.add_customer("Salma", "User", "secret", open_checking=True)
+        self.assertTrue(is_password_hash(c.password))
+        self.assertNotIn("secret", c.password)
+        self.assertIs(self.bs.login(c.id, "secret"), c)
+        self.assertRaises(PermissionError, self.bs.login, c.id, "wrong")
+
+    def test_plaintext_rows_migrate_on_login(self):
+        with open(self.bank_path, "w", encoding="utf-8") as f:
+            f.write(",".join(BankSystem.FIELDS) + "\n10001,Ali,User,2222,50.00,True,0,,,\n")
+        self.bs.load_from_csv()
+        self.bs.login(10001, "2222")
+        self.assertTrue(is_password_hash(self.bs.get_customer(10001).password))
+        self.bs.load_from_csv()
+        self.assertTrue(is_password_hash(self.bs.get_customer(10001).password))
+        self.bs.login(10001, "2222")
+
+    def test_cached_login_and_tokens_skip_the_kdf(self):
+        c = self.bs.add_customer("Yara", "User", "pw")
+        self.bs.login(c.id, "pw")
+        calls = []
+        original = banking.verify_password
+        banking.verify_password = lambda *a: calls.append(a) or original(*a)
+        self.addCleanup(setattr, banking, "verify_password", original)
+        self.bs.login(c.id, "pw")
+        self.assertRaises(PermissionError, self.bs.login, c.id, "nope")
+        self.assertEqual(len(calls), 1)
+        token = self.bs.issue_token(c)
+        self.assertIs(self.bs.resume_session(token).customer, c)
+        self.assertRaises(PermissionError, self.bs.resume_session, "bogus")
+
+class TestMoney(unittest.TestCase):
+    def test_parse_and_format(self):
+        self.assertEqual(Money.parse("12.5").cents, 1250)
+        self.assertEqual(Money.parse("-0.07").cents, -7)
+        self.assertEqual(Money.parse("1.005").cents, 101)
+        self.assertEqual(str(Money(-4507)), "-45.07")
+        self.assertEqual(f"{Money(5):>8}", "    0.05")
+        self.assertRaises(ValueError, Money.parse, "abc")
+        self.assertRaises(ValueError, Money.of, float("nan"))
+        for huge in (1e30, Decimal("1e40"), "1e30"):
+            self.assertRaises(ValueError, Money.of, huge)
+
+    def test_arithmetic_is_exact(self):
+        total = Money.of(0.1) + Money.of(0.2)
+        self.assertEqual(total, Money.parse("0.30"))
+        self.assertEqual(total, 0.3)
+        self.assertEqual(Money.of(100) - 35, Money.of(65))
+        self.assertTrue(Money.of(-1) < 0)
+
+class TestJournal(BankTestCase):
+    def test_operations_replay_from_journal(self):
+        bs = self.open_bank()
+        c = bs.add_customer("Sara", "User", "3333", open_checking=True)
+        bs.login(c.id, "3333")
+        bs.deposit("checking", 40)
+        self.assertFalse(os.path.exists(self.bank_path))
+        again = self.open_bank()
+        self.assertEqual(len(again.customers), 1)
+        self.assertEqual(again.customers[0].checking.balance, 40.0)
+
+    def test_checkpoint_compacts_journal(self):
+        bs = self.open_bank(checkpoint_every=3)
+        c = bs.add_customer("Omar", "User", "4444", open_checking=True)
+        bs.login(c.id, "4444")
+        bs.deposit("checking", 10)
+        bs.deposit("checking", 5)
+        self.assertEqual(os.path.getsize(bs.store.journal_path), 0)
+        again = self.open_bank()
+        self.assertEqual(again.customers[0].checking.balance, 15.0)
+
+    def test_torn_journal_tail_is_ignored(self):
+        bs = self.open_bank()
+        c = bs.add_customer("Huda", "User", "5555", open_checking=True)
+        bs.login(c.id, "5555")
+        bs.deposit("checking", 25)
+        bs.close()
+        with open(bs.store.journal_path, "a", encoding="utf-8") as f:
+            f.write(f"{c.id},Huda,User,5555,99")
+        again = self.open_bank()
+        self.assertEqual(again.customers[0].checking.balance, 25.0)
+
+    def test_apply_batch(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Lina", "User", "7777", open_checking=True, open_savings=True)
+        b = bs.add_customer("Faisal", "User", "8888", open_checking=True)
+        results, stats = bs.apply_batch([
+            {"op": "deposit", "customer_id": a.id, "account_type": "checking", "amount": "80"},
+            {"op": "withdraw", "customer_id": a.id, "account_type": "checking", "amount": "500"},
+            {"op": "transfer", "customer_id": a.id, "from_type": "checking", "amount": "30",
+             "target_customer_id": b.id, "target_account_type": "checking"},
+            {"op": "deposit", "customer_id": 1, "account_type": "checking", "amount": "5"},
+            {"op": "interest", "customer_id": a.id},
+        ])
+        self.assertEqual(results[0], "Deposit successful. New balance: 80.00")
+        self.assertIn("Cannot withdraw more than $100", results[1])
+        self.assertEqual(results[2], "Transfer successful. checking=50.00")
+        self.assertEqual(results[3:], ["Customer not found.", "Unknown operation."])
+        self.assertEqual(stats["applied"], 2)
+        self.assertEqual(stats["rejected"], 3)
+        self.assertEqual(stats["by_op"]["deposit"], {"applied": 1, "rejected": 1})
+        self.assertEqual(stats["customers_touched"], 2)
+        self.assertEqual(len(bs.log.list_for(a.id, limit=0)), 3)
+        again = self.open_bank()
+        self.assertEqual(again.get_customer(b.id).checking.balance, Money.of(30))
+
+    def test_lazy_index_reads_quoted_newlines(self):
+        bs = self.open_bank()
+        odd = bs.add_customer("Line\nBreak", 'Quote "Q", Comma', "pw", open_checking=True)
+        after = bs.add_customer("Next", "User", "pw", open_savings=True)
+        bs.save_all_to_csv()
+        lazy = self.open_bank(lazy=True)
+        self.assertEqual(lazy.store.ids(), [odd.id, after.id])
+        self.assertEqual((lazy.get_customer(odd.id).first_name, lazy.get_customer(odd.id).last_name),
+                         ("Line\nBreak", 'Quote "Q", Comma'))
+        self.assertIsNotNone(lazy.get_customer(after.id).savings)
+
+    def test_bad_op_does_not_strand_the_batch(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Lina", "User", "7777", open_checking=True)
+        def broken(txn, customer, account_type, amount):
+            raise ValueError("broken op")
+        bs._withdraw = broken
+        results, stats = bs.apply_batch([
+            {"op": "deposit", "customer_id": a.id, "account_type": "checking", "amount": "50"},
+            {"op": "transfer", "customer_id": a.id, "from_type": "checking", "amount": "5",
+             "target_customer_id": "x", "target_account_type": "checking"},
+            {"op": "withdraw", "customer_id": a.id, "account_type": "checking", "amount": "5"},
+            None,
+            {"op": "deposit", "customer_id": a.id, "account_type": "checking", "amount": Decimal("1e40")},
+            {"op": ["deposit"], "customer_id": a.id, "idempotency_key": ["k"]},
+        ])
+        self.assertEqual(results[1:], ["Target customer not found.", "Error: broken op",
+                                       "Error: operation must be an object", "Amount must be a number.",
+                                       "Error: unhashable type: 'list'"])
+        self.assertEqual((stats["applied"], stats["rejected"]), (1, 5))
+        self.assertEqual(len(bs.log.list_for(a.id, limit=0)), 1)
+        self.assertEqual(self.open_bank().get_customer(a.id).checking.balance, Money.of(50))
+
+    def test_aggregates_track_operations_and_survive_restarts(self):
+        bs = self.open_bank(checkpoint_every=4)
+        a = bs.add_customer("Rami", "User", "pw", open_checking=True, open_savings=True)
+        b = bs.add_customer("Nour", "User", "pw", open_checking=True)
+        bs.login(a.id, "pw")
+        bs.deposit("checking", 100)
+        bs.deposit("savings", 10)
+        bs.withdraw("checking", 150)
+        bs.transfer("checking", None, 20, b.id, "checking")
+        bs.transfer("savings", "checking", 5)
+        bs.withdraw("checking", 90)
+        summary = bs.customer_summary()
+        self.assertEqual(summary["deposit:checking"], {"count": 1, "total": "100.00"})
+        self.assertEqual(summary["overdraft_fee"], {"count": 1, "total": "35.00"})
+        self.assertEqual(summary["rejected:withdraw"]["count"], 1)
+        self.assertEqual(bs.customer_summary(b.id), {"transfer_in:checking": {"count": 1, "total": "20.00"}})
+        bank = bs.bank_summary()
+        self.assertEqual(bank["balances"], {"checking": "-20.00", "savings": "5.00"})
+        self.assertEqual(bank["liabilities"], "-15.00")
+        bs.deposit("savings", 7)
+        expected = (bs.customer_summary(), bs.bank_summary())
+        again = self.open_bank()
+        self.assertEqual((again.customer_summary(a.id), again.bank_summary()), expected)
+        self.assertEqual(again.bank_summary()["balances"]["savings"], "12.00")
+        os.remove(bs.store.aggregates_path)
+        rebuilt = self.open_bank()
+        self.assertEqual((rebuilt.customer_summary(a.id), rebuilt.bank_summary()), expected)
+
+    def test_lazy_mode_loads_customers_on_demand(self):
+        bs = self.open_bank()
+        ids = [bs.add_customer(f"C{n}", "User", "pw", open_checking=True).id for n in range(5)]
+        bs.save_all_to_csv()
+        bs.close()
+        lazy = self.open_bank(lazy=True, cache_size=2)
+        self.assertEqual(len(lazy._by_id), 0)
+        lazy.login(ids[0], "pw")
+        lazy.deposit("checking", 15)
+        for cid in ids[1:]:
+            self.assertEqual(lazy.get_customer(cid).first_name, f"C{ids.index(cid)}")
+        self.assertEqual(len(lazy._by_id), 2)
+        self.assertIs(lazy.get_customer(ids[0]), lazy.current)
+        lazy.logout()
+        self.assertEqual(lazy.add_customer("New", "User", "pw").id, ids[-1] + 1)
+        self.assertEqual(len(lazy.customers), 6)
+        lazy.save_all_to_csv()
+        again = self.open_bank(lazy=True)
+        self.assertEqual(again.get_customer(ids[0]).checking.balance, Money.of(15))
+        self.assertEqual(again.get_customer(ids[-1] + 1).first_name, "New")
+        self.assertIsNone(again.get_customer(1))
+
+class TestBufferedLog(BankTestCase):
+    def test_rows_are_group_committed(self):
+        log = TransactionLog(self.log_path, batch_rows=3, durability="fsync")
+        self.addCleanup(log.close)
+        size = os.path.getsize(self.log_path)
+        log.append(customer_id=10001, action="deposit", status="ok")
+        log.append(customer_id=10001, action="deposit", status="ok")
+        self.assertEqual(os.path.getsize(self.log_path), size)
+        log.append(customer_id=10002, action="deposit", status="ok")
+        self.assertGreater(os.path.getsize(self.log_path), size)
+        log.append(customer_id=10001, action="withdraw", status="ok")
+        self.assertEqual(len(log.list_for(10001)), 3)
+
+    def test_logout_flushes_pending_rows(self):
+        log = TransactionLog(self.log_path, batch_rows=100)
+        bs = self.open_bank(log=log)
+        c = bs.add_customer("Rana", "User", "9", open_checking=True)
+        bs.login(c.id, "9")
+        bs.deposit("checking", 10)
+        bs.logout()
+        self.assertEqual(len(TransactionLog(self.log_path).list_for(c.id)), 1)
+
+    def test_interval_commits_without_more_appends(self):
+        log = TransactionLog(self.log_path, batch_rows=100, batch_interval=0.05)
+        self.addCleanup(log.close)
+        log.append(customer_id=10001, action="deposit", status="ok")
+        time.sleep(0.3)
+        self.assertEqual(len(TransactionLog(self.log_path).list_for(10001)), 1)
+
+class TestTransactionIndex(BankTestCase):
+    def test_list_for_reads_only_indexed_rows(self):
+        log = TransactionLog(self.log_path)
+        for i in range(30):
+            log.append(customer_id=10001 + i % 2, action="deposit", account_type="checking",
+                       amount=f"{i}.00", status="ok", message='say "hï",\nthere')
+        rows = log.list_for(10001, limit=5)
+        self.assertEqual([r["amount"] for r in rows], ["20.00", "22.00", "24.00", "26.00", "28.00"])
+        self.assertEqual(rows[-1]["message"], 'say "hï",\nthere')
+        self.assertEqual(len(log.list_for(10002, limit=0)), 15)
+
+    def test_index_catches_up_and_rebuilds(self):
+        first = TransactionLog(self.log_path)
+        second = TransactionLog(self.log_path)
+        first.append(customer_id=10001, action="deposit", status="ok")
+        second.append(customer_id=10001, action="withdraw", status="ok")
+        self.assertEqual([r["action"] for r in first.list_for(10001)], ["deposit", "withdraw"])
+        self.assertEqual(len(TransactionLog(self.log_path).list_for(10001)), 2)
+        os.remove(first.index_path)
+        self.assertEqual(len(TransactionLog(self.log_path).list_for(10001)), 2)
+
+    def test_legacy_layouts_are_read_and_migrated(self):
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            f.write(",".join(TransactionLog.LEGACY_FIELDS) + "\n")
+            f.write("10001,deposit,checking,5.00,0.00,0.00,5.00,ok,Deposit successful.\n")
+            f.write("2025-09-24T09:18:35,10001,withdraw,checking,2.00,0.00,5.00,3.00,ok,Withdraw successful.\n")
+        log = TransactionLog(self.log_path)
+        self.assertEqual(log.version, 1)
+        log.append(customer_id=10001, action="deposit", account_type="savings", status="ok")
+        rows = log.list_for(10001, limit=0)
+        self.assertEqual([r["action"] for r in rows], ["deposit", "withdraw", "deposit"])
+        self.assertEqual(rows[1]["ts"], "2025-09-24T09:18:35")
+        self.assertEqual(rows[1]["new_balance"], "3.00")
+        self.assertTrue(log.migrate())
+        self.assertEqual(log.version, TransactionLog.VERSION)
+        self.assertEqual(TransactionLog(self.log_path).list_for(10001, limit=0), rows)
+        self.assertFalse(log.migrate())
+
+    def test_rotation_archives_segments_and_reads_across_them(self):
+        log = TransactionLog(self.log_path, segment_bytes=600)
+        for i in range(40):
+            log.append(customer_id=10001 + i % 4, action="deposit" if i % 3 else "withdraw",
+                       account_type="checking", amount=f"{i}.00", status="ok")
+        position = log.position()
+        log.close()
+        self.assertGreater(len(log.segments), 2)
+        self.assertTrue(all(os.path.exists(log._segment_path(seg)) for seg in log.segments))
+        again = TransactionLog(self.log_path)
+        self.assertEqual(again.position(), position)
+        self.assertEqual([r["amount"] for r in again.iter_rows()], [f"{i}.00" for i in range(40)])
+        self.assertEqual([r["amount"] for r in again.list_for(10002, limit=3)], ["29.00", "33.00", "37.00"])
+        withdraws = again.list_for(10001, limit=2, match=lambda r: r["action"] == "withdraw")
+        self.assertEqual([r["amount"] for r in withdraws], ["24.00", "36.00"])
+        self.assertEqual(len(again.list_for(10003, limit=0)), 10)
+        self.assertEqual(again.list_for(99999, limit=0), [])
+        archived = sum(seg["rows"] for seg in again.segments)
+        self.assertEqual([r["amount"] for r in again.iter_rows(again._archived_bytes())],
+                         [f"{i}.00" for i in range(archived, 40)])
+
+    def test_query_filters_and_pages_across_segments(self):
+        log = TransactionLog(self.log_path, segment_bytes=700)
+        for i in range(30):
+            account = "checking" if i % 2 else "savings"
+            if i % 5 == 0:
+                account = f"{account}->10002:checking"
+            log.append(ts=f"2025-09-{i + 1:02d}T10:00:00", customer_id=10001 if i % 3 else 10003,
+                       action="transfer" if i % 5 == 0 else "deposit", account_type=account,
+                       amount=f"{i}.00", status="ok")
+        self.assertTrue(log.segments)
+        def pages(**filters):
+            seen, cursor = [], None
+            while True:
+                rows, cursor = log.query(10001, cursor=cursor, page_size=4, **filters)
+                seen.append([int(r["amount"][:-3]) for r in rows])
+                if cursor is None:
+                    return seen
+        everything = [i for i in range(29, -1, -1) if i % 3]
+        self.assertEqual(sum(pages(), []), everything)
+        self.assertEqual(pages()[0], everything[:4])
+        self.assertEqual(sum(pages(actions="deposit", account_type="checking"), []),
+                         [i for i in everything if i % 5 and i % 2])
+        self.assertEqual(sum(pages(external=True, account_type="savings"), []), [20, 10])
+        self.assertEqual(sum(pages(since="2025-09-05", until="2025-09-10", min_amount="5"), []), [8, 7, 5])
+        self.assertEqual(log.query(10001, max_amount="2", page_size=0), (log.query(10001, max_amount=2)[0], None))
+        self.assertEqual(log.query(99999), ([], None))
+
+    def test_rotation_recovers_from_crash_before_new_file(self):
+        log = TransactionLog(self.log_path)
+        log.append(customer_id=10001, action="deposit", status="ok")
+        self.assertTrue(log.rotate())
+        self.assertFalse(log.rotate())
+        log.close()
+        # Simulate dying after the manifest was saved but before the new
+        # active file replaced the archived one.
+        with gzip.open(log._segment_path(log.segments[0]), "rb") as src, open(self.log_path, "wb") as dst:
+            dst.write(src.read())
+        again = TransactionLog(self.log_path)
+        self.assertEqual(again.seq, 1)
+        self.assertEqual(len(again.list_for(10001, limit=0)), 1)
+
+    def test_bank_aggregates_survive_rotation(self):
+        log = TransactionLog(self.log_path, segment_bytes=400)
+        bs = BankSystem(self.bank_path, log_path=self.log_path, log=log)
+        c = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        session = bs.open_session(c.id, "pw")
+        for _ in range(10):
+            session.deposit("checking", "5")
+        summary = bs.bank_summary()
+        bs.close()
+        self.assertTrue(log.segments)
+        again = BankSystem(self.bank_path, log_path=self.log_path)
+        again.load_from_csv()
+        self.assertEqual(again.bank_summary(), summary)
+        os.remove(again.store.aggregates_path)
+        again.close()
+        rebuilt = BankSystem(self.bank_path, log_path=self.log_path)
+        rebuilt.load_from_csv()
+        self.assertEqual(rebuilt.bank_summary(), summary)
+        rebuilt.close()
+
+class TestIdempotency(BankTestCase):
+    def test_repeats_return_the_first_result(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        b = bs.add_customer("Bob", "Lee", "pw", open_checking=True)
+        session = bs.open_session(a.id, "pw")
+        first = session.deposit("checking", "50", idempotency_key="k1")
+        self.assertEqual(session.deposit("checking", "50", idempotency_key="k1"), first)
+        over = session.withdraw("checking", "500", idempotency_key="k2")
+        session.transfer("checking", None, "10", b.id, "checking", idempotency_key="k3")
+        self.assertEqual(session.transfer("checking", None, "10", b.id, "checking", idempotency_key="k3"),
+                         "Transfer successful. checking=40.00")
+        self.assertEqual(bs.get_customer(b.id).checking.balance, Money.of(10))
+        rows = bs.log.list_for(a.id, limit=0)
+        self.assertEqual([(r["action"], r["idem_key"]) for r in rows],
+                         [("deposit", "k1"), ("withdraw", "k2"), ("transfer", "k3")])
+        self.assertEqual(rows[0]["result"], first)
+
+        again = self.open_bank()
+        session = again.open_session(a.id, "pw")
+        self.assertEqual(session.withdraw("checking", "500", idempotency_key="k2"), over)
+        self.assertEqual(session.deposit("checking", "50", idempotency_key="k1"), first)
+        self.assertEqual(len(again.log.list_for(a.id, limit=0)), 3)
+        self.assertNotEqual(session.deposit("checking", "50", idempotency_key="k4"), first)
+        self.assertEqual(again.get_customer(a.id).checking.balance, Money.of(90))
+
+    def test_keyed_rejections_survive_a_restart(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        b = bs.add_customer("Bob", "Lee", "pw", open_checking=True)
+        denied = bs.open_session(a.id, "pw").transfer("checking", None, "10", b.id, "checking",
+                                                      idempotency_key="t1")
+        self.assertTrue(denied.startswith("Insufficient funds"))
+        results, _ = bs.apply_batch([{"op": "withdraw", "customer_id": a.id, "account_type": "savings",
+                                      "amount": "1", "idempotency_key": "t2"}])
+        bs.close()
+
+        again = self.open_bank()
+        again.get_customer(a.id).checking.balance = Money.of(100)
+        session = again.open_session(a.id, "pw")
+        self.assertEqual(session.transfer("checking", None, "10", b.id, "checking", idempotency_key="t1"),
+                         denied)
+        self.assertEqual(session.withdraw("savings", "1", idempotency_key="t2"), results[0])
+        self.assertEqual(again.get_customer(b.id).checking.balance, Money.of(0))
+        self.assertEqual(reconcile.summarise(enumerate(again.log.list_for(a.id, limit=0)))["invalid"], [])
+
+    def test_duplicates_found_under_the_lock_finish_their_span(self):
+        memory = MemorySink()
+        bs = self.open_bank(metrics=Metrics(memory))
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        session = bs.open_session(a.id, "pw")
+        session.deposit("checking", "5", idempotency_key="k")
+        get = bs.idempotency.get
+        misses = [None]
+        bs.idempotency.get = lambda *args: misses.pop() if misses else get(*args)
+        session.deposit("checking", "5", idempotency_key="k")
+        self.assertEqual(memory.snapshot()["ops"], {"deposit:ok": 1, "deposit:rejected": 1})
+        self.assertEqual(memory.snapshot()["rejections"], {"deposit:duplicate": 1})
+        self.assertEqual(a.checking.balance, Money.of(5))
+
+    def test_batch_suppresses_duplicates(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        ops = [{"op": "deposit", "customer_id": a.id, "account_type": "checking", "amount": "5",
+                "idempotency_key": "b1"}] * 3
+        results, stats = bs.apply_batch(ops)
+        self.assertEqual((stats["applied"], stats["duplicates"]), (1, 2))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(bs.apply_batch(ops[:1])[1]["duplicates"], 1)
+        self.assertEqual(a.checking.balance, Money.of(5))
+
+    def test_cache_expires_and_evicts(self):
+        cache = banking.IdempotencyCache(ttl=10, max_size=2)
+        cache.put(1, "a", "A", now=0)
+        cache.put(1, "b", "B", now=5)
+        self.assertEqual(cache.get(1, "a", now=9), "A")
+        self.assertIsNone(cache.get(1, "a", now=10))
+        cache.put(2, "a", "C", now=6)
+        cache.put(2, "b", "D", now=7)
+        self.assertEqual((len(cache), cache.get(1, "b", now=8), cache.get(2, "a", now=8)), (2, None, "C"))
+
+    def test_older_logs_are_upgraded_for_keys(self):
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            f.write("#txlog,2\n" + ",".join(TransactionLog.FIELDS[:10]) + "\n")
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        session = bs.open_session(a.id, "pw")
+        session.deposit("checking", "5")
+        self.assertEqual(bs.log.version, 2)
+        session.deposit("checking", "5", idempotency_key="k")
+        self.assertEqual((bs.log.version, bs.log.columns), (TransactionLog.VERSION, TransactionLog.FIELDS))
+        self.assertEqual([r["idem_key"] for r in bs.log.list_for(a.id, limit=0)], ["", "k"])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+import unittest
+import binstore
+import bulk
+from banking import BankSystem, CsvStore, Money
+from testbase import BankTestCase
+
+class TestBinaryStore(BankTestCase):
+    bank_name = "bank.bin"
+
+    def setUp(self):
+        super().setUp()
+        self.csv_path = self.path("bank.csv")
+        self.bin_path = self.bank_path
+        bs = BankSystem(self.csv_path, log_path=self.log_path, kdf_iterations=1000)
+        self.ann = bs.add_customer("Ann", "Lée", "pw", open_checking=True, open_savings=True)
+        self.bob = bs.add_customer("Bob", "", "pw", open_savings=True)
+        self.cy = bs.add_customer("Cy", "Zed", "pw")
+        self.ann.checking.balance = Money.parse("-12.34")
+        self.ann.checking.overdraft_count = 2
+        self.bob.savings.balance = Money.parse("1000000.05")
+        self.bob.savings.active = False
+        bs.save_all_to_csv()
+        bs.close()
+
+    def csv_rows(self, path):
+        store = CsvStore(path, self.log_path)
+        rows = list(store.iter_rows())
+        store.close()
+        return rows
+
+    def test_round_trip_through_csv(self):
+        self.assertEqual(binstore.convert(self.csv_path, self.bin_path, self.log_path), 3)
+        back = self.path("back.csv")
+        self.assertEqual(binstore.convert(self.bin_path, back, self.log_path), 3)
+        self.assertEqual(self.csv_rows(back), self.csv_rows(self.csv_path))
+
+    def test_lazy_and_eager_banks_read_the_snapshot(self):
+        binstore.convert(self.csv_path, self.bin_path, self.log_path)
+        lazy = self.open_bank(lazy=True)
+        ann = lazy.get_customer(self.ann.id)
+        self.assertEqual((ann.last_name, ann.checking.balance, ann.checking.overdraft_count),
+                         ("Lée", Money.parse("-12.34"), 2))
+        self.assertIsNone(lazy.get_customer(99999))
+        self.assertEqual(lazy.store.ids(), [self.ann.id, self.bob.id, self.cy.id])
+        eager = self.open_bank()
+        bob = eager.get_customer(self.bob.id)
+        self.assertEqual((bob.checking, bob.savings.balance, bob.savings.active),
+                         (None, Money.parse("1000000.05"), False))
+        self.assertEqual([BankSystem._row_values(eager, c) for c in eager.customers],
+                         [[r[k] for k in BankSystem.FIELDS] for r in self.csv_rows(self.csv_path)])
+
+    def test_changes_are_journaled_then_folded_in(self):
+        binstore.convert(self.csv_path, self.bin_path, self.log_path)
+        bs = self.open_bank(lazy=True)
+        session = bs.open_session(self.cy.id, "pw")
+        session.create_account("checking", "5")
+        dee = bs.add_customer("Dee", "Doe", "pw", open_checking=True)
+        self.assertEqual(bs.store.max_id(), dee.id)
+        again = self.open_bank(lazy=True)
+        self.assertEqual(again.get_customer(self.cy.id).checking.balance, Money.of(5))
+        self.assertIn(dee.id, again.store.ids())
+        bs.save_all_to_csv()
+        self.assertEqual(os.path.getsize(bs.store.journal_path), 0)
+        self.assertEqual(len(binstore.RecordTable(self.bin_path)), 4)
+        self.assertEqual(self.open_bank().get_customer(self.cy.id).checking.balance, Money.of(5))
+
+    def test_unsorted_rows_are_sorted_and_bad_files_rejected(self):
+        rows = [[r[k] for k in BankSystem.FIELDS] for r in self.csv_rows(self.csv_path)]
+        binstore.write_binary(self.bin_path, rows[::-1])
+        table = binstore.RecordTable(self.bin_path)
+        self.assertEqual(table.ids(), sorted(int(r[0]) for r in rows))
+        self.assertEqual(table.row(table.find(self.bob.id))["savings_balance"], "1000000.05")
+        table.close()
+        with open(self.bin_path, "wb") as f:
+            f.write(b"id,first_name\n" * 4)
+        with self.assertRaises(ValueError):
+            binstore.RecordTable(self.bin_path)
+
+    def test_bulk_convert_binary(self):
+        bulk.main(["--bank", self.csv_path, "--log", self.log_path, "convert-binary", self.bin_path])
+        self.assertEqual(len(binstore.RecordTable(self.bin_path)), 3)
+
+if __name__ == "__main__":
+    unittest.main()
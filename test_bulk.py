@@ -0,0 +1,53 @@
+import json
+import os
+import unittest
+from banking import Money
+import bulk
+from testbase import BankTestCase
+
+class TestBulk(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        bs = self.open_bank()
+        c = bs.add_customer("Old", "User", "1", open_checking=True)
+        bs.login(c.id, "1")
+        bs.deposit("checking", 20)
+        bs.close()
+
+    def run_cli(self, *argv):
+        return bulk.main(["--bank", self.bank_path, "--log", self.log_path, "--progress", "0", *argv])
+
+    def test_import_assigns_ids_after_existing(self):
+        src = self.path("new.jsonl")
+        with open(src, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"first_name": "A", "last_name": "One", "password": "p", "checking_balance": "12.50"}) + "\n")
+            f.write(json.dumps({"first_name": "", "password": "p"}) + "\n")
+            f.write(json.dumps({"first_name": "B", "last_name": "Two", "password": "q", "open_savings": True}) + "\n")
+        self.run_cli("import-customers", src)
+        bs = self.open_bank()
+        self.assertEqual([c.id for c in bs.customers], [10001, 10002, 10003])
+        self.assertEqual(bs.get_customer(10001).checking.balance, Money.of(20))
+        self.assertEqual(bs.get_customer(10002).checking.balance, Money.parse("12.50"))
+        self.assertIsNone(bs.get_customer(10003).checking)
+        self.assertEqual(bs.get_customer(10003).savings.balance, Money(0))
+        self.assertEqual(os.path.getsize(bs.store.journal_path), 0)
+
+    def test_exports_apply_filters(self):
+        src = self.path("new.csv")
+        with open(src, "w", encoding="utf-8") as f:
+            f.write("first_name,last_name,password,open_checking\nC,Three,r,no\n")
+        self.run_cli("import-customers", src)
+        out = self.path("customers.csv")
+        self.run_cli("export-customers", out, "--account", "checking")
+        with open(out, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertNotIn("password", lines[0])
+        out = self.path("tx.jsonl")
+        self.run_cli("export-transactions", out, "--customer", "10001", "--action", "deposit")
+        with open(out, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([r["amount"] for r in rows], ["20.00"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import time
+import unittest
+from banking import Money
+from limits import Limit, VelocityLimits, Window
+from testbase import BankTestCase
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+class TestVelocityLimits(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+
+    def open_bank(self):
+        limits = VelocityLimits(Limit("day", max_amount="250"), Limit("hour", max_count=3, scope="customer"),
+                                clock=self.clock)
+        return super().open_bank(limits=limits)
+
+    def test_window_expires_old_buckets(self):
+        w = Window(3600, 4)
+        w.add(0, 100)
+        w.add(1000, 50)
+        self.assertEqual(w.totals(1799), (2, 150))
+        self.assertEqual(w.totals(3599), (2, 150))
+        self.assertEqual(w.totals(3600), (1, 50))
+        w.add(100, 7)
+        self.assertEqual(w.totals(3600), (1, 50))
+        self.assertEqual(w.totals(10 ** 6), (0, 0))
+
+    def test_limits_reject_and_log(self):
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True, open_savings=True)
+        b = bs.add_customer("Bob", "Lee", "pw", open_checking=True)
+        a.checking.balance = a.savings.balance = Money.of(1000)
+        session = bs.open_session(a.id, "pw")
+        self.assertTrue(session.withdraw("checking", "100").startswith("Withdraw successful"))
+        self.assertTrue(session.transfer("checking", None, "100", b.id, "checking").startswith("Transfer successful"))
+        self.assertTrue(session.transfer("checking", "savings", "100").startswith("Transfer successful"))
+        msg = session.withdraw("checking", "60")
+        self.assertTrue(msg.startswith("Velocity limit reached: at most $250.00 per account per day"), msg)
+        self.assertTrue(session.withdraw("savings", "60").startswith("Withdraw successful"))
+        msg = session.withdraw("savings", "1")
+        self.assertIn("at most 3 transactions across accounts per hour", msg)
+        rows = bs.log.list_for(a.id, limit=0)
+        self.assertEqual([(r["status"], r["message"]) for r in rows if r["status"] != "ok"],
+                         [("error", "velocity limit"), ("error", "velocity limit")])
+        self.assertEqual(a.checking.balance, Money.of(700))
+        self.assertEqual(bs.customer_summary(a.id)["rejected:withdraw"]["count"], 2)
+
+        # The hourly count resets an hour later; the daily amount is rebuilt
+        # from the log by a restarted bank.
+        self.clock.now += 3700
+        again = self.open_bank()
+        again_session = again.open_session(a.id, "pw")
+        self.assertIn("per day", again_session.withdraw("checking", "60"))
+        self.assertTrue(again_session.withdraw("checking", "50").startswith("Withdraw successful"))
+        self.clock.now += 86400
+        self.assertTrue(again_session.withdraw("checking", "100").startswith("Withdraw successful"))
+
+    def test_parse(self):
+        limit = Limit.parse("hour:count=5:amount=300:scope=customer:actions=withdraw")
+        self.assertEqual((limit.window, limit.max_count, limit.max_amount, limit.scope, limit.actions),
+                         (3600, 5, 30000, "customer", ("withdraw",)))
+        self.assertEqual(Limit.parse("90:count=1").window, 90)
+        for bad in ("day", "day:speed=1", "day:count=1:scope=bank"):
+            with self.assertRaises(ValueError):
+                Limit.parse(bad)
+
+if __name__ == "__main__":
+    unittest.main()
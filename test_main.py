@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import sys
+import unittest
+import main
+from testbase import BankTestCase
+
+class TestScriptedMode(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp.name)
+
+    def test_script_runs_without_prompts(self):
+        script = self.path("day.txt")
+        out = self.path("results.jsonl")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("# a teller day\n")
+            f.write("add_customer Ali User pw yes\n")
+            f.write('{"op": "add_customer", "first_name": "Bea", "password": "pw", "open_checking": true}\n')
+            f.write("deposit checking 5\n")
+            f.write("login 10001 pw\n")
+            f.write("deposit checking 40\n")
+            f.write("transfer checking - 15 target_customer_id=10002 target_account_type=checking\n")
+            f.write("withdraw checking\n")
+            f.write("history\n")
+            f.write("query 1 actions=deposit,withdraw external=no\n")
+            f.write("accounts\n")
+            f.write("logout\n")
+        code = main.main(["--bank", self.bank_path, "--script", script, "--output", out])
+        with open(out, encoding="utf-8") as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(code, 1)
+        self.assertEqual([r["line"] for r in results], list(range(2, 13)))
+        self.assertEqual(results[1]["customer_id"], 10002)
+        self.assertEqual(results[2]["error"], "login required")
+        self.assertEqual(results[4]["message"], "Deposit successful. New balance: 40.00")
+        self.assertEqual(results[5]["message"], "Transfer successful. checking=25.00")
+        self.assertEqual(results[6]["error"], "missing argument: amount")
+        self.assertEqual([r["action"] for r in results[7]["rows"]], ["deposit", "transfer"])
+        self.assertEqual(([r["amount"] for r in results[8]["rows"]], results[8]["cursor"] is not None), (["40.00"], True))
+        self.assertEqual(results[9]["accounts"]["checking"]["balance"], "25.00")
+
+    def test_parse_command_forms(self):
+        self.assertIsNone(main.parse_command("   "))
+        self.assertEqual(main.parse_command('login 10001 "my pw"'),
+                         {"op": "login", "customer_id": "10001", "password": "my pw"})
+        with self.assertRaises(ValueError):
+            main.parse_command("logout now")
+        out = io.StringIO()
+        self.assertEqual(main.run_script(None, ["bogus"], out)["errors"], 1)
+
+    def test_unexpected_errors_fail_only_their_step(self):
+        bs = self.open_bank()
+        bs.add_customer("Ali", "User", "pw", open_checking=True)
+        def broken(*args, **kw):
+            raise RuntimeError("disk on fire")
+        bs.add_customer = broken
+        out = io.StringIO()
+        stats = main.run_script(bs, ["add_customer Bea User pw", "login 10001 pw", "accounts"], out)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(results[0]["error"], "internal error: disk on fire")
+        self.assertEqual(results[2]["accounts"]["checking"]["balance"], "0.00")
+
+    def test_login_menu_keeps_its_numbers(self):
+        bs = self.open_bank()
+        c = bs.add_customer("Ali", "User", "pw", open_checking=True)
+        bs.login(c.id, "pw")
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin, sys.stdout = io.StringIO("9\n\n7\n\n"), io.StringIO()
+        try:
+            main.login_menu(bs)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        self.assertIn("7. Logout\n8. Exit\n9. Summary", printed)
+        self.assertIn("--- Summary ---", printed)
+        self.assertIsNone(bs.current)
+
+if __name__ == "__main__":
+    unittest.main()
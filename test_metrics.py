@@ -0,0 +1,48 @@
+import json
+import os
+import unittest
+from metrics import JsonlSink, MemorySink, Metrics, PrometheusSink
+from testbase import BankTestCase
+
+class TestMetrics(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = MemorySink()
+        self.jsonl_path = self.path("ops.jsonl")
+        self.prom_path = self.path("bank.prom")
+        self.metrics = Metrics(self.memory, JsonlSink(self.jsonl_path), PrometheusSink(self.prom_path))
+        self.bs = self.open_bank(metrics=self.metrics)
+        c = self.bs.add_customer("Mona", "User", "pw", open_checking=True)
+        self.bs.login(c.id, "pw")
+
+    def test_phases_and_rejections_reach_every_sink(self):
+        self.bs.deposit("checking", 50)
+        self.bs.withdraw("checking", 500)
+        self.bs.withdraw("checking", -1)
+        self.bs.transfer("checking", "savings", 5)
+        self.metrics.close()
+        snap = self.memory.snapshot()
+        self.assertEqual(snap["ops"], {"deposit:ok": 1, "transfer:rejected": 1, "withdraw:rejected": 2})
+        self.assertEqual(snap["rejections"], {"transfer:error: no savings account": 1,
+                                              "withdraw:amount must be positive": 1, "withdraw:over limit": 1})
+        for phase in ("lock", "validate", "rules", "journal", "log", "total"):
+            self.assertIn(f"deposit:{phase}", snap["timings"])
+        with open(self.jsonl_path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([e["op"] for e in events], ["deposit", "withdraw", "withdraw", "transfer"])
+        self.assertEqual(events[1]["reason"], "over limit")
+        with open(self.prom_path, encoding="utf-8") as f:
+            text = f.read()
+        self.assertIn('bank_rejections_total{op="withdraw",reason="over limit"} 1', text)
+        self.assertIn('bank_op_seconds_count{op="deposit",phase="total"} 1', text)
+
+    def test_profile_toggle(self):
+        self.metrics.start_profile()
+        self.bs.deposit("checking", 5)
+        report = self.metrics.stop_profile(self.path("session.prof"))
+        self.assertIn("_deposit", report)
+        self.assertTrue(os.path.exists(self.path("session.prof")))
+        self.assertEqual(self.metrics.stop_profile(), "")
+
+if __name__ == "__main__":
+    unittest.main()
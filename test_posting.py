@@ -0,0 +1,72 @@
+import os
+import unittest
+from banking import Money
+import posting
+from testbase import BankTestCase
+
+class TestPosting(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        bs = self.open_bank()
+        self.saver = bs.add_customer("Saver", "User", "pw", open_checking=True, open_savings=True)
+        self.low = bs.add_customer("Low", "User", "pw", open_checking=True)
+        self.over = bs.add_customer("Over", "User", "pw", open_checking=True)
+        self.frozen = bs.add_customer("Frozen", "User", "pw", open_checking=True, open_savings=True)
+        self.saver.savings.balance = Money.parse("1000.05")
+        self.saver.checking.balance = Money.of(500)
+        self.low.checking.balance = Money.of(20)
+        self.over.checking.balance = Money.of(-10)
+        self.over.checking.overdraft_count = 2
+        self.frozen.savings.balance = Money.of(100)
+        self.frozen.checking.balance = Money.of(-50)
+        bs._deactivate_customer_accounts(self.frozen)
+        bs.save_all_to_csv()
+        bs.close()
+
+    def post(self, bs, **kw):
+        return posting.post_period(bs, interest_rate="0.01", maintenance_fee="5", minimum_balance="100",
+                                   overdraft_fee="35", **kw)
+
+    def test_posting_applies_rules_and_persists(self):
+        bs = self.open_bank()
+        stats = self.post(bs, use_numpy=False)
+        self.assertEqual(stats["engine"], "python")
+        self.assertEqual((stats["interest_count"], stats["interest_total"]), (1, "10.00"))
+        self.assertEqual((stats["fee_count"], stats["fee_total"]), (2, "40.00"))
+        self.assertEqual(stats["deactivated"], 1)
+        again = self.open_bank()
+        self.assertEqual(again.get_customer(self.saver.id).savings.balance, Money.parse("1010.05"))
+        self.assertEqual(again.get_customer(self.saver.id).checking.balance, Money.of(500))
+        self.assertEqual(again.get_customer(self.low.id).checking.balance, Money.of(15))
+        over = again.get_customer(self.over.id)
+        self.assertEqual((over.checking.balance, over.checking.overdraft_count, over.checking.active),
+                         (Money.of(-45), 3, False))
+        frozen = again.get_customer(self.frozen.id)
+        self.assertEqual((frozen.savings.balance, frozen.checking.balance), (Money.of(100), Money.of(-50)))
+        self.assertEqual([r["action"] for r in again.log.list_for(self.low.id, limit=0)], ["fee"])
+        self.assertEqual(os.path.getsize(again.store.journal_path), 0)
+        self.assertEqual(again.bank_summary(), bs.bank_summary())
+
+    def test_engines_agree(self):
+        cols = {"chk_cents": [-1, 0, 99, 100, -500], "chk_active": [True, True, True, True, False],
+                "chk_odc": [0, 0, 0, 0, 3], "sav_cents": [1, 50, 149, 0, 10 ** 9],
+                "sav_active": [True, True, True, False, True], "sav_odc": [2, 0, 0, 0, 0]}
+        rule = {"num": 1, "den": 100, "maintenance_fee": 500, "minimum_balance": 10000, "overdraft_fee": 3500}
+        interest, fees, over, deactivate, touched = posting.compute_python(cols, rule)
+        self.assertEqual(interest, [0, 1, 1, 0, 10 ** 7])
+        self.assertEqual(fees, [3500, 500, 500, 500, 0])
+        self.assertEqual(deactivate, [True, False, False, False, False])
+        if posting.np is not None:
+            self.assertEqual(posting.compute_numpy(cols, rule), (interest, fees, over, deactivate, touched))
+
+    def test_lazy_bank_posts_through_the_store(self):
+        bs = self.open_bank(lazy=True, cache_size=1)
+        saver = bs.get_customer(self.saver.id)
+        self.post(bs)
+        self.assertEqual(saver.savings.balance, Money.parse("1010.05"))
+        self.assertEqual(bs.get_customer(self.low.id).checking.balance, Money.of(15))
+        again = self.open_bank()
+        self.assertEqual(again.get_customer(self.over.id).checking.balance, Money.of(-45))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import bulk
+import reconcile
+from banking import Money, TransactionLog
+from testbase import BankTestCase
+
+class TestReconcile(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        bs = self.open_bank(log=TransactionLog(self.log_path, segment_bytes=1500))
+        self.ann = bs.add_customer("Ann", "Lee", "pw", open_checking=True, open_savings=True)
+        self.bob = bs.add_customer("Bob", "Lee", "pw", open_checking=True)
+        self.ann.checking.balance = Money.of(300)
+        bs.save_all_to_csv()
+        ann = bs.open_session(self.ann.id, "pw")
+        bob = bs.open_session(self.bob.id, "pw")
+        for _ in range(6):
+            ann.deposit("checking", "20")
+            ann.transfer("checking", "savings", "15")
+            ann.transfer("checking", None, "10", self.bob.id, "checking")
+            bob.withdraw("checking", "4")
+            ann.withdraw("savings", "500")
+        bs.close()
+
+    def run_recon(self, **kw):
+        return reconcile.reconcile(self.bank_path, self.log_path, **kw)
+
+    def issues(self, report):
+        return {k: report[k] for k in ("gaps", "mismatches", "orphans", "invalid") if report[k]}
+
+    def test_consistent_bank_passes_serially_and_in_parallel(self):
+        log = TransactionLog(self.log_path)
+        self.assertTrue(log.segments)
+        log.close()
+        serial = self.run_recon(workers=1)
+        self.assertEqual(self.issues(serial), {})
+        self.assertEqual((serial["rows"], serial["accounts"]), (30, 3))
+        parallel = self.run_recon(workers=2)
+        self.assertGreater(parallel["ranges"], serial["ranges"])
+        self.assertEqual({k: v for k, v in parallel.items() if k not in ("ranges", "seconds")},
+                         {k: v for k, v in serial.items() if k not in ("ranges", "seconds")})
+
+    def test_rows_without_balances_are_skipped(self):
+        log = TransactionLog(self.log_path)
+        log.append(customer_id=self.ann.id, action="login", status="ok", message="Login success")
+        log.append(customer_id=self.bob.id, action="add_customer", status="ok", message="Customer created")
+        log.append(customer_id=self.ann.id, action="logout", status="ok", message="Logged out")
+        log.append(customer_id=self.ann.id, action="deposit", account_type="checking", amount="1.00",
+                   prev_balance="", new_balance="oops", status="ok")
+        log.close()
+        report = self.run_recon(workers=1)
+        self.assertEqual((report["rows"], report["skipped"]), (34, 3))
+        self.assertEqual([r["action"] for r in report["invalid"]], ["deposit"])
+        self.assertEqual((report["gaps"], report["mismatches"], report["orphans"]), ([], [], []))
+
+    def test_unlogged_changes_show_as_mismatches_gaps_and_orphans(self):
+        bs = self.open_bank()
+        bs.get_customer(self.bob.id).checking.balance += Money.of(1)
+        bs.get_customer(self.ann.id).savings.balance = Money.of(7)
+        bs.save_all_to_csv()
+        bs.open_session(self.bob.id, "pw").deposit("checking", "5")
+        bs.log.append(customer_id=99999, action="deposit", account_type="checking", amount="1.00",
+                      fee="0.00", prev_balance="0.00", new_balance="1.00", status="ok", message="")
+        bs.close()
+        report = self.run_recon(workers=2)
+        self.assertEqual([(g["customer_id"], g["expected"], g["found"]) for g in report["gaps"]],
+                         [(str(self.bob.id), "36.00", "37.00")])
+        self.assertEqual(report["mismatches"], [{"customer_id": str(self.ann.id), "account_type": "savings",
+                                                 "log": "90.00", "snapshot": "7.00"}])
+        self.assertEqual(report["orphans"], [{"customer_id": "99999", "account_type": "checking", "rows": 1,
+                                              "reason": "no such customer"}])
+        self.assertEqual(bulk.main(["--bank", self.bank_path, "--log", self.log_path, "reconcile"]), 1)
+
+    def test_incremental_runs_read_only_new_rows(self):
+        first = self.run_recon(workers=1)
+        bs = self.open_bank()
+        bs.open_session(self.ann.id, "pw").deposit("savings", "1")
+        bs.close()
+        second = self.run_recon(workers=1, incremental=True)
+        self.assertEqual((second["start"], second["rows"], second["accounts"]), (first["position"], 1, 3))
+        self.assertEqual(self.issues(second), {})
+
+        # Accounts without new rows are still held to the watermark balance.
+        bs = self.open_bank()
+        bs.get_customer(self.bob.id).checking.balance = Money.of(0)
+        bs.save_all_to_csv()
+        bs.close()
+        third = self.run_recon(workers=1, incremental=True)
+        self.assertEqual(third["rows"], 0)
+        self.assertEqual([m["customer_id"] for m in third["mismatches"]], [str(self.bob.id)])
+        self.assertEqual(bulk.main(["--bank", self.bank_path, "--log", self.log_path, "reconcile",
+                                    "--workers", "1", "--incremental"]), 1)
+
+    def test_watermark_is_dropped_when_the_log_is_rewritten(self):
+        self.bank_path = self.path("old.csv")
+        self.log_path = self.path("old.log")
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            f.write("#txlog,2\n" + ",".join(TransactionLog.FIELDS[:10]) + "\n")
+        bs = self.open_bank()
+        a = bs.add_customer("Ann", "Lee", "pw", open_checking=True)
+        session = bs.open_session(a.id, "pw")
+        session.deposit("checking", "5")
+        session.deposit("checking", "7")
+        bs.log.flush()
+        self.run_recon(workers=1)
+        session.deposit("checking", "1", idempotency_key="k")
+        bs.close()
+        migrated = self.run_recon(workers=1, incremental=True)
+        self.assertEqual((migrated["start"], migrated["rows"]), (0, 3))
+        self.assertEqual(self.issues(migrated), {})
+
+        log = TransactionLog(self.log_path)
+        log.rotate()
+        log.close()
+        rotated = self.run_recon(workers=1, incremental=True)
+        self.assertEqual((rotated["start"], rotated["rows"]), (0, 3))
+        self.assertEqual(self.issues(rotated), {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import socket
+import threading
+import unittest
+from banking import Money
+from server import BankTCPServer
+from testbase import BankTestCase
+
+class TestServer(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = self.open_bank()
+        self.a = self.bank.add_customer("Amal", "User", "a", open_checking=True)
+        self.b = self.bank.add_customer("Badr", "User", "b", open_checking=True)
+        self.a.checking.balance = Money.of(1000)
+        self.b.checking.balance = Money.of(1000)
+        self.server = BankTCPServer(("127.0.0.1", 0), self.bank)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self):
+        sock = socket.create_connection(self.server.server_address)
+        self.addCleanup(sock.close)
+        f = sock.makefile("rw", encoding="utf-8")
+        self.addCleanup(f.close)
+        def call(**request):
+            f.write(json.dumps(request) + "\n")
+            f.flush()
+            return json.loads(f.readline())
+        return call
+
+    def test_session_protocol(self):
+        call = self.connect()
+        self.assertFalse(call(op="deposit", account_type="checking", amount="5")["ok"])
+        self.assertTrue(call(op="login", customer_id=self.a.id, password="a")["ok"])
+        reply = call(op="deposit", account_type="checking", amount="5")
+        self.assertEqual(reply["message"], "Deposit successful. New balance: 1005.00")
+        self.assertEqual(call(op="accounts")["accounts"]["checking"]["balance"], "1005.00")
+        self.assertEqual(call(op="history")["rows"][-1]["action"], "deposit")
+        self.assertIsNone(self.bank.current)
+
+    def test_bad_requests_get_a_reply(self):
+        call = self.connect()
+        reply = call(op="add_customer", first_name="Dana", password=1234, open_checking=True)
+        self.assertTrue(reply["ok"])
+        self.assertTrue(call(op="login", customer_id=reply["customer_id"], password=1234)["ok"])
+        self.assertFalse(call(op="login", customer_id=self.a.id, password=1234)["ok"])
+        def broken(customer):
+            raise RuntimeError("token store down")
+        self.bank.issue_token = broken
+        self.assertEqual(call(op="login", customer_id=self.a.id, password="a"),
+                         {"ok": False, "error": "internal error: token store down"})
+        # The failed login leaves the earlier session in place.
+        self.assertEqual(call(op="deposit", account_type="checking", amount="5")["message"],
+                         "Deposit successful. New balance: 5.00")
+        self.assertEqual(self.a.checking.balance, Money.of(1000))
+        fresh = self.connect()
+        fresh(op="login", customer_id=self.a.id, password="a")
+        self.assertEqual(fresh(op="accounts"), {"ok": False, "error": "login required"})
+
+    def test_concurrent_cross_transfers_conserve_money(self):
+        def worker(src, dst, password):
+            call = self.connect()
+            call(op="login", customer_id=src.id, password=password)
+            for _ in range(20):
+                call(op="transfer", from_type="checking", amount="1",
+                     target_customer_id=dst.id, target_account_type="checking")
+        threads = [threading.Thread(target=worker, args=args)
+                   for args in [(self.a, self.b, "a"), (self.b, self.a, "b")] * 2]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertFalse(any(t.is_alive() for t in threads))
+        self.assertEqual(self.a.checking.balance + self.b.checking.balance, Money.of(2000))
+        self.assertEqual(len(self.bank.log.list_for(self.a.id, limit=0)), 40)
+
+if __name__ == "__main__":
+    unittest.main()
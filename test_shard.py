@@ -0,0 +1,69 @@
+import unittest
+from banking import BankSystem, Money
+from shard import ShardRouter
+from testbase import BankTestCase
+
+class TestShardedLedger(BankTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = ShardRouter(self.tmp.name, shards=2)
+
+    def tearDown(self):
+        self.router.close()
+
+    def shard_bank(self, shard):
+        bs = BankSystem(self.path(f"shard{shard}/bank.csv"), log_path=self.path(f"shard{shard}/transactions.csv"))
+        bs.load_from_csv()
+        self.addCleanup(bs.close)
+        return bs
+
+    def test_worker_survives_unexpected_errors(self):
+        a = self.router.add_customer("Amal", "User", "a", open_checking=True)
+        shard = self.router.shard_for(a.id)
+        with self.assertRaisesRegex(ValueError, "internal error"):
+            self.router.call(shard, "add_customer", 99999, "Bad", "", 1234, False, False)
+        session = self.router.open_session(a.id, "a")
+        self.assertEqual(session.deposit("checking", "5"), "Deposit successful. New balance: 5.00")
+
+    def test_routing_and_cross_shard_transfer(self):
+        a = self.router.add_customer("Amal", "User", "a", open_checking=True, open_savings=True)
+        b = self.router.add_customer("Badr", "User", "b", open_checking=True)
+        self.assertEqual((a.id, b.id), (10001, 10002))
+        self.assertNotEqual(self.router.shard_for(a.id), self.router.shard_for(b.id))
+        sa = self.router.open_session(a.id, "a")
+        self.assertEqual(sa.deposit("checking", "100"), "Deposit successful. New balance: 100.00")
+        self.assertEqual(sa.transfer("checking", None, "30", b.id, "checking"), "Transfer successful. checking=70.00")
+        self.assertIn("Insufficient funds", sa.transfer("checking", None, "90", b.id, "checking"))
+        self.assertEqual(sa.transfer("checking", None, "5", b.id, "savings"), "Error: No savings account.")
+        self.assertIn("Transfer successful", sa.transfer("checking", "savings", "10"))
+        sb = self.router.resume_session(self.router.open_session(b.id, "b").customer.token)
+        self.assertEqual(sb.accounts()["checking"]["balance"], "30.00")
+        self.assertEqual(sb.recent_transactions()[-1]["action"], "transfer_in")
+        self.assertEqual(sa.accounts()["checking"]["balance"], "60.00")
+        with self.assertRaises(PermissionError):
+            self.router.open_session(a.id, "wrong")
+
+    def test_recovery_settles_prepared_transfers(self):
+        a = self.router.add_customer("Amal", "User", "a", open_checking=True)
+        b = self.router.add_customer("Badr", "User", "b", open_checking=True)
+        sa = self.router.open_session(a.id, "a")
+        sa.deposit("checking", "100")
+        src, dst = self.router.shard_for(a.id), self.router.shard_for(b.id)
+        for txid, decided in (("t-commit", True), ("t-abort", False)):
+            self.assertEqual(self.router.call(src, "prepare_debit", txid, sa.customer.handle, "checking", "20.00",
+                                              b.id, "checking", dst)[0], txid == "t-commit")
+            self.router.call(dst, "prepare_credit", txid, b.id, "checking", "20.00", a.id)
+            if decided:
+                self.router._decide(txid)
+        self.assertIn("in progress", sa.withdraw("checking", "5"))
+        self.router.close()
+        self.router = ShardRouter(self.tmp.name, shards=2)
+        self.assertEqual(self.shard_bank(src).get_customer(a.id).checking.balance, Money.of(80))
+        self.assertEqual(self.shard_bank(dst).get_customer(b.id).checking.balance, Money.of(20))
+        self.assertEqual([self.router.call(s, "in_doubt") for s in range(2)], [[], []])
+        self.assertEqual(self.router.add_customer("New", "User", "n").id, 10003)
+        with self.assertRaises(ValueError):
+            ShardRouter(self.tmp.name, shards=3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from banking import BankSystem, Money
+from sqlite_store import SqliteStore
+from testbase import BankTestCase
+import bulk
+
+class TestSqliteStore(BankTestCase):
+    bank_name = "bank.db"
+
+    def test_operations_commit_rows_and_log_together(self):
+        bs = self.open_bank()
+        self.assertIsInstance(bs.store, SqliteStore)
+        a = bs.add_customer("Hind", "User", "a", open_checking=True, open_savings=True)
+        b = bs.add_customer("Zaid", "User", "b", open_checking=True)
+        bs.login(a.id, "a")
+        bs.deposit("checking", "90.25")
+        bs.withdraw("checking", 500)
+        bs.transfer("checking", None, 10, target_customer_id=b.id, target_account_type="checking")
+        again = self.open_bank()
+        self.assertEqual(again.get_customer(a.id).checking.balance, Money.parse("80.25"))
+        self.assertEqual(again.get_customer(b.id).checking.balance, Money.of(10))
+        self.assertIsNone(again.get_customer(b.id).savings)
+        rows = again.log.list_for(a.id, limit=2)
+        self.assertEqual([r["message"] for r in rows], ["over limit", f"External transfer to {b.id}"])
+        self.assertEqual(rows[1]["new_balance"], "80.25")
+
+    def test_convert_from_csv(self):
+        bank_path = self.path("bank.csv")
+        log_path = self.log_path
+        bs = BankSystem(bank_path, log_path=log_path, kdf_iterations=1000)
+        c = bs.add_customer("Noor", "User", "n", open_savings=True)
+        bs.login(c.id, "n")
+        bs.deposit("savings", 7)
+        bs.close()
+        bulk.main(["--bank", bank_path, "--log", log_path, "convert-sqlite", self.bank_path])
+        again = self.open_bank()
+        self.assertEqual(again.get_customer(c.id).savings.balance, Money.of(7))
+        self.assertIs(again.login(c.id, "n"), again.get_customer(c.id))
+        self.assertEqual(again.log.list_for(c.id)[0]["action"], "deposit")
+
+    def test_import_keeps_existing_customers(self):
+        bs = self.open_bank()
+        old = [bs.add_customer(f"C{i}", "User", "p", open_checking=True).id for i in range(3)]
+        bs.close()
+        src = self.path("new.csv")
+        with open(src, "w", encoding="utf-8") as f:
+            f.write("first_name,last_name,password,checking_balance\nNew,User,q,5\n")
+        bulk.main(["--bank", self.bank_path, "--progress", "0", "--kdf-iterations", "1000", "import-customers", src])
+        again = self.open_bank()
+        self.assertEqual([c.id for c in again.customers], old + [old[-1] + 1])
+        self.assertEqual(again.get_customer(old[-1] + 1).checking.balance, Money.of(5))
+
+    def test_lazy_checkpoint_keeps_customers(self):
+        bs = self.open_bank(lazy=True)
+        a = bs.add_customer("Hind", "User", "a", open_checking=True)
+        b = bs.add_customer("Zaid", "User", "b", open_savings=True)
+        bs.open_session(a.id, "a").deposit("checking", "12")
+        bs.save_all_to_csv()
+        self.assertEqual(bs.store.ids(), [a.id, b.id])
+        again = self.open_bank(lazy=True)
+        self.assertEqual(again.get_customer(a.id).checking.balance, Money.of(12))
+
+    def test_query_pushes_filters_into_sql(self):
+        bs = self.open_bank()
+        for i in range(12):
+            account = "checking->10002:savings" if i % 4 == 0 else "checking" if i % 2 else "savings"
+            bs.log.append(ts=f"2025-09-{i + 1:02d}T10:00:00", customer_id=10001,
+                          action="transfer" if i % 4 == 0 else "deposit", account_type=account,
+                          amount=f"{i}.00", status="ok")
+        rows, cursor = bs.log.query(10001, page_size=5)
+        self.assertEqual([r["amount"] for r in rows], ["11.00", "10.00", "9.00", "8.00", "7.00"])
+        rows, cursor = bs.log.query(10001, cursor=cursor, page_size=5, account_type="checking")
+        self.assertEqual([r["amount"] for r in rows], ["5.00", "4.00", "3.00", "1.00", "0.00"])
+        self.assertEqual(bs.log.query(10001, cursor=cursor, page_size=5, account_type="checking"), ([], None))
+        rows, cursor = bs.log.query(10001, actions="transfer", external=True, since="2025-09-02", max_amount="8")
+        self.assertEqual(([r["amount"] for r in rows], cursor), (["8.00", "4.00"], None))
+        rows, _ = bs.log.query(10001, actions=["deposit"], external=False, until="2025-09-04", min_amount=2)
+        self.assertEqual([r["amount"] for r in rows], ["2.00"])
+
+if __name__ == "__main__":
+    unittest.main()
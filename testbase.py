@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+from banking import BankSystem
+
+class BankTestCase(unittest.TestCase):
+    # Each test gets a temporary directory holding bank_name and
+    # transactions.csv; open_bank() opens a loaded BankSystem on them with a
+    # cheap KDF and closes it when the test ends.
+    bank_name = "bank.csv"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.bank_path = self.path(self.bank_name)
+        self.log_path = self.path("transactions.csv")
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def open_bank(self, **kw):
+        kw.setdefault("kdf_iterations", 1000)
+        bs = BankSystem(self.bank_path, log_path=self.log_path, **kw)
+        bs.load_from_csv()
+        self.addCleanup(bs.close)
+        return bs